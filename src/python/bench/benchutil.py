@@ -0,0 +1,134 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# helpers shared by the benchmarks in this directory
+#
+
+import os
+import sys
+import imp
+import time
+import numpy
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+CAPTURE_DIR = os.path.join(BENCH_DIR, 'captures')
+
+# the modules imported by server-fetch.py live next to it
+if PYTHON_DIR not in sys.path:
+    sys.path.insert(0, PYTHON_DIR)
+
+
+def load_server_fetch():
+    # server-fetch.py is a script and its name is not a valid module name
+    return imp.load_source('server_fetch', os.path.join(PYTHON_DIR, 'server-fetch.py'))
+
+
+def load_fake_bmc():
+    return imp.load_source('fake_bmc', os.path.join(PYTHON_DIR, 'fake-bmc.py'))
+
+
+def load_server_stress():
+    return imp.load_source('server_stress', os.path.join(PYTHON_DIR, 'server-stress.py'))
+
+
+def fake_bmc_wrapper(*options):
+    # the --query-wrapper running the fake BMC with this interpreter
+    return ' '.join([sys.executable, os.path.join(PYTHON_DIR, 'fake-bmc.py')] + list(options))
+
+
+def discover_snmp(srv, nr_cpus=None):
+    # set up the snmp sensors of a server of server-fetch.py as if it walked the fake BMC
+    fake = load_fake_bmc()
+    if nr_cpus is None:
+        nr_cpus = fake._NR_FB_CPUS
+    srv._learn_walk_sizes([fake._snmpwalk(mib, nr_cpus) for mib in srv._snmp_mibs()])
+
+
+def read_capture(name):
+    return open(os.path.join(CAPTURE_DIR, name)).read()
+
+
+def best_rate(func, nr_items, min_time=0.5, repeat=3):
+    #
+    # items per second of the fastest of repeat runs, func is called as many
+    # times as needed to run for at least min_time seconds
+    #
+    best = None
+    for r in range(repeat):
+        n = 0
+        start = time.time()
+        while True:
+            func()
+            n += 1
+            elapsed = time.time() - start
+            if elapsed >= min_time:
+                break
+        rate = n*nr_items/elapsed
+        if best is None or rate > best:
+            best = rate
+    return best
+
+
+def sensor_keys(srv):
+    # the keys of the sensors of a server of server-fetch.py, source by source
+    return [key for source in ('ipmi', 'snmp') for key, query, index, scale in srv._sensors[source]]
+
+
+def store_sample(srv, t, values):
+    # values has a value per sensor in the order of sensor_keys()
+    start = 0
+    for source in ('ipmi', 'snmp'):
+        n = len(srv._sensors[source])
+        srv._store(source, t, numpy.array(values[start:start + n], dtype=float))
+        start = start + n
+
+
+class message_sink(object):
+    #
+    # stands in for relay_server with a single viewer, keeps what would be
+    # sent to it. The tasks of the relay thread are run by run_tasks()
+    #
+    def __init__(self):
+        self.header = ''
+        self.messages = []
+        self.tasks = []
+        self.channels = [None]
+
+    def set_header(self, header, channel=None):
+        self.header = header
+
+    def set_subscribe(self, subscribe):
+        pass
+
+    def run_in_thread(self, func, *args):
+        self.tasks.append((func, args))
+
+    def run_tasks(self):
+        for func, args in self.tasks:
+            func(*args)
+        self.tasks = []
+
+    def get_channels(self):
+        return self.channels
+
+    def publish(self, msg, key=None, channel=None):
+        if not self.messages:
+            msg = self.header + (msg if key is None else key)
+        self.messages.append(msg)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Memory held while collecting a long run, keeping its samples for the .npz
+# and .mat files or writing them to a run directory of column_store.py. Then
+# the time of reading one sensor of the run back, the whole trace and its
+# last minutes, in a fresh interpreter each. All the reads must give the same
+# samples.
+#
+
+import os
+import sys
+import zlib
+import shutil
+import argparse
+import subprocess
+import numpy
+import benchutil
+import column_store
+
+_NR_SAMPLES = 200000
+_KEY = 'x_3'
+_TAIL = 600                 # samples read from the end of the trace
+
+
+def fill(fetch, nr_samples, directory):
+    # the same samples in a server keeping them and in a run directory
+    servers = []
+    for i in range(2):
+        srv = fetch.server(True, True, fetch._COLLECT_FB, None)
+        benchutil.discover_snmp(srv)
+        servers.append(srv)
+    store = column_store.column_store(directory)
+    servers[1].set_column_store(store, False)
+    keys = benchutil.sensor_keys(servers[0])
+    rng = numpy.random.RandomState(0)
+    for i in range(nr_samples):
+        values = rng.uniform(0, 100, len(keys)).round()
+        for srv in servers:
+            benchutil.store_sample(srv, float(i), values)
+        if i % 1000 == 999:
+            store.flush()
+    store.close()
+    return servers
+
+
+def block_bytes(srv):
+    return sum(block._data.nbytes + block._time.nbytes for block, keys in srv._blocks)
+
+
+# a fresh interpreter per load, it has read nothing of the run before
+_CHILD = """
+import sys, time, zlib, numpy, scipy.io
+sys.path.insert(0, %r)
+import column_store
+start = time.time()
+values = numpy.array(%s)
+elapsed = time.time() - start
+print elapsed, len(values), zlib.crc32(values.tostring())
+"""
+
+
+def run_child(load):
+    out = subprocess.check_output([sys.executable, '-c', _CHILD % (benchutil.PYTHON_DIR, load)])
+    elapsed, n, crc = out.split()
+    return float(elapsed), (int(n), int(crc))
+
+
+def checksum(values):
+    return len(values), zlib.crc32(numpy.ascontiguousarray(values).tostring())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--samples", dest="samples", default=_NR_SAMPLES, help="Nr. of samples of the run (default %d)" % _NR_SAMPLES)
+    parser.add_argument("-d","--dir", dest="dir", default='/tmp', help="Directory of the files written (default /tmp)")
+    args = parser.parse_args()
+    nr_samples = int(args.samples)
+
+    fetch = benchutil.load_server_fetch()
+    directory = os.path.join(args.dir, 'column-load-run')
+    npz_path = os.path.join(args.dir, 'column-load.npz')
+    mat_path = os.path.join(args.dir, 'column-load.mat')
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    srv, stored = fill(fetch, nr_samples, directory)
+    srv.save_numpy(npz_path)
+    srv.save_matlab(mat_path, 1., 1.)
+    print "fb: %d samples, %d traces, blocks in memory kept %.1f MB  run dir %.3f MB" % \
+        (nr_samples, len(srv._traces), block_bytes(srv)/1e6, block_bytes(stored)/1e6)
+
+    expected = srv.get_trace(_KEY).get_time_with_data()[1]
+    loads = (
+        ('npz', 'numpy.load(%r)[%r]' % (npz_path, _KEY), expected),
+        ('mat', 'scipy.io.loadmat(%r, variable_names=[%r])[%r][0]' % (mat_path, _KEY, _KEY), expected),
+        ('run dir', 'column_store.load_trace(%r, %r)[1]' % (directory, _KEY), expected),
+        ('npz tail', 'numpy.load(%r)[%r][-%d:]' % (npz_path, _KEY, _TAIL), expected[-_TAIL:]),
+        ('run dir tail', 'column_store.open_trace(%r, %r)[0][1][-%d:]' % (directory, _KEY, _TAIL), expected[-_TAIL:]),
+    )
+    for name, load, values in loads:
+        elapsed, loaded = run_child(load)
+        assert loaded == checksum(values), name
+        print "  %-13s %8.4f s" % (name, elapsed)
+
+    shutil.rmtree(directory)
+    os.remove(npz_path)
+    os.remove(mat_path)
+    sys.exit(0)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Cost of resampling a run onto a uniform grid with trace_grid.py and of
+# writing the matrix to a .mat file. The traces are sampled at 1 Hz with a
+# jittered clock and a few missed samples, half of them from a source started
+# 50 [ms] after the other, and the loads of the sockets of a server-stress.py
+# run are added. The first and the last grid times are checked against a
+# lookup of each grid time on its own.
+#
+
+import os
+import sys
+import time
+import argparse
+import numpy
+import benchutil
+import mat_writer
+import trace_grid
+
+_NR_TRACES = 60
+_DURATION = 86400           # [sec]
+_MAX_GAP = 2.               # [sec]
+_NR_CHECKED = 500           # grid times at each end
+
+
+def make_run(nr_traces, duration, seed=0):
+    rng = numpy.random.RandomState(seed)
+    parts = []
+    for i in range(nr_traces):
+        t = 1.5e9 + 0.05*(i % 2) + numpy.arange(duration) + rng.normal(0, 2e-3, duration)
+        kept = rng.uniform(size=duration) > 0.01
+        parts.append((t[kept], numpy.round(rng.normal(40, 5, kept.sum()))))
+    stress = benchutil.load_server_stress()
+    loads = []
+    for sockid in range(2):
+        load = stress.sysid_cpu_load(sockid, duration/5, 5.)
+        loads.append((load.get_name(), 1.5e9 + 0.3 + load.get_time(), load.get_values().astype(float), 5.))
+    return parts, loads
+
+
+def lookup(t, v, g, method):
+    # the value of a trace at one grid time
+    i = t.searchsorted(g, 'right') - 1
+    if g < t[0] or g > t[-1]:
+        return numpy.nan
+    if method == 'zoh':
+        if i < 0 or g - t[i] > _MAX_GAP:
+            return numpy.nan
+        return v[i]
+    if method == 'linear':
+        if i < 0 or i + 1 >= len(t):
+            return v[i] if i >= 0 and t[i] == g else numpy.nan
+        if t[i] != g and t[i + 1] - t[i] > _MAX_GAP:
+            return numpy.nan
+        return v[i] + (g - t[i])/(t[i + 1] - t[i])*(v[i + 1] - v[i])
+    near = numpy.argmin(numpy.abs(t - g))
+    return v[near] if abs(t[near] - g) <= _MAX_GAP else numpy.nan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--traces", dest="traces", default=_NR_TRACES, help="Nr. of traces (default %d)" % _NR_TRACES)
+    parser.add_argument("-d","--duration", dest="duration", default=_DURATION, help="Length of the run [sec] (default %d, a day)" % _DURATION)
+    parser.add_argument("-T","--period", dest="period", default=1., help="Period of the grid [sec] (default 1)")
+    parser.add_argument("-o","--outfile", dest="outfile", default='/tmp/grid-export.mat', help="The .mat file written (default /tmp/grid-export.mat)")
+    args = parser.parse_args()
+
+    parts, loads = make_run(int(args.traces), int(args.duration))
+    grid = trace_grid.uniform_grid(1.5e9, max(t[-1] for t, v in parts), float(args.period))
+    nr_samples = sum(len(t) for t, v in parts)
+    print "%d traces, %d samples, grid of %d x %d" % (len(parts), nr_samples, len(grid), len(parts) + len(loads))
+
+    begin = time.time()
+    load_matrix = trace_grid.align_loads(loads, grid)
+    print "  loads    %6.3f [sec]" % (time.time() - begin)
+    for method in trace_grid.METHODS:
+        begin = time.time()
+        matrix = trace_grid.resample(parts, grid, method, _MAX_GAP)
+        elapsed = time.time() - begin
+        for k in range(_NR_CHECKED) + range(max(len(grid) - _NR_CHECKED, 0), len(grid)):
+            for j, (t, v) in enumerate(parts):
+                expected = lookup(t, v, grid[k], method)
+                assert numpy.isnan(expected) == numpy.isnan(matrix[k, j]), (method, k, j)
+                assert numpy.isnan(expected) or abs(expected - matrix[k, j]) < 1e-9, (method, k, j)
+        print "  %-8s %6.3f [sec]  %5.1f M values/s  %5.1f M samples/s" % \
+            (method, elapsed, matrix.size/elapsed/1e6, nr_samples/elapsed/1e6)
+
+    matrix = numpy.concatenate([matrix.T, load_matrix.T]).T
+    begin = time.time()
+    mat_writer.save_variables(args.outfile, [('grid', matrix), ('grid_t', grid - grid[0])])
+    print "  .mat     %6.3f [sec]  %.1f MB" % (time.time() - begin, os.path.getsize(args.outfile)/1e6)
+    os.remove(args.outfile)
+    sys.exit(0)
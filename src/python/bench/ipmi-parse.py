@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Lines/s of the ipmi output parser of server-fetch.py against the regex chain
+# it replaced, on the captures in bench/captures (or the given files).
+#
+
+import sys
+import re
+import argparse
+import benchutil
+
+#
+# the regex chains tried in order on every line by the former fetch_use_ipmi()
+#
+_LEGACY_DELL = [
+    ("Fan1\sRPM,(\d+),RPM,ok", 'u_1'),
+    ("Fan2\sRPM,(\d+),RPM,ok", 'u_2'),
+    ("Fan3\sRPM,(\d+),RPM,ok", 'u_3'),
+    ("Fan4\sRPM,(\d+),RPM,ok", 'u_4'),
+    ("Fan5\sRPM,(\d+),RPM,ok", 'u_5'),
+    ("Fan6\sRPM,(\d+),RPM,ok", 'u_6'),
+    ("Inlet\sTemp,(\d+),degrees\sC,ok", 'x_i'),
+    ("CPU\sUsage,(\d+),percent,ok", 'l_c'),
+    ("IO\sUsage,(\d+),percent,ok", 'l_io'),
+    ("MEM\sUsage,(\d+),percent,ok", 'l_m'),
+    ("SYS\sUsage,(\d+),percent,ok", 'l_s'),
+    ("Exhaust\sTemp,(\d+),degrees\sC,ok", 'x_o'),
+    ("Temp,(\d+),degrees\sC,ok", None),
+    ("Current\s1,([\d\.]+),Amps,ok", 'c_1'),
+    ("Current\s2,([\d\.]+),Amps,ok", 'c_2'),
+    ("Voltage\s1,(\d+),Volts,ok", 'v_1'),
+    ("Voltage\s2,(\d+),Volts,ok", 'v_2'),
+    ("Pwr\sConsumption,(\d+),Watts,ok", 'p_c'),
+]
+
+_LEGACY_FB = [
+    ("\d+,Outlet\sCntr\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_o'),
+    ("\d+,Inlet\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_i'),
+    ("\d+,P0\sTherm\sMargin\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_s0'),
+    ("\d+,P1\sTherm\sMargin\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_s1'),
+    ("\d+,P0\sDIMM\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_d0'),
+    ("\d+,P1\sDIMM\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", 'x_d1'),
+    ("\d+,SYS_Fan0\s*,([+-]?\d+(?:\.\d+)?),RPM,'OK'", 'u_1'),
+    ("\d+,SYS_Fan1\s*,([+-]?\d+(?:\.\d+)?),RPM,'OK'", 'u_2'),
+]
+
+
+def legacy_parse(samples, chain, meas_t, ipmi_all):
+    # samples maps a trace name to its list of (time, value)
+    count = 0
+    for l in ipmi_all.splitlines():
+        for pattern, name in chain:
+            match = re.match(pattern, l)
+            if match is None:
+                continue
+            if name is None:
+                # the unnamed Temp rows, CPU 1 then CPU 2
+                if count == 0:
+                    name = 'x_s0'
+                    count += 1
+                else:
+                    name = 'x_s1'
+            samples.setdefault(name, []).append((meas_t, float(match.group(1))))
+            break
+
+
+def run(fetch, kind, capture, min_time):
+    server_choice = {'dell': fetch._COLLECT_DELL, 'fb': fetch._COLLECT_FB}[kind]
+    chain = {'dell': _LEGACY_DELL, 'fb': _LEGACY_FB}[kind]
+    nr_lines = len(capture.splitlines())
+
+    # both parsers must fill the same traces with the same values
+    legacy = {}
+    legacy_parse(legacy, chain, 0., capture)
+    table = fetch.server(True, False, server_choice, None)
+    table.parse_ipmi(0., capture)
+    legacy_values = dict((name, samples[-1][1]) for name, samples in legacy.items())
+    # a key also read by snmp has a trace per source
+    ipmi_names = set(key for key, query, index, scale in table._sensors['ipmi'])
+    table_values = dict((name, table.get_trace(name if name in ipmi_names else name + '_ipmi').get_last_value())
+                        for name in legacy_values)
+    if legacy_values != table_values:
+        print "%s: the parsers disagree" % kind
+        print "  regex chain : %s" % legacy_values
+        print "  table       : %s" % table_values
+        sys.exit(1)
+
+    #
+    # fresh servers so that the traces stay small while benchmarking
+    #
+    samples = {}
+    srv = [fetch.server(True, False, server_choice, None)]
+    def legacy_once():
+        legacy_parse(samples, chain, 0., capture)
+    def table_once():
+        srv[0].parse_ipmi(0., capture)
+
+    before = benchutil.best_rate(legacy_once, nr_lines, min_time)
+    srv[0] = fetch.server(True, False, server_choice, None)
+    after = benchutil.best_rate(table_once, nr_lines, min_time)
+    print "%-5s %3d lines  regex chain %10.0f lines/s  dispatch table %10.0f lines/s  (x%.1f)" % \
+        (kind, nr_lines, before, after, after/before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dell", dest="dell", default=None, help="Output of ipmitool -c sdr list full (default the bundled capture)")
+    parser.add_argument("--fb", dest="fb", default=None, help="Output of ipmi-sensors --comma-separated-output (default the bundled capture)")
+    parser.add_argument("-t","--min-time", dest="min_time", default=0.5, help="Seconds per measurement (default 0.5)")
+    args = parser.parse_args()
+
+    fetch = benchutil.load_server_fetch()
+    for kind, path, default in (('dell', args.dell, 'dell-sdr-list-full.csv'), ('fb', args.fb, 'fb-ipmi-sensors.csv')):
+        if path is None:
+            capture = benchutil.read_capture(default)
+        else:
+            capture = open(path).read()
+        run(fetch, kind, capture, float(args.min_time))
+    sys.exit(0)
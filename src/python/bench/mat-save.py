@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Peak memory and time of saving a long run of a server to a .mat file, with
+# scipy.io.savemat of a dict of all the variables (the former save_matlab)
+# and with the streaming writer. The traces are views of the samples, a
+# trace per source for the dell sensors read by both. Then the cost of
+# saving it periodically while it grows, appending to the same file. The
+# files are checked to hold the same variables.
+#
+
+import os
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+import numpy
+import scipy.io
+import benchutil
+
+_NR_SAMPLES = 200000
+
+
+def new_server(fetch, kind):
+    srv = fetch.server(True, True, fetch._SERVER_KINDS[kind], None)
+    benchutil.discover_snmp(srv)
+    return srv
+
+
+def fill(fetch, kind, nr_samples):
+    srv = new_server(fetch, kind)
+    keys = benchutil.sensor_keys(srv)
+    rng = numpy.random.RandomState(0)
+    for i in range(nr_samples):
+        benchutil.store_sample(srv, float(i), rng.uniform(0, 100, len(keys)).round())
+    return srv
+
+
+def legacy_save(srv, path):
+    variables = {'timelength': 1., 'period': 1.}
+    variables.update(srv._get_trace_variables())
+    scipy.io.savemat(path, variables)
+
+
+def measure(save, srv, path, results):
+    # in a child, its peak rss starts from what it shares with the parent
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    save(srv, path)
+    elapsed = time.time() - start
+    results.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, elapsed))
+
+
+def run_child(save, srv, path):
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=measure, args=(save, srv, path, results))
+    child.start()
+    peak, elapsed = results.get()
+    child.join()
+    return peak, elapsed
+
+
+def periodic(fetch, kind, nr_samples, nr_saves, path):
+    # the run grows and is saved nr_saves times, appending to the file
+    srv = new_server(fetch, kind)
+    keys = benchutil.sensor_keys(srv)
+    rng = numpy.random.RandomState(0)
+    if os.path.exists(path):
+        os.remove(path)
+    times = []
+    for i in range(nr_samples):
+        benchutil.store_sample(srv, float(i), rng.uniform(0, 100, len(keys)).round())
+        if (i + 1) % (nr_samples//nr_saves) == 0:
+            start = time.time()
+            srv.save_matlab(path, 1., 1., True)
+            times.append(time.time() - start)
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--samples", dest="samples", default=_NR_SAMPLES, help="Nr. of samples of the run (default %d)" % _NR_SAMPLES)
+    parser.add_argument("-k","--kind", dest="kind", default='dell', choices=('dell', 'fb'), help="Server model (default dell)")
+    parser.add_argument("-d","--dir", dest="dir", default='/tmp', help="Directory of the files written (default /tmp)")
+    args = parser.parse_args()
+    nr_samples = int(args.samples)
+
+    fetch = benchutil.load_server_fetch()
+    srv = fill(fetch, args.kind, nr_samples)
+    size = sum(block._data[:, :len(block)].nbytes + 8*len(block) for block, keys in srv._blocks)
+    print "%s: %d samples, %d traces, %.1f MB of samples" % (args.kind, nr_samples, len(srv._traces), size/1e6)
+
+    paths = [os.path.join(args.dir, 'mat-save-%s.mat' % name) for name in ('savemat', 'stream')]
+    for name, save, path in (('savemat dict', legacy_save, paths[0]),
+                             ('streaming', lambda s, p: s.save_matlab(p, 1., 1.), paths[1])):
+        peak, elapsed = run_child(save, srv, path)
+        print "  %-13s peak +%7.1f MB  %6.2f s" % (name, peak/1e3, elapsed)
+    a = scipy.io.loadmat(paths[0])
+    b = scipy.io.loadmat(paths[1])
+    for key in a:
+        if not key.startswith('__'):
+            assert numpy.array_equal(a[key], b[key]), key
+
+    nr_saves = 20
+    path = os.path.join(args.dir, 'mat-save-append.mat')
+    times = periodic(fetch, args.kind, nr_samples, nr_saves, path)
+    print "  %d appending saves  first %.3f s  median %.3f s  last %.3f s  max %.3f s" % \
+        (nr_saves, times[0], numpy.median(times), times[-1], max(times))
+    c = scipy.io.loadmat(path)
+    for key in a:
+        if not key.startswith('__'):
+            assert numpy.array_equal(a[key], c[key]), key
+    for path in paths + [path]:
+        os.remove(path)
+    sys.exit(0)
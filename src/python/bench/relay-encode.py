@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Cost of building the relay message of a sample and its size on the wire, for
+# each --relay-format of server-fetch.py. The binary formats are encoded in
+# the relay thread, their cost is split in the part left in the sampling loop
+# and the part done by the relay thread. The sensors are filled with values
+# of a random walk where each column changes with the given probability, the
+# cpu loads change at every sample. The decoded samples are checked against
+# the values that were sent.
+#
+
+import sys
+import argparse
+import numpy
+import benchutil
+import relay_protocol
+import sample_scheduler
+
+_NR_SAMPLES = 2000
+
+
+def fill(srv, nr_samples, p_change, seed=0):
+    # the values of all the sensors, a row per sample
+    rng = numpy.random.RandomState(seed)
+    keys = benchutil.sensor_keys(srv)
+    values = numpy.round(rng.uniform(0, 100, len(keys)))
+    loads = numpy.array([key.startswith('l_') for key in keys])
+    rows = []
+    for i in range(nr_samples):
+        changed = loads | (rng.uniform(size=len(keys)) < p_change)
+        values = numpy.where(changed, numpy.round(values + rng.normal(0, 3, len(keys))), values)
+        rows.append(values.tolist())
+    return keys, rows
+
+
+def run(fetch, relay_format, nr_samples, p_change):
+    sink = benchutil.message_sink()
+    srv = fetch.server(True, True, fetch._COLLECT_FB, sink, relay_format=relay_format)
+    benchutil.discover_snmp(srv)
+    srv._s_t_ipmi.save_start_time(1.5e9)
+    srv._s_t_snmp.save_start_time(1.5e9)
+    keys, rows = fill(srv, nr_samples, p_change)
+
+    latency = sample_scheduler.latency_histogram()
+    thread = sample_scheduler.latency_histogram()
+    for i, row in enumerate(rows):
+        t = float(i)
+        benchutil.store_sample(srv, t, row)
+        start = sample_scheduler.monotonic()
+        srv._relay_data(t, t, t)
+        latency.record(sample_scheduler.monotonic() - start)
+        start = sample_scheduler.monotonic()
+        sink.run_tasks()
+        thread.record(sample_scheduler.monotonic() - start)
+
+    nr_bytes = sum(len(msg) for msg in sink.messages[1:])
+    if relay_format != 'text':
+        decoder = relay_protocol.frame_decoder()
+        samples = []
+        for msg in sink.messages:
+            samples.extend(decoder.feed(msg))
+        names = [trace.get_name() for trace in srv._relay_traces]
+        assert decoder.get_names() == names
+        assert len(samples) == len(rows)
+        # the relay sends the traces in the order of get_traces
+        columns = [keys.index(name) for name in names]
+        for (times, values), row in zip(samples, rows):
+            assert numpy.array_equal(values, numpy.array(row, dtype=numpy.float32)[columns])
+    return latency, thread, nr_bytes/float(len(rows) - 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--samples", dest="samples", default=_NR_SAMPLES, help="Nr. of samples (default %d)" % _NR_SAMPLES)
+    parser.add_argument("-p","--change", dest="change", default=0.2, help="Probability that a column other than the loads changes (default 0.2)")
+    args = parser.parse_args()
+
+    fetch = benchutil.load_server_fetch()
+    print "%d samples of a fb server, %.0f%% of the other columns change" % (int(args.samples), 100*float(args.change))
+    for relay_format in fetch._RELAY_FORMATS:
+        latency, thread, size = run(fetch, relay_format, int(args.samples), float(args.change))
+        print "  %-6s  sampling p50 %6.1f us  p99 %6.1f us  relay thread p50 %6.1f us  %6.0f bytes/sample" % \
+            (relay_format, 1e6*latency.get_percentile(50), 1e6*latency.get_percentile(99),
+             1e6*thread.get_percentile(50), size)
+    sys.exit(0)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Load test of the relay: many local viewers, some of which never read, while
+# samples are published at a fixed rate. Reports how long publish() blocks
+# the sampling loop and what each kind of viewer received. The socket buffers
+# of the stuck viewers are shrunk on both ends so that their queues overflow,
+# the run checks that their oldest messages are dropped and that publish()
+# costs about the same as with no stuck viewer.
+#
+
+import os
+import sys
+import time
+import socket
+import select
+import argparse
+import multiprocessing
+import benchutil
+import relay_server
+import sample_scheduler
+
+_MSG_SIZE = 1500    # about the size of a server-fetch.py relay message
+_BUFFER_SIZE = 4096 # [bytes] socket buffers of the stuck viewers
+_MAX_SLOWDOWN = 2.  # of the p50 of publish() with stuck viewers
+
+
+def viewers(port, nr_clients, nr_stuck, duration, stuck_ports, results):
+    #
+    # a child process with all the viewers, the stuck ones connect but never
+    # read, the others read everything as fast as they can
+    #
+    socks = []
+    for i in range(nr_clients):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if i < nr_stuck:
+            # before connecting, the window is then small from the start
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _BUFFER_SIZE)
+        s.connect(('localhost', port))
+        socks.append(s)
+    stuck_ports.put([s.getsockname()[1] for s in socks[:nr_stuck]])
+    readers = socks[nr_stuck:]
+    received = dict((s.fileno(), 0) for s in readers)
+    end = time.time() + duration
+    while time.time() < end:
+        readable, w, x = select.select(readers, [], [], 0.1)
+        for s in readable:
+            received[s.fileno()] += len(s.recv(65536))
+    results.put(sorted(received.values()))
+    for s in socks:
+        s.close()
+
+
+def run(nr_clients, nr_stuck, rate, duration):
+    relay = relay_server.relay_server('localhost', 0)
+    relay.start()
+
+    results = multiprocessing.Queue()
+    stuck_ports = multiprocessing.Queue()
+    child = multiprocessing.Process(target=viewers, args=(relay.get_port(), nr_clients, nr_stuck, duration + 2.,
+                                                          stuck_ports, results))
+    child.start()
+    ports = set(stuck_ports.get())
+    while relay.get_stats()['clients'] < nr_clients:
+        time.sleep(0.01)
+    # the kernel would otherwise buffer the messages of a stuck viewer
+    stuck = [client for client in relay._clients.values() if client.addr[1] in ports]
+    for client in stuck:
+        client.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _BUFFER_SIZE)
+
+    msg = 'x'*(_MSG_SIZE - 1) + '\n'
+    latency = sample_scheduler.latency_histogram()
+    scheduler = sample_scheduler.deadline_scheduler(1./rate)
+    nr_msgs = int(rate*duration)
+    for i in range(nr_msgs):
+        scheduler.wait()
+        start = sample_scheduler.monotonic()
+        relay.publish(msg)
+        latency.record(sample_scheduler.monotonic() - start)
+        scheduler.done()
+
+    received = results.get()
+    child.join()
+    stats = relay.get_stats()
+    relay.close()
+
+    delivered = [n/float(_MSG_SIZE*nr_msgs) for n in received]
+    print "%d viewers (%d stuck), %d messages of %d bytes at %.0f Hz" % \
+        (nr_clients, nr_stuck, nr_msgs, _MSG_SIZE, rate)
+    print "  publish()   p50 %.1f us  p99 %.1f us  max %.1f us" % \
+        (1e6*latency.get_percentile(50), 1e6*latency.get_percentile(99), 1e6*latency.get_max())
+    print "  sampling    %.1f%% late ticks" % (100*scheduler.get_late_ratio())
+    print "  readers     %.1f%% .. %.1f%% of the messages delivered" % (100*min(delivered), 100*max(delivered))
+    print "  stuck       %d messages dropped, %d .. %d per viewer" % \
+        (stats['dropped'], min([c.nr_dropped for c in stuck] or [0]), max([c.nr_dropped for c in stuck] or [0]))
+    # each stuck viewer drops all but what its queue and socket buffers hold
+    for client in stuck:
+        assert client.nr_dropped > 0 and client.nr_dropped + client.nr_sent + len(client.queue) + 1 >= nr_msgs, \
+            (client.addr, client.nr_dropped, client.nr_sent)
+    return latency.get_percentile(50)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--clients", dest="clients", default=100, help="Nr. of viewers (default 100)")
+    parser.add_argument("-s","--stuck", dest="stuck", default=10, help="Nr. of viewers that never read (default 10)")
+    parser.add_argument("-r","--rate", dest="rate", default=100, help="Published samples per second (default 100)")
+    parser.add_argument("-t","--duration", dest="duration", default=5, help="Seconds of publishing (default 5)")
+    args = parser.parse_args()
+
+    baseline = run(int(args.clients), 0, float(args.rate), float(args.duration))
+    p50 = run(int(args.clients), int(args.stuck), float(args.rate), float(args.duration))
+    assert p50 <= _MAX_SLOWDOWN*baseline, (p50, baseline)
+    sys.exit(0)
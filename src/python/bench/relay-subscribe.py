@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Cost on the sampling loop and on the relay thread of the binary relay of
+# server-fetch.py with and without viewers that subscribe to a few sensors at
+# a low rate. Each viewer has its own subscription, the first one gets the
+# mean of the fans every second and its frames are checked against the samples
+# that were sent.
+#
+
+import sys
+import time
+import socket
+import select
+import argparse
+import multiprocessing
+import numpy
+import benchutil
+import relay_server
+import relay_protocol
+import sample_scheduler
+
+_PATTERNS = ['u_*', 'x_*', 'l_*', 'x_i,x_o', 'x_d*,x_s*'] + ['l_%d' % i for i in range(32)]
+_RATES = [1., 0.2, 0.5, 2.]
+
+
+def requests(nr_viewers):
+    # all different, the first one is checked
+    result = [relay_protocol.subscription_request(['u_*'], 1., 'mean')]
+    i = 1
+    while len(result) < nr_viewers:
+        patterns = _PATTERNS[i % len(_PATTERNS)].split(',')
+        rate = _RATES[(i//len(_PATTERNS)) % len(_RATES)]
+        aggregate = relay_protocol._AGGREGATES[i % len(relay_protocol._AGGREGATES)]
+        request = relay_protocol.subscription_request(patterns, rate, aggregate)
+        if request not in result:
+            result.append(request)
+        i += 1
+    return result
+
+
+def viewers(port, lines, duration, results):
+    socks = []
+    for line in lines:
+        s = socket.create_connection(('localhost', port))
+        s.sendall(line)
+        socks.append(s)
+    decoders = dict((s, relay_protocol.frame_decoder()) for s in socks)
+    first = []
+    end = time.time() + duration
+    while time.time() < end:
+        readable, w, x = select.select(socks, [], [], 0.1)
+        for s in readable:
+            samples = decoders[s].feed(s.recv(65536))
+            if s is socks[0]:
+                first.extend((times['t_ipmi'], values.tolist()) for times, values in samples)
+    results.put((first, decoders[socks[0]].get_names(), sum(d.nr_frames for d in decoders.values())))
+    for s in socks:
+        s.close()
+
+
+def run(fetch, nr_viewers, rate, duration):
+    relay = relay_server.relay_server('localhost', 0)
+    relay.start()
+    srv = fetch.server(True, True, fetch._COLLECT_FB, relay, relay_format='delta')
+    benchutil.discover_snmp(srv)
+    names = [trace.get_name() for trace in srv._relay_traces]
+    keys = benchutil.sensor_keys(srv)
+
+    # the work of the relay thread for each sample
+    thread = sample_scheduler.latency_histogram()
+    publisher = srv._relay_publisher
+    publish = publisher._publish
+    def timed_publish(*args):
+        start = sample_scheduler.monotonic()
+        publish(*args)
+        thread.record(sample_scheduler.monotonic() - start)
+    publisher._publish = timed_publish
+
+    lines = requests(nr_viewers)
+    results = multiprocessing.Queue()
+    child = None
+    if nr_viewers:
+        child = multiprocessing.Process(target=viewers, args=(relay.get_port(), lines, duration + 2., results))
+        child.start()
+        while relay.get_stats()['channels'] < nr_viewers:
+            time.sleep(0.01)
+
+    rng = numpy.random.RandomState(0)
+    latency = sample_scheduler.latency_histogram()
+    scheduler = sample_scheduler.deadline_scheduler(1./rate)
+    rows = []
+    for i in range(int(rate*duration)):
+        scheduler.wait()
+        t = i/rate
+        row = rng.uniform(0, 100, len(keys)).round()
+        benchutil.store_sample(srv, t, row)
+        rows.append(row)
+        start = sample_scheduler.monotonic()
+        srv._relay_data(t, t, t)
+        latency.record(sample_scheduler.monotonic() - start)
+        scheduler.done()
+
+    nr_frames = 0
+    if child is not None:
+        first, first_names, nr_frames = results.get()
+        child.join()
+        # the mean of the fans over each window of 1 [sec]
+        rows = numpy.array(rows)
+        columns = [keys.index(name) for name in first_names]
+        assert first_names == sorted(n for n in names if n.startswith('u_'))
+        assert len(first) >= int(duration) - 1
+        start = 0
+        for t, values in first:
+            end = int(round(t*rate)) + 1
+            expected = rows[start:end, columns].mean(axis=0)
+            assert numpy.allclose(values, expected.astype(numpy.float32)), (t, values, expected)
+            start = end
+    relay.close()
+
+    print "%3d viewers  sampling p50 %5.1f us  p99 %6.1f us  relay thread p50 %5.1f us  p99 %6.1f us  %.1f%% late  %d frames" % \
+        (nr_viewers, 1e6*latency.get_percentile(50), 1e6*latency.get_percentile(99), 1e6*thread.get_percentile(50),
+         1e6*thread.get_percentile(99), 100*scheduler.get_late_ratio(), nr_frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--viewers", dest="viewers", default=200, help="Nr. of subscribed viewers (default 200)")
+    parser.add_argument("-r","--rate", dest="rate", default=100, help="Samples per second (default 100)")
+    parser.add_argument("-t","--duration", dest="duration", default=5, help="Seconds of sampling (default 5)")
+    args = parser.parse_args()
+
+    fetch = benchutil.load_server_fetch()
+    for nr_viewers in (0, int(args.viewers)):
+        run(fetch, nr_viewers, float(args.rate), float(args.duration))
+    sys.exit(0)
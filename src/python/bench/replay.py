@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Throughput of replaying a day of captured queries at 1 Hz through
+# server-fetch.py as fast as possible: the parsers and the samples kept in
+# memory, then also written to a run directory or to a coded recording. The
+# capture is written from the outputs of the fake BMC, as --capture would.
+#
+
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import numpy
+import benchutil
+import query_capture
+import column_store
+import trace_recorder
+import trace_codec
+
+_NR_TICKS = 86400
+
+
+def write_capture(fetch, kind, nr_ticks, path):
+    fake = benchutil.load_fake_bmc()
+    random.seed(0)
+    rng = numpy.random.RandomState(0)
+    srv = fetch.server(True, True, fetch._SERVER_KINDS[kind], None)
+    meta = srv.get_capture_meta()
+    meta.update({'period': 1., 'timelength': nr_ticks/3600.})
+    capture = query_capture.query_capture(path, meta)
+    mibs = srv._snmp_mibs()
+    sized = [mib for mib in mibs if mib in srv._sized_mibs]
+    capture.add_walks(sized, ['\n'.join(fake._snmpwalk(mib)) + '\n' for mib in sized])
+    capture.meta({'start_time': {'s_t_ipmi': 1e9, 's_t_snmp': 1e9 + 0.05}})
+    for i in range(nr_ticks):
+        capture.tick(float(i))
+        if kind == 'dell':
+            ipmi = fake._dell_sdr_list_full()
+        else:
+            ipmi = fake._fb_ipmi_sensors()
+        capture.add_ipmi(i + rng.normal(0, 2e-3), '\n'.join(ipmi) + '\n')
+        capture.add_snmp(i + 0.05 + rng.normal(0, 2e-3), mibs, ['\n'.join(fake._snmpwalk(mib)) + '\n' for mib in mibs])
+    capture.close()
+
+
+def replay(fetch, path, setup=None):
+    # setup(srv) adds the storage and returns what closes it
+    meta = query_capture.read_meta(path)
+    srv = fetch.server(meta['use_ipmi'], meta['use_snmp'], fetch._SERVER_KINDS[meta['server']], None,
+                       use_ipmi_session=meta['ipmi_session'])
+    srv.discover_snmp(path)
+    close = None
+    if setup is not None:
+        close = setup(srv)
+    start = time.time()
+    nr_ticks = srv.replay(path, meta['period'], 0)
+    if close is not None:
+        close()
+    return srv, nr_ticks, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--ticks", dest="ticks", default=_NR_TICKS, help="Nr. of 1 Hz ticks captured (default %d, a day)" % _NR_TICKS)
+    parser.add_argument("-d","--dir", dest="dir", default='/tmp', help="Directory of the files written (default /tmp)")
+    args = parser.parse_args()
+    nr_ticks = int(args.ticks)
+
+    fetch = benchutil.load_server_fetch()
+    for kind in ('fb', 'dell'):
+        path = os.path.join(args.dir, 'replay-%s.cap' % kind)
+        write_capture(fetch, kind, nr_ticks, path)
+        print "%s: %d ticks captured, %.1f MB" % (kind, nr_ticks, os.path.getsize(path)/1e6)
+
+        run_dir = os.path.join(args.dir, 'replay-%s-run' % kind)
+        prefix = os.path.join(args.dir, 'replay-%s-rec' % kind)
+        def with_run_dir(srv):
+            if os.path.exists(run_dir):
+                shutil.rmtree(run_dir)
+            store = column_store.column_store(run_dir)
+            srv.set_column_store(store, False)
+            return store.close
+        def with_recording(srv):
+            for segment in trace_recorder._segment_paths(prefix):
+                os.remove(segment)
+            recorder = trace_recorder.trace_recorder(prefix, codec=trace_codec.trace_codec('zlib'))
+            srv.set_recorder(recorder, False)
+            return recorder.close
+
+        servers = []
+        for name, setup in (('in memory', None), ('run dir', with_run_dir), ('coded recording', with_recording)):
+            srv, replayed, elapsed = replay(fetch, path, setup)
+            assert replayed == nr_ticks
+            servers.append(srv)
+            if len(servers) == 1:
+                nr_samples = sum(len(trace) for trace in srv._traces.values())
+                print "  %d samples of %d traces" % (nr_samples, len(srv._traces))
+            print "  %-16s %6.2f [sec]  %8.0f ticks/s  %9.0f samples/s  (x%.0f real time)" % \
+                (name, elapsed, nr_ticks/elapsed, nr_samples/elapsed, nr_ticks/elapsed)
+
+        # the replayed samples are the same whatever they were written to
+        traces, meta, complete = trace_recorder.read_recording(prefix)
+        for key in sorted(servers[0]._traces):
+            t, v = servers[0].get_trace(key).get_time_with_data()
+            assert numpy.array_equal(column_store.load_trace(run_dir, key)[1], v), key
+            assert numpy.array_equal(traces[key][1], v), key
+
+        shutil.rmtree(run_dir)
+        for segment in trace_recorder._segment_paths(prefix):
+            os.remove(segment)
+        os.remove(path)
+    sys.exit(0)
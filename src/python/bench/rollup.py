@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Cost of the rollups of trace_rollup.py over a long run: a block of sensors
+# sampled at 1 Hz for a week with a few missed samples, added a row at a
+# time as server-fetch.py does. Prints the cost of a row, the memory of the
+# rollup against the rows it replaces and the time of queries zooming out
+# from the last minutes to the whole week. The buckets of the whole run are
+# checked against the samples of the first column.
+#
+
+import sys
+import time
+import argparse
+import numpy
+import benchutil
+import trace_rollup
+
+_NR_COLUMNS = 16
+_DURATION = 7*86400         # [sec]
+_CHUNK = 3600               # rows generated at once
+_POINTS = 1000
+_NR_QUERIES = 200
+
+
+def feed(rollup, nr_columns, duration, seed=0):
+    # the times and the first column of the rows added
+    rng = numpy.random.RandomState(seed)
+    all_times = numpy.empty(duration)
+    first = numpy.empty(duration)
+    for start in range(0, duration, _CHUNK):
+        n = min(_CHUNK, duration - start)
+        times = start + numpy.arange(n) + rng.normal(0, 2e-3, n)
+        values = numpy.round(rng.normal(40, 5, (n, nr_columns)))
+        values[rng.uniform(size=(n, nr_columns)) < 0.01] = numpy.nan
+        all_times[start:start + n] = times
+        first[start:start + n] = values[:, 0]
+        for t, row in zip(times.tolist(), values):
+            rollup.add(t, row)
+    return all_times, first
+
+
+def check_run(rollup, all_times, first):
+    # the buckets of the whole run against the samples
+    resolution, times, mins, maxs, means, counts = rollup.query(0, None, None, _POINTS)
+    assert resolution > 0
+    keys = numpy.floor(all_times/resolution)*resolution
+    present = first == first
+    for k, t in enumerate(times):
+        bucket = first[(keys == t) & present]
+        assert counts[k] == len(bucket), (t, counts[k], len(bucket))
+        assert mins[k] == bucket.min() and maxs[k] == bucket.max() and abs(means[k] - bucket.mean()) < 1e-9, t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--columns", dest="columns", default=_NR_COLUMNS, help="Nr. of sensors of the block (default %d)" % _NR_COLUMNS)
+    parser.add_argument("-d","--duration", dest="duration", default=_DURATION, help="Length of the run [sec] (default %d, a week)" % _DURATION)
+    args = parser.parse_args()
+    nr_columns = int(args.columns)
+    duration = int(args.duration)
+
+    rollup = trace_rollup.trace_rollup(nr_columns)
+    begin = time.time()
+    all_times, first = feed(rollup, nr_columns, duration)
+    elapsed = time.time() - begin
+    print "%d rows of %d columns added in %.1f [sec], %.1f [us] per row" % \
+        (duration, nr_columns, elapsed, elapsed/duration*1e6)
+    print "rollup %.1f MB, the rows %.1f MB" % (rollup.get_nbytes()/1e6, duration*(nr_columns + 1)*8/1e6)
+
+    end = float(duration)
+    for window in (600, 3600, 86400, 2*86400, duration, None):
+        t0 = end - window if window is not None else None
+        begin = time.time()
+        for i in range(_NR_QUERIES):
+            resolution, times, mins, maxs, means, counts = rollup.query(i % nr_columns, t0, end, _POINTS)
+        elapsed = (time.time() - begin)/_NR_QUERIES
+        print "  last %-8s %5d points at %5g [sec]  %6.3f [ms]" % \
+            ('%d s' % window if window is not None else 'run', len(times), resolution, elapsed*1e3)
+    check_run(rollup, all_times, first)
+    sys.exit(0)
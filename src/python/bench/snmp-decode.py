@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Values/s of the snmp walk decoding of server-fetch.py against the line by
+# line parsing it replaced, on the walks of fake FB nodes with more and more
+# cpus. The sensors are discovered from the first walk of each node. The
+# decoding alone is timed against a float() per line, then the whole
+# parse_snmp against the former parsing. parse_snmp also stores the sample in
+# its block, which costs about the same whatever the nr. of values: on a 32
+# cpu node it is slower than the former parsing even though its decoding is
+# faster, it wins from 64 cpus.
+#
+
+import sys
+import argparse
+import benchutil
+
+_NR_CPUS = (32, 64, 128, 256)
+
+
+def legacy_parse(samples, meas_t, outputs, scales):
+    #
+    # the former fetch_snmp(), a float() and an append per line. It had the
+    # counts of the 32 cpu node hard-coded, here they are the nr. of lines
+    #
+    for out, scale, walk_samples in zip(outputs, scales, samples):
+        lines = out.splitlines()
+        for i in range(len(lines)):
+            walk_samples.setdefault(i, []).append((meas_t, float(lines[i])/scale))
+
+
+def run(fetch, nr_cpus, min_time):
+    fake = benchutil.load_fake_bmc()
+    srv = fetch.server(False, True, fetch._COLLECT_FB, None)
+    mibs = srv._snmp_mibs()
+    outputs = ['\n'.join(fake._snmpwalk(mib, nr_cpus)) + '\n' for mib in mibs]
+    scales = [1000., 1.]
+    nr_values = sum(len(out.splitlines()) for out in outputs)
+
+    # both must give the same sensors with the same values
+    legacy = [{}, {}]
+    legacy_parse(legacy, 0., outputs, scales)
+    srv.parse_snmp(0., None, outputs)
+    for prefix, walk_samples in zip(('x_%d', 'l_%d'), legacy):
+        for i, values in walk_samples.items():
+            if srv.get_trace(prefix % i).get_last_value() != values[-1][1]:
+                print "%d cpus: the parsers disagree on %s" % (nr_cpus, prefix % i)
+                sys.exit(1)
+    if len(srv._sensors['snmp']) != nr_values:
+        print "%d cpus: %d sensors discovered for %d values" % (nr_cpus, len(srv._sensors['snmp']), nr_values)
+        sys.exit(1)
+
+    #
+    # fresh state so that the traces stay small while benchmarking
+    #
+    legacy = [{}, {}]
+    def legacy_once():
+        legacy_parse(legacy, 0., outputs, scales)
+    def vector_once():
+        srv.parse_snmp(0., None, outputs)
+    def lines_decode():
+        for out in outputs:
+            [float(line) for line in out.splitlines()]
+    def vector_decode():
+        for out in outputs:
+            fetch._decode_walk(out)
+
+    decode_before = benchutil.best_rate(lines_decode, nr_values, min_time)
+    decode_after = benchutil.best_rate(vector_decode, nr_values, min_time)
+    before = benchutil.best_rate(legacy_once, nr_values, min_time)
+    srv = fetch.server(False, True, fetch._COLLECT_FB, None)
+    benchutil.discover_snmp(srv, nr_cpus)
+    after = benchutil.best_rate(vector_once, nr_values, min_time)
+    print "%3d cpus %4d values  decode per line %10.0f vector %10.0f values/s (x%.1f)  " \
+        "parse per line %10.0f parse_snmp %10.0f values/s (x%.1f)" % \
+        (nr_cpus, nr_values, decode_before, decode_after, decode_after/decode_before, before, after, after/before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t","--min-time", dest="min_time", default=0.5, help="Seconds per measurement (default 0.5)")
+    args = parser.parse_args()
+
+    fetch = benchutil.load_server_fetch()
+    for nr_cpus in _NR_CPUS:
+        run(fetch, nr_cpus, float(args.min_time))
+    sys.exit(0)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# The collection pipeline of server-fetch.py and server-stress.py against
+# the fake BMC, written as JSON so that versions can be compared:
+#
+#   parse     samples/s of parse_ipmi and parse_snmp on the fake outputs
+#   collect   the latency of the ticks of collect() querying the fake BMC,
+#             and the cost of timing their phases
+#   relay     the cost of _relay_data in the sampling loop per relay format
+#   save      time of save_numpy/save_matlab of 1 h, 24 h and 7 d of a FB
+#             server at 1 Hz, and the rss the save adds at its peak
+#   prbs      lookups/s of pseudo_random_binary_signal.get_value_at_time
+#
+# Each result is a dict of metrics, a metric name ends with its unit: _per_s
+# is better when higher, _s, _us, _mb and _bytes when lower. With --compare
+# the metrics are printed as ratios to an earlier result file, the ones worse
+# by more than --threshold are flagged.
+#
+
+import os
+import sys
+import imp
+import json
+import time
+import socket
+import random
+import datetime
+import argparse
+import resource
+import subprocess
+import multiprocessing
+import numpy
+import benchutil
+import sample_scheduler
+
+_SECTIONS = ('parse', 'collect', 'relay', 'save', 'prbs')
+_DATASETS = (('1h', 3600), ('24h', 86400), ('7d', 7*86400))
+_COLLECT_TICKS = 20
+_COLLECT_PERIOD = 0.5       # [sec]
+_RELAY_SAMPLES = 2000
+_PRBS_SIZES = (3600, 604800)
+_THRESHOLD = 0.1
+
+
+def _percentiles(histogram, unit, scale):
+    metrics = {'count': histogram.get_count()}
+    for p in (50, 90, 99):
+        metrics['p%d_%s' % (p, unit)] = scale*histogram.get_percentile(p)
+    metrics['max_%s' % unit] = scale*histogram.get_max()
+    metrics['mean_%s' % unit] = scale*histogram.get_mean()
+    return metrics
+
+
+def bench_parse(fetch, results, min_time):
+    fake = benchutil.load_fake_bmc()
+    random.seed(0)
+    for kind in ('dell', 'fb'):
+        srv = fetch.server(True, True, fetch._SERVER_KINDS[kind], None)
+        benchutil.discover_snmp(srv)
+        if kind == 'dell':
+            ipmi = '\n'.join(fake._dell_sdr_list_full()) + '\n'
+        else:
+            ipmi = '\n'.join(fake._fb_ipmi_sensors()) + '\n'
+        outputs = ['\n'.join(fake._snmpwalk(mib)) + '\n' for mib in srv._snmp_mibs()]
+        nr_values = sum(len(out.splitlines()) for out in outputs)
+        rate = benchutil.best_rate(lambda: srv.parse_ipmi(0., ipmi), 1, min_time)
+        results['parse.ipmi.%s' % kind] = {'samples_per_s': rate, 'values_per_s': rate*len(ipmi.splitlines())}
+        rate = benchutil.best_rate(lambda: srv.parse_snmp(0., None, outputs), 1, min_time)
+        results['parse.snmp.%s' % kind] = {'samples_per_s': rate, 'values_per_s': rate*nr_values}
+
+
+def bench_collect(fetch, results, nr_ticks, min_time):
+    #
+    # the ticks as timed by collect() itself, and what timing its phases
+    # costs per tick against the period
+    #
+    timer = sample_scheduler.phase_timer()
+    lap = 1./benchutil.best_rate(lambda: timer.lap('bench', timer.stamp()), 1, min_time)
+    for kind, concurrent in (('dell', False), ('fb', False), ('fb', True)):
+        target = fetch.bmc_target('bench', fetch._SERVER_KINDS[kind], benchutil.fake_bmc_wrapper('--kind', kind))
+        srv = fetch.server(True, True, fetch._SERVER_KINDS[kind], None, concurrent, target)
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            srv.collect(_COLLECT_PERIOD, nr_ticks*_COLLECT_PERIOD/3600.)
+        finally:
+            sys.stdout = stdout
+        phases = srv.get_phase_summary(False)
+        metrics = dict(('%s_s' % name, value) for name, value in phases['tick'].items() if name != 'count')
+        metrics['count'] = phases['tick']['count']
+        metrics['late_ratio'] = srv._scheduler.get_late_ratio()
+        laps = sum(phase['count'] for phase in phases.values())/float(phases['tick']['count'])
+        metrics['phase_laps'] = laps
+        metrics['phase_overhead_us'] = 1e6*laps*lap
+        metrics['phase_overhead_pct'] = 100.*laps*lap/_COLLECT_PERIOD
+        results['collect.%s.%s' % (kind, 'concurrent' if concurrent else 'sequential')] = metrics
+
+
+def bench_relay(results, nr_samples):
+    # the runs of relay-encode.py, a fifth of the columns change per sample
+    fetch = benchutil.load_server_fetch()
+    relay_encode = imp.load_source('relay_encode', os.path.join(benchutil.BENCH_DIR, 'relay-encode.py'))
+    for relay_format in fetch._RELAY_FORMATS:
+        latency, thread, size = relay_encode.run(fetch, relay_format, nr_samples, 0.2)
+        metrics = _percentiles(latency, 'us', 1e6)
+        metrics['thread_p50_us'] = 1e6*thread.get_percentile(50)
+        metrics['message_bytes'] = size
+        results['relay.%s' % relay_format] = metrics
+
+
+def _fill(fetch, nr_samples):
+    # a FB server with nr_samples rows of random whole values
+    srv = fetch.server(True, True, fetch._COLLECT_FB, None)
+    benchutil.discover_snmp(srv)
+    keys = benchutil.sensor_keys(srv)
+    for block, block_keys in srv._blocks:
+        block.reserve(nr_samples)
+    rng = numpy.random.RandomState(0)
+    for start in range(0, nr_samples, 10000):
+        rows = rng.uniform(0, 100, (min(10000, nr_samples - start), len(keys))).round()
+        for i, row in enumerate(rows):
+            benchutil.store_sample(srv, float(start + i), row)
+    return srv
+
+
+def _measure(save, path, queue):
+    # in a child, its peak rss starts from what it shares with the parent
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    save(path)
+    elapsed = time.time() - start
+    queue.put((elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)/1e3))
+
+
+def _run_child(save, path):
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_measure, args=(save, path, queue))
+    child.start()
+    elapsed, peak = queue.get()
+    child.join()
+    return elapsed, peak
+
+
+def bench_save(fetch, results, datasets, directory):
+    for name, nr_samples in datasets:
+        srv = _fill(fetch, nr_samples)
+        metrics = {'samples': nr_samples, 'traces': len(srv._traces)}
+        for fmt, save in (('numpy', srv.save_numpy), ('matlab', lambda path: srv.save_matlab(path, 1., nr_samples/3600.))):
+            path = os.path.join(directory, 'suite-save-%s.%s' % (name, 'npz' if fmt == 'numpy' else 'mat'))
+            elapsed, peak = _run_child(save, path)
+            metrics['%s_s' % fmt] = elapsed
+            metrics['%s_peak_mb' % fmt] = peak
+            metrics['%s_file_mb' % fmt] = os.path.getsize(path)/1e6
+            os.remove(path)
+        results['save.%s' % name] = metrics
+
+
+def bench_prbs(results, min_time):
+    stress = benchutil.load_server_stress()
+    numpy.random.seed(0)
+    for size in _PRBS_SIZES:
+        signal = stress.pseudo_random_binary_signal('bench', size, 1.)
+        times = numpy.random.uniform(0, size, 1000).tolist()
+        def lookups():
+            for t in times:
+                signal.get_value_at_time(t)
+        rate = benchutil.best_rate(lookups, len(times), min_time)
+        results['prbs.lookup.%d' % size] = {'lookups_per_s': rate, 'lookup_us': 1e6/rate}
+
+
+def _revision():
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=benchutil.PYTHON_DIR,
+                                      stderr=open(os.devnull, 'w'))
+        return out.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _better(name, ratio):
+    # how much better the new value is, > 1 is an improvement
+    if name.endswith('_per_s'):
+        return ratio
+    if name.endswith(('_s', '_us', '_mb', '_bytes')):
+        return 1./ratio if ratio else float('inf')
+    return None
+
+
+def compare(old, new, threshold):
+    nr_worse = 0
+    for key in sorted(new['results']):
+        if key not in old['results']:
+            continue
+        for name, value in sorted(new['results'][key].items()):
+            before = old['results'][key].get(name)
+            if not before or not isinstance(value, (int, float)):
+                continue
+            better = _better(name, float(value)/before)
+            if better is None:
+                continue
+            flag = ''
+            if better < 1./(1. + threshold):
+                flag = '  ! worse'
+                nr_worse += 1
+            print "  %-28s %-16s %12.4g -> %12.4g  x%.2f%s" % (key, name, before, value, better, flag)
+    return nr_worse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o","--outfile", dest="outfile", default='suite.json', help="Path to the JSON results (default suite.json)")
+    parser.add_argument("-s","--sections", dest="sections", default=','.join(_SECTIONS), help="Comma separated sections to run (default %s)" % ','.join(_SECTIONS))
+    parser.add_argument("--datasets", dest="datasets", default=','.join(name for name, n in _DATASETS), help="Datasets of the save section (default all)")
+    parser.add_argument("-t","--min-time", dest="min_time", default=0.5, help="Seconds per throughput measurement (default 0.5)")
+    parser.add_argument("-d","--dir", dest="dir", default='/tmp', help="Directory of the files written (default /tmp)")
+    parser.add_argument("-c","--compare", dest="compare", default=None, help="Earlier JSON results to compare with")
+    parser.add_argument("--threshold", dest="threshold", default=_THRESHOLD, help="Relative change flagged as a regression (default %.2f)" % _THRESHOLD)
+    args = parser.parse_args()
+
+    sections = [s for s in args.sections.split(',') if s]
+    for section in sections:
+        if section not in _SECTIONS:
+            print "Unknown section %s, expected some of %s" % (section, ','.join(_SECTIONS))
+            sys.exit(1)
+    datasets = [(name, n) for name, n in _DATASETS if name in args.datasets.split(',')]
+    min_time = float(args.min_time)
+
+    fetch = benchutil.load_server_fetch()
+    results = {}
+    for section in sections:
+        start = time.time()
+        if section == 'parse':
+            bench_parse(fetch, results, min_time)
+        elif section == 'collect':
+            bench_collect(fetch, results, _COLLECT_TICKS, min_time)
+        elif section == 'relay':
+            bench_relay(results, _RELAY_SAMPLES)
+        elif section == 'save':
+            bench_save(fetch, results, datasets, args.dir)
+        else:
+            bench_prbs(results, min_time)
+        print "%s: %.1f [sec]" % (section, time.time() - start)
+        for key in sorted(k for k in results if k.startswith(section + '.')):
+            print "  %-28s %s" % (key, ', '.join('%s %.4g' % item for item in sorted(results[key].items())))
+
+    output = {
+        'meta': {
+            'revision': _revision(),
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'host': socket.gethostname(),
+            'python': sys.version.split()[0],
+            'numpy': numpy.__version__,
+            'cpus': multiprocessing.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.outfile, 'w') as f:
+        json.dump(output, f, indent=1, sort_keys=True)
+    print "Results written to %s" % args.outfile
+
+    if args.compare is not None:
+        print "Compared with %s (%s):" % (args.compare, json.load(open(args.compare))['meta'].get('revision'))
+        if compare(json.load(open(args.compare)), output, float(args.threshold)):
+            sys.exit(2)
+    sys.exit(0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Cost of the time queries of a trace of server-fetch.py as it grows to 10M
+# samples: a window of a minute, the value at a time and the last samples,
+# at random times. They search the times of the block and return views, so
+# they should cost about the same at every size, while get_time_with_data
+# copies the whole trace once a sample was missed. The windows and the values
+# of the largest trace are checked against a scan of all its samples.
+#
+
+import sys
+import time
+import argparse
+import numpy
+import benchutil
+
+_NR_SAMPLES = 10000000
+_NR_LOOKUPS = 1000
+_WINDOW = 60.               # [sec]
+_NR_CHECKED = 100
+
+
+def same(a, b):
+    # equal values, NaN where the other is NaN
+    a, b = numpy.atleast_1d(a), numpy.atleast_1d(b)
+    missing = numpy.isnan(a)
+    return numpy.array_equal(missing, numpy.isnan(b)) and numpy.array_equal(a[~missing], b[~missing])
+
+
+def check(trace, times, values, rng):
+    for t in rng.uniform(0, times[-1], _NR_CHECKED):
+        got_t, got_v = trace.window(t, t + _WINDOW)
+        inside = (times >= t) & (times <= t + _WINDOW)
+        assert numpy.array_equal(got_t, times[inside]) and same(got_v, values[inside]), t
+        assert same(trace.at(t), values[numpy.flatnonzero(times <= t)[-1]]), t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--samples", dest="samples", default=_NR_SAMPLES, help="Nr. of samples of the largest trace (default %d)" % _NR_SAMPLES)
+    args = parser.parse_args()
+    nr_samples = int(args.samples)
+
+    fetch = benchutil.load_server_fetch()
+    block = fetch.sample_block(1)
+    block.reserve(nr_samples)
+    trace = fetch.data_trace('x_i', 'degC')
+    trace.add_column(block, 0)
+    rng = numpy.random.RandomState(0)
+    row = numpy.empty(1)
+    sizes = [10**k for k in range(3, 8) if 10**k <= nr_samples]
+    if sizes[-1] != nr_samples:
+        sizes.append(nr_samples)
+    print "%8s %10s %10s %10s %12s" % ('samples', 'window', 'at', 'latest', 'full copy')
+    for size in sizes:
+        # 1 Hz with a jittered clock and a few missed samples
+        n = len(block)
+        times = n + numpy.arange(size - n) + rng.normal(0, 2e-3, size - n)
+        values = numpy.round(rng.normal(40, 5, size - n))
+        values[rng.uniform(size=size - n) < 0.001] = numpy.nan
+        for t, v in zip(times.tolist(), values.tolist()):
+            row[0] = v
+            block.write(t, row)
+        lookups = rng.uniform(0, size, _NR_LOOKUPS).tolist()
+
+        def windows():
+            for t in lookups:
+                trace.window(t, t + _WINDOW)
+
+        def values_at():
+            for t in lookups:
+                trace.at(t)
+
+        def latest():
+            for t in lookups:
+                trace.latest(10)
+
+        rates = [benchutil.best_rate(func, _NR_LOOKUPS, 0.2) for func in (windows, values_at, latest)]
+        copy_rate = benchutil.best_rate(trace.get_time_with_data, 1, 0.2)
+        print "%8d %7.2f us %7.2f us %7.2f us %9.3f ms" % \
+            ((size,) + tuple(1e6/rate for rate in rates) + (1e3/copy_rate,))
+    all_times, all_values = block.get_column(0)
+    check(trace, all_times, all_values, rng)
+    sys.exit(0)
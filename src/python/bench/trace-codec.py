@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Bytes per sample and encode/decode MB/s of the encodings of trace_codec.py
+# on FB and Dell runs, against the 16 bytes of a float64 time and value. The
+# runs are the outputs of the fake BMC parsed by server-fetch.py at 1 Hz with
+# a jittered clock. Each trace is encoded in blocks of a minute, as a coded
+# recording writes them, and whole, as an export would. The MB/s are of the
+# float64 samples. Then the size of the recording segments with and without
+# the codec, and what a month of each costs.
+#
+# The fake BMC draws independent random values, a real sensor changes
+# slowly and compresses better.
+#
+
+import os
+import sys
+import time
+import random
+import argparse
+import numpy
+import benchutil
+import trace_codec
+import trace_recorder
+
+_NR_SAMPLES = 3600
+_CHUNK = 60                         # samples of a trace per coded chunk at 1 Hz
+_MONTH = 30*24*3600                 # [sec]
+_CONFIGS = [
+    # name, compressor, time order, quantize
+    ('float64', 'none', 0, False),
+    ('float64 zlib', 'zlib', 0, False),
+    ('int', 'none', 0, True),
+    ('int dod', 'none', 2, True),
+    ('int zlib', 'zlib', 0, True),
+    ('int delta zlib', 'zlib', 1, True),
+    ('int dod zlib-fast', 'zlib-fast', 2, True),
+    ('int dod zlib', 'zlib', 2, True),
+    ('int dod bz2', 'bz2', 2, True),
+    ('int dod lz4', 'lz4', 2, True),
+]
+
+
+def record_run(fetch, kind, nr_samples, recorder=None):
+    # a server of server-fetch.py after nr_samples ticks of the fake BMC
+    fake = benchutil.load_fake_bmc()
+    random.seed(0)
+    rng = numpy.random.RandomState(0)
+    srv = fetch.server(True, True, fetch._SERVER_KINDS[kind], None)
+    benchutil.discover_snmp(srv)
+    if recorder is not None:
+        srv.set_recorder(recorder, False)
+    mibs = srv._snmp_mibs()
+    for i in range(nr_samples):
+        t = 1e9 + i + rng.normal(0, 2e-3)
+        if kind == 'dell':
+            ipmi = fake._dell_sdr_list_full()
+        else:
+            ipmi = fake._fb_ipmi_sensors()
+        srv.parse_ipmi(t, '\n'.join(ipmi) + '\n')
+        srv.parse_snmp(t + 0.05, None, ['\n'.join(fake._snmpwalk(mib)) + '\n' for mib in mibs])
+    return srv
+
+
+def best_time(func, repeat=3):
+    best = None
+    for r in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_config(traces, codec, block_size):
+    # (bytes per sample, encode MB/s, decode MB/s)
+    blocks = []
+    for t, v in traces:
+        for start in range(0, len(t), block_size):
+            blocks.append((t[start:start + block_size], v[start:start + block_size]))
+    encoded = [codec.encode(t, v) for t, v in blocks]
+    for (t, v), block in zip(blocks, encoded):
+        t2, v2 = trace_codec.decode(block)
+        assert numpy.array_equal(v2, v) and numpy.abs(t2 - t).max() <= 1e-6
+
+    nr_samples = sum(len(t) for t, v in traces)
+    encode_time = best_time(lambda: [codec.encode(t, v) for t, v in blocks])
+    decode_time = best_time(lambda: [trace_codec.decode(block) for block in encoded])
+    mb = 16.*nr_samples/1e6
+    return float(sum(len(block) for block in encoded))/nr_samples, mb/encode_time, mb/decode_time
+
+
+def segment_bytes(prefix):
+    return sum(os.path.getsize(trace_recorder.segment_path(prefix, i))
+               for i in range(len(trace_recorder._segment_paths(prefix))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--samples", dest="samples", default=_NR_SAMPLES, help="Nr. of ticks of the runs (default %d)" % _NR_SAMPLES)
+    parser.add_argument("-d","--dir", dest="dir", default='/tmp', help="Directory of the recordings written (default /tmp)")
+    args = parser.parse_args()
+    nr_samples = int(args.samples)
+
+    fetch = benchutil.load_server_fetch()
+    for kind in ('fb', 'dell'):
+        srv = record_run(fetch, kind, nr_samples)
+        traces = [srv.get_trace(key).get_time_with_data() for key in sorted(srv._traces)]
+        nr_values = sum(len(t) for t, v in traces)
+        print "%s: %d ticks, %d traces, %d samples" % (kind, nr_samples, len(traces), nr_values)
+        for name, compressor, order, quantize in _CONFIGS:
+            if compressor not in trace_codec.compressors():
+                print "  %-18s (not installed)" % name
+                continue
+            codec = trace_codec.trace_codec(compressor, order, quantize=quantize)
+            results = []
+            for block_size in (_CHUNK, nr_samples):
+                results.extend(run_config(traces, codec, block_size))
+            print "  %-18s %ds blocks %6.2f B/sample %7.1f MB/s enc %7.1f MB/s dec   whole %6.2f B/sample %7.1f MB/s enc %7.1f MB/s dec" % \
+                ((name, _CHUNK) + tuple(results))
+
+        # the recordings, the coded chunks hold a minute of samples at 1 Hz
+        sizes = []
+        for name, codec in (('raw', None), ('zlib', trace_codec.trace_codec('zlib'))):
+            prefix = os.path.join(args.dir, 'trace-codec-%s-%s' % (kind, name))
+            for path in trace_recorder._segment_paths(prefix):
+                os.remove(path)
+            recorder = trace_recorder.trace_recorder(prefix, chunk_records=_CHUNK*len(traces), codec=codec)
+            recorded = record_run(fetch, kind, nr_samples, recorder)
+            recorder.close()
+            traces_read, meta, complete = trace_recorder.read_recording(prefix)
+            # the sensors and the quality of the queries of each source
+            logs = set('q_' + source for source in fetch._SOURCES)
+            assert complete and set(traces_read) == set(recorded._traces) | logs
+            nr_bytes = segment_bytes(prefix)
+            print "  recording %-5s %6.2f B/sample  %8.1f MB/month" % \
+                (name, float(nr_bytes)/nr_values, float(nr_bytes)/nr_samples*_MONTH/1e6)
+            for path in trace_recorder._segment_paths(prefix):
+                os.remove(path)
+    sys.exit(0)
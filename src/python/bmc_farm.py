@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# A farm of simulated Dell and FB servers in one process, to load test
+# server-fetch.py at fleet scale without hardware. The sensors of each server
+# come from a lumped thermal model driven by a binary load per socket: the
+# PRBS schedules of server-stress.py, read from its .mat output or drawn the
+# same way. All the servers are stepped together as numpy arrays, a step
+# costs about the same for one server or a few thousands.
+#
+# Each heat sink is a heat capacity heated by the power of its socket and
+# cooled by the air, through a conductance that grows with the fan speed. The
+# die is hotter than its sink by the power times a small resistance, it jumps
+# with the load and then drifts with the sink. The fans follow the hottest
+# die, the DIMMs and the outlet follow the sockets with their own time
+# constants. The inlet is a constant per server.
+#
+# The farm serves on two UDP ports of localhost:
+#
+#   snmp    SNMPv2c GET/GETNEXT/GETBULK of the subtrees walked by
+#           server-fetch.py, the community names the server (-n)
+#   query   the output of ipmitool "sdr list full", ipmi-sensors and
+#           snmpwalk -Oqv for the command line of fake-bmc.py --farm, the
+#           ipmi host (-H/-h) or the community (-c) names the server
+#
+# A query is the arguments of the command joined by \0, the answer is
+# "0\n<output>" or "1 <reason>\n". The community and ipmi host of the lab
+# servers name the first server of their kind.
+#
+# Usage: bmc_farm.py -n 1000 -o farm.txt serves 1000 servers until it is
+# interrupted, farm.txt is their inventory for server-fetch.py -f, e.g.
+#
+#   server-fetch.py -i -s -f farm.txt -w "python fake-bmc.py --farm localhost:16162"
+#
+
+import sys
+import time
+import bisect
+import select
+import socket
+import argparse
+import numpy
+import snmp_client
+
+try:
+    import scipy.io
+except ImportError:
+    scipy = None
+
+_SNMP_PORT = 16161
+_QUERY_PORT = 16162
+_STEP = 0.5                     # [sec] between the updates of the model
+_PRBS_PERIOD = 5.               # [sec] of a generated load, as server-stress.py
+_PRBS_SIZE = 720                # values of a generated load, then it repeats
+_REPORT_PERIOD = 10.            # [sec]
+_MAX_DATAGRAM = 65507
+_NR_SOCKETS = 2
+_NR_FB_CPUS = 32                # two hardware threads per core
+
+# the thermal model, per socket
+_P_IDLE = 25.                   # [W]
+_P_LOAD = 95.                   # [W] added at full load
+_P_REST = 90.                   # [W] of the rest of the server
+_C_SINK = 250.                  # [J/K]
+_G_SINK = (1.2, 4.5)            # [W/K] heat sink to air at the slowest and fastest fan
+_R_DIE = 0.12                   # [K/W] die to heat sink
+_TAU_FAN = 10.                  # [sec]
+_TAU_DIMM = 300.                # [sec]
+_TAU_OUTLET = 20.               # [sec]
+_K_AIR = 26.                    # [W/K] heat carried by the air at the fastest fan
+_FAN_CURVE = (45., 75.)         # [degC] of the hottest socket at the slowest and fastest fan
+_FAN_MIN = 0.6                  # slowest fan, fraction of the fastest
+_T_JMAX = 90.                   # [degC] the FB margins are relative to it
+_INLET = (19., 23.)             # [degC]
+
+# [RPM] of the fastest fan and the step the BMC reports it in
+_FAN_RPM = {'dell': (4080., 120.), 'fb': (3000., 25.)}
+_KINDS = ('dell', 'fb')
+
+# the snmp community and ipmi host of the lab servers in server-fetch.py, the
+# first server of the kind answers them so that one server can be polled
+# without an inventory
+_LAB_NAMES = {'dell': ('public', '192.168.21.151'), 'fb': ('LTU', '10.0.100.122')}
+
+_MIB_DELL_TEMP = 'IDRAC-MIB-SMIv2::temperatureProbeReading'
+_MIB_DELL_FAN = 'IDRAC-MIB-SMIv2::coolingDeviceReading'
+_MIB_FB_TEMP = 'LM-SENSORS-MIB::lmTempSensorsValue'
+_MIB_FB_LOAD = 'HOST-RESOURCES-MIB::hrProcessorLoad'
+
+
+class thermal_model(object):
+    #
+    # the state of nr_servers servers of nr_sockets sockets, [degC], [W] and
+    # the fans as a fraction of their fastest speed. socket is the die
+    #
+    def __init__(self, nr_servers, nr_sockets=_NR_SOCKETS, seed=0):
+        assert nr_servers > 0
+        assert nr_sockets > 0
+        rng = numpy.random.RandomState(seed)
+        self.inlet = rng.uniform(_INLET[0], _INLET[1], nr_servers)
+        self.sink = self.inlet[:, None] + rng.uniform(8., 12., (nr_servers, nr_sockets))
+        self.dimm = self.inlet[:, None] + rng.uniform(1., 3., (nr_servers, nr_sockets))
+        self.outlet = self.inlet + 8.
+        self.fan = numpy.empty(nr_servers)
+        self.fan.fill(_FAN_MIN)
+        self.power = numpy.empty((nr_servers, nr_sockets))
+        self.power.fill(_P_IDLE)
+        self.socket = self.sink + _R_DIE*self.power
+        # the servers are not all the same
+        self._c_sink = _C_SINK*rng.uniform(0.9, 1.1, (nr_servers, nr_sockets))
+
+    def step(self, dt, loads):
+        #
+        # advance by dt [sec] with loads in [0, 1] per server and socket held
+        # over the step. Each part is a first order lag stepped exactly
+        #
+        assert dt >= 0
+        self.power = _P_IDLE + _P_LOAD*loads
+        g = _G_SINK[0] + (_G_SINK[1] - _G_SINK[0])*(self.fan[:, None] - _FAN_MIN)/(1. - _FAN_MIN)
+        steady = self.inlet[:, None] + self.power/g
+        self.sink += (steady - self.sink)*(1. - numpy.exp(-dt*g/self._c_sink))
+        self.socket = self.sink + _R_DIE*self.power
+
+        hottest = self.socket.max(axis=1)
+        curve = numpy.clip((hottest - _FAN_CURVE[0])/(_FAN_CURVE[1] - _FAN_CURVE[0]), 0., 1.)
+        self.fan += (_FAN_MIN + (1. - _FAN_MIN)*curve - self.fan)*(1. - numpy.exp(-dt/_TAU_FAN))
+
+        steady = self.inlet[:, None] + 0.25*(self.sink - self.inlet[:, None]) + 2.
+        self.dimm += (steady - self.dimm)*(1. - numpy.exp(-dt/_TAU_DIMM))
+        steady = self.inlet + (self.power.sum(axis=1) + _P_REST)/(_K_AIR*self.fan)
+        self.outlet += (steady - self.outlet)*(1. - numpy.exp(-dt/_TAU_OUTLET))
+
+
+class load_schedule(object):
+    #
+    # a binary load per server and socket, held for a period and repeated
+    # after the last one. Either the sockets of a server-stress.py .mat file,
+    # started at a random offset per server so that they do not all switch
+    # together, or drawn as server-stress.py does
+    #
+    def __init__(self, nr_servers, nr_sockets=_NR_SOCKETS, period=_PRBS_PERIOD, size=_PRBS_SIZE, seed=0, path=None):
+        rng = numpy.random.RandomState(seed)
+        if path is None:
+            self._period = float(period)
+            self._values = rng.choice([0, 1], size=(nr_servers, nr_sockets, size)).astype(numpy.int8)
+            return
+        if scipy is None:
+            raise IOError('reading %s needs scipy' % path)
+        mat = scipy.io.loadmat(path)
+        self._period = float(numpy.asarray(mat['period']).ravel()[0])
+        loads = [numpy.asarray(mat['socket%02d_values' % i]).ravel()
+                 for i in range(int(numpy.asarray(mat['nr_sockets']).ravel()[0]))]
+        size = min(len(values) for values in loads)
+        self._values = numpy.empty((nr_servers, nr_sockets, size), dtype=numpy.int8)
+        offsets = rng.randint(0, size, nr_servers)
+        for s in range(nr_sockets):
+            values = loads[s % len(loads)][:size]
+            for i in range(nr_servers):
+                self._values[i, s] = numpy.roll(values, -offsets[i])
+
+    def get_period(self):
+        return self._period
+
+    def at(self, t):
+        # the loads at t [sec] from the start, a float per server and socket
+        idx = int(t//self._period) % self._values.shape[2]
+        return self._values[:, :, idx].astype(float)
+
+
+class _snmp_table(object):
+    # the OIDs of the subtrees of a server kind in walk order, and where each is in the rendered values
+    def __init__(self, mibs):
+        self.oids = []
+        self.walks = {}
+        for mib, nr_values, first in mibs:
+            root = snmp_client.parse_oid(snmp_client.MIB_OIDS[mib])
+            start = len(self.oids)
+            self.oids.extend(root + (first + i,) for i in range(nr_values))
+            self.walks[mib] = (start, start + nr_values)
+        self.columns = dict((oid, i) for i, oid in enumerate(self.oids))
+        self.sorted = sorted(self.oids)
+
+
+class simulated_bmc(object):
+    # one server of the farm, what snmp_client.answer_request asks
+    def __init__(self, farm, name, kind, index, row):
+        self.name = name
+        self.kind = kind
+        self.index = index              # in the thermal model
+        self.row = row                  # in the values of its kind
+        self._farm = farm
+
+    def get(self, oid):
+        column = self._farm._tables[self.kind].columns.get(oid)
+        if column is None:
+            return None
+        return int(self._farm._snmp_values[self.kind][self.row, column])
+
+    def get_next(self, oid):
+        table = self._farm._tables[self.kind]
+        i = bisect.bisect_right(table.sorted, oid)
+        if i == len(table.sorted):
+            return None
+        oid = table.sorted[i]
+        return oid, int(self._farm._snmp_values[self.kind][self.row, table.columns[oid]])
+
+
+class bmc_farm(object):
+    def __init__(self, nr_servers, kind='fb', nr_cpus=_NR_FB_CPUS, seed=0, loads_path=None, period=_PRBS_PERIOD):
+        assert kind in _KINDS + ('mixed',)
+        assert nr_cpus % (2*_NR_SOCKETS) == 0
+        self._nr_cpus = nr_cpus
+        self._rng = numpy.random.RandomState(seed + 1)
+        self._model = thermal_model(nr_servers, _NR_SOCKETS, seed)
+        self._loads = load_schedule(nr_servers, _NR_SOCKETS, period, seed=seed + 2, path=loads_path)
+        self._servers = []
+        self._by_name = {}
+        rows = dict((k, 0) for k in _KINDS)
+        for i in range(nr_servers):
+            if kind == 'mixed':
+                k = _KINDS[i % len(_KINDS)]
+            else:
+                k = kind
+            srv = simulated_bmc(self, 'sim%04d' % i, k, i, rows[k])
+            rows[k] += 1
+            self._servers.append(srv)
+            self._by_name[srv.name] = srv
+        for k in _KINDS:
+            first = [srv for srv in self._servers if srv.kind == k][:1]
+            for name in _LAB_NAMES[k]:
+                if first and name not in self._by_name:
+                    self._by_name[name] = first[0]
+        self._indices = dict((k, numpy.array([srv.index for srv in self._servers if srv.kind == k], dtype=numpy.intp))
+                             for k in _KINDS)
+
+        # an FB socket is its average then a temperature per core
+        self._nr_cores = nr_cpus//(2*_NR_SOCKETS)
+        self._tables = {
+            'dell': _snmp_table([(_MIB_DELL_TEMP, 4, 1), (_MIB_DELL_FAN, 6, 1)]),
+            'fb': _snmp_table([(_MIB_FB_TEMP, _NR_SOCKETS*(self._nr_cores + 1), 1), (_MIB_FB_LOAD, nr_cpus, 196608)]),
+        }
+        self._core_offsets = self._rng.uniform(-3., 3., (nr_servers, _NR_SOCKETS, self._nr_cores))
+        self._fan_offsets = self._rng.uniform(-0.03, 0.03, (nr_servers, 6))
+        self._start = None
+        self._last_step = None
+        self._snmp_sock = None
+        self._query_sock = None
+        self.nr_snmp = 0
+        self.nr_queries = 0
+        self.nr_errors = 0
+        self.step_time = 0.
+        self.nr_steps = 0
+        self.step(0.)
+
+    def get_servers(self):
+        return self._servers
+
+    def get_model(self):
+        return self._model
+
+    def step(self, t):
+        #
+        # the model at t [sec] from the start, then the values the BMCs
+        # answer until the next step
+        #
+        start = time.time()
+        dt = 0. if self._last_step is None else t - self._last_step
+        self._last_step = t
+        loads = self._loads.at(t)
+        self._model.step(dt, loads)
+        self._loads_now = loads
+        self._render()
+        self.step_time += time.time() - start
+        self.nr_steps += 1
+
+    def _render(self):
+        #
+        # the sensors of all the servers of each kind as the BMCs report them,
+        # [degC] and RPM rounded as they are, a small noise on each reading
+        #
+        model = self._model
+        rng = self._rng
+        n = len(self._servers)
+        fan_rpm = dict((k, numpy.round(_FAN_RPM[k][0]*model.fan[:, None]*(1. + self._fan_offsets)/_FAN_RPM[k][1])*_FAN_RPM[k][1])
+                       for k in _KINDS)
+        cores = model.socket[:, :, None] + self._core_offsets + rng.normal(0., 0.5, self._core_offsets.shape)
+        # [%] per logical cpu, the cpus of a socket are contiguous
+        cpu_load = numpy.repeat(self._loads_now, self._nr_cpus//_NR_SOCKETS, axis=1)
+        cpu_load = numpy.clip(numpy.round(cpu_load*rng.uniform(90., 100., cpu_load.shape) + rng.uniform(0., 3., cpu_load.shape)), 0, 100)
+        power = model.power.sum(axis=1) + _P_REST
+
+        self._snmp_values = {}
+        self._ipmi_values = {}
+        for k in _KINDS:
+            rows = self._indices[k]
+            if k == 'dell':
+                temps = numpy.column_stack((model.inlet, model.outlet, model.socket[:, 0], model.socket[:, 1]))[rows]
+                self._snmp_values[k] = numpy.column_stack((numpy.round(10.*temps), fan_rpm[k][rows])).astype(numpy.int64)
+                self._ipmi_values[k] = numpy.column_stack((
+                    fan_rpm[k][rows], numpy.round(temps),
+                    numpy.round(100.*self._loads_now[rows].mean(axis=1)),
+                    rng.randint(0, 6, len(rows)), rng.randint(5, 21, len(rows)),
+                    numpy.round(100.*self._loads_now[rows].mean(axis=1)),
+                    numpy.round(10.*power[rows]/230.)/10., numpy.round(10.*rng.uniform(0., 0.4, len(rows)))/10.,
+                    rng.randint(228, 235, (len(rows), 2)), numpy.round(power[rows])))
+            else:
+                per_socket = numpy.concatenate((cores.mean(axis=2)[:, :, None], cores), axis=2)
+                temps = numpy.round(1000.*per_socket.reshape(n, -1))
+                self._snmp_values[k] = numpy.column_stack((temps, cpu_load))[rows].astype(numpy.int64)
+                self._ipmi_values[k] = numpy.column_stack((
+                    numpy.round(model.outlet), numpy.round(model.inlet),
+                    numpy.round(model.socket - _T_JMAX), numpy.round(model.dimm), fan_rpm[k][:, :2]))[rows]
+
+    def _ipmi_lines(self, srv, tool):
+        values = self._ipmi_values[srv.kind][srv.row].tolist()
+        if srv.kind == 'dell':
+            names = ['Fan%d RPM' % i for i in range(1, 7)] + ['Inlet Temp', 'Exhaust Temp', 'Temp', 'Temp',
+                     'CPU Usage', 'IO Usage', 'MEM Usage', 'SYS Usage', 'Current 1', 'Current 2',
+                     'Voltage 1', 'Voltage 2', 'Pwr Consumption']
+            units = ['RPM']*6 + ['degrees C']*4 + ['percent']*4 + ['Amps']*2 + ['Volts']*2 + ['Watts']
+            return ['%s,%s,%s,ok' % (name, ('%.1f' if unit == 'Amps' else '%d') % value, unit)
+                    for name, value, unit in zip(names, values, units)]
+        rows = [(257, 'Outlet Cntr Temp', 'C'), (263, 'Inlet Temp', 'C'), (265, 'P0 Therm Margin', 'C'),
+                (266, 'P1 Therm Margin', 'C'), (273, 'P0 DIMM Temp', 'C'), (274, 'P1 DIMM Temp', 'C'),
+                (326, 'SYS_Fan0', 'RPM'), (327, 'SYS_Fan1', 'RPM')]
+        if tool == 'ipmi-sensors':
+            return ["%d,%-16s,%.2f,%s,'OK'" % (sid, name, value, unit) for (sid, name, unit), value in zip(rows, values)]
+        return ['%s,%d,%s,ok' % (name, value, {'C': 'degrees C'}.get(unit, unit)) for (sid, name, unit), value in zip(rows, values)]
+
+    def _walk_lines(self, srv, mib):
+        table = self._tables[srv.kind]
+        if mib not in table.walks:
+            return []
+        start, end = table.walks[mib]
+        return [str(value) for value in self._snmp_values[srv.kind][srv.row, start:end].tolist()]
+
+    def answer_query(self, args):
+        #
+        # the output of the command line of fake-bmc.py, the server is named
+        # by the ipmi host or the snmp community
+        #
+        if not args:
+            raise ValueError('empty query')
+        tool = args[0].split('/')[-1]
+        if tool in ('ipmitool', 'ipmi-sensors'):
+            flag = '-H' if tool == 'ipmitool' else '-h'
+        elif tool == 'snmpwalk':
+            flag = '-c'
+        else:
+            raise ValueError('unknown tool %s' % tool)
+        if flag not in args[:-1]:
+            raise ValueError('%s without %s' % (tool, flag))
+        srv = self._by_name.get(args[args.index(flag) + 1])
+        if srv is None:
+            raise ValueError('no server %s in the farm' % args[args.index(flag) + 1])
+        if tool == 'snmpwalk':
+            return self._walk_lines(srv, args[-1])
+        if tool == 'ipmitool' and args[-3:] != ['sdr', 'list', 'full']:
+            raise ValueError('only sdr list full is simulated')
+        return self._ipmi_lines(srv, tool)
+
+    def write_inventory(self, path, snmp_port=_SNMP_PORT):
+        # the servers as hosts of server-fetch.py -f, see read_inventory
+        f = open(path, 'w')
+        f.write('# %d simulated servers of bmc_farm.py\n' % len(self._servers))
+        for srv in self._servers:
+            f.write('%s %s ipmi_host=%s snmp_host=127.0.0.1:%d community=%s\n' %
+                    (srv.name, srv.kind, srv.name, snmp_port, srv.name))
+        f.close()
+
+    def bind(self, snmp_port=_SNMP_PORT, query_port=_QUERY_PORT, host='127.0.0.1'):
+        self._snmp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._snmp_sock.bind((host, snmp_port))
+        self._query_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._query_sock.bind((host, query_port))
+        for sock in (self._snmp_sock, self._query_sock):
+            sock.setblocking(0)
+            # a burst of queries of the whole fleet
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        return self._snmp_sock.getsockname()[1], self._query_sock.getsockname()[1]
+
+    def _handle(self, sock):
+        # answer the datagrams waiting on sock
+        while True:
+            try:
+                data, addr = sock.recvfrom(_MAX_DATAGRAM)
+            except socket.error:
+                return
+            if sock is self._snmp_sock:
+                try:
+                    reply = snmp_client.answer_request(data, self._by_name)
+                except (snmp_client.snmp_error, IndexError):
+                    reply = None
+                self.nr_snmp += 1
+            else:
+                try:
+                    reply = '0\n' + ''.join(line + '\n' for line in self.answer_query(data.split('\0')))
+                except ValueError as e:
+                    reply = '1 %s\n' % e
+                    self.nr_errors += 1
+                self.nr_queries += 1
+            if reply is None:
+                continue
+            try:
+                sock.sendto(reply, addr)
+            except socket.error:
+                self.nr_errors += 1
+
+    def serve(self, timelength=None, step=_STEP, report=_REPORT_PERIOD):
+        # answer the queries, stepping the model every step [sec] of real time
+        assert self._snmp_sock is not None, "bind() first"
+        poll = select.epoll()
+        poll.register(self._snmp_sock.fileno(), select.EPOLLIN)
+        poll.register(self._query_sock.fileno(), select.EPOLLIN)
+        socks = {self._snmp_sock.fileno(): self._snmp_sock, self._query_sock.fileno(): self._query_sock}
+        self._start = time.time()
+        self._last_step = 0.
+        next_step = self._start + step
+        next_report = self._start + report
+        try:
+            while timelength is None or time.time() - self._start < timelength:
+                now = time.time()
+                if now >= next_step:
+                    self.step(now - self._start)
+                    next_step = max(next_step + step, now)
+                if report and now >= next_report:
+                    self.print_stats(now - self._start)
+                    next_report = next_report + report
+                for fd, event in poll.poll(max(0., next_step - time.time())):
+                    self._handle(socks[fd])
+        finally:
+            poll.close()
+
+    def print_stats(self, elapsed):
+        model = self._model
+        print "farm %.0fs: %d snmp, %d queries, %d errors, step %.2f [ms], sockets %.1f-%.1f degC, fans %.0f-%.0f%%" % \
+            (elapsed, self.nr_snmp, self.nr_queries, self.nr_errors, 1e3*self.step_time/max(1, self.nr_steps),
+             model.socket.min(), model.socket.max(), 100*model.fan.min(), 100*model.fan.max())
+        sys.stdout.flush()
+
+    def close(self):
+        for sock in (self._snmp_sock, self._query_sock):
+            if sock is not None:
+                sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n","--servers", dest="servers", default=1000, help="Nr. of simulated servers (default 1000)")
+    parser.add_argument("-k","--kind", dest="kind", default='fb', choices=_KINDS + ('mixed',), help="Server model, mixed alternates them (default fb)")
+    parser.add_argument("--cpus", dest="cpus", default=_NR_FB_CPUS, help="Logical cpus of a FB server (default %d)" % _NR_FB_CPUS)
+    parser.add_argument("-l","--loads", dest="loads", default=None, help="The socket loads of a server-stress.py .mat output, otherwise drawn like it")
+    parser.add_argument("-T","--period", dest="period", default=_PRBS_PERIOD, help="Period of the drawn loads in seconds (default %gs)" % _PRBS_PERIOD)
+    parser.add_argument("--step", dest="step", default=_STEP, help="Seconds between the updates of the model (default %g)" % _STEP)
+    parser.add_argument("--seed", dest="seed", default=0, help="Seed of the servers and their loads (default 0)")
+    parser.add_argument("--snmp-port", dest="snmp_port", default=_SNMP_PORT, help="UDP port of the snmp agents (default %d)" % _SNMP_PORT)
+    parser.add_argument("--query-port", dest="query_port", default=_QUERY_PORT, help="UDP port of the queries of fake-bmc.py --farm (default %d)" % _QUERY_PORT)
+    parser.add_argument("-o","--inventory", dest="inventory", default=None, help="Write the inventory of the farm for server-fetch.py -f")
+    parser.add_argument("-t","--timelength", dest="timelength", default=None, help="Serve for this many hours (default until interrupted)")
+    args = parser.parse_args()
+
+    farm = bmc_farm(int(args.servers), args.kind, int(args.cpus), int(args.seed), args.loads, float(args.period))
+    snmp_port, query_port = farm.bind(int(args.snmp_port), int(args.query_port))
+    if args.inventory is not None:
+        farm.write_inventory(args.inventory, snmp_port)
+    print "Farm of %d %s servers: snmp on udp port %d, queries on udp port %d" % \
+        (len(farm.get_servers()), args.kind, snmp_port, query_port)
+    sys.stdout.flush()
+    timelength = None
+    if args.timelength is not None:
+        timelength = float(args.timelength)*3600
+    try:
+        farm.serve(timelength, float(args.step))
+    except KeyboardInterrupt:
+        pass
+    farm.close()
+    sys.exit(0)
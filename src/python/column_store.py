@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# A run as a directory of raw .npy columns, filled while collecting, that a
+# single sensor can be memory-mapped from without reading the rest:
+#
+#   <dir>/manifest.json          the traces, their units and files, the meta
+#   <dir>/<block>/t.npy          the times of the samples of a sample block
+#   <dir>/<block>/<key>.npy      the values of a sensor in that block
+#
+# A block holds the sensors of one source in one sensor group, a sample where
+# a sensor was missing is NaN in its column. A trace read by more than one
+# source has a part per block. The new samples are appended to the files
+# about once per second, each append ends by writing the new length in the
+# header, so a reader gets the samples up to the last append, e.g.
+#
+#   t, v = column_store.open_trace('run', 'x_i')[0]
+#
+# are memmaps whatever the length of the run.
+#
+# Usage: column_store.py DIR [-o out.npz] [-m out.mat] converts a run
+# directory to the files written by server-fetch.py.
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy
+import mat_writer
+
+_MANIFEST = 'manifest.json'
+_HEADER_SIZE = 128          # [bytes] room for any length, so the data never moves
+_FLUSH_PERIOD = 1.          # [sec]
+
+
+def _npy_header(n):
+    # a version 1.0 header of a float64 vector of n values, padded to _HEADER_SIZE
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d,), }" % n
+    header_len = _HEADER_SIZE - 10
+    return '\x93NUMPY\x01\x00' + chr(header_len & 0xff) + chr(header_len >> 8) + header.ljust(header_len - 1) + '\n'
+
+
+class column_file(object):
+    # a .npy vector that grows at its end
+    def __init__(self, path):
+        self._file = open(path, 'w+b')
+        self._file.write(_npy_header(0))
+        self._n = 0
+        self._nr_written = 0
+
+    def append(self, values):
+        self._file.seek(0, 2)
+        numpy.ascontiguousarray(values, dtype=numpy.float64).tofile(self._file)
+        self._n += len(values)
+
+    def commit(self):
+        # the data is written before the length that makes it visible
+        if self._nr_written == self._n:
+            return
+        self._file.flush()
+        self._file.seek(0)
+        self._file.write(_npy_header(self._n))
+        self._file.flush()
+        self._nr_written = self._n
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+class column_store(object):
+    def __init__(self, directory, flush_period=_FLUSH_PERIOD):
+        assert isinstance(directory, str)
+        assert flush_period > 0
+        # never overwrite or extend an earlier run
+        if os.path.exists(os.path.join(directory, _MANIFEST)):
+            raise IOError('%s already holds a run' % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._flush_period = flush_period
+        self._last_flush = time.time()
+        self._keep = True
+        # [block, time file, value files, nr. of rows of the block written]
+        self._blocks = []
+        self._manifest = {'traces': {}, 'meta': {}}
+        self._write_manifest()
+
+    def set_keep(self, keep):
+        # unless the rows are kept the blocks are emptied once written
+        assert isinstance(keep, bool)
+        self._keep = keep
+
+    def get_keep(self):
+        return self._keep
+
+    def _write_manifest(self):
+        path = os.path.join(self._directory, _MANIFEST)
+        f = open(path + '.tmp', 'w')
+        json.dump(self._manifest, f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(path + '.tmp', path)
+
+    def add_block(self, block, keys, units):
+        #
+        # the columns of block, for the sensors keys with units. Must be
+        # called before the block gets its first sample
+        #
+        assert len(block) == 0
+        assert len(keys) == block.get_nr_columns()
+        name = block.get_name()
+        assert name and not os.path.exists(os.path.join(self._directory, name))
+        os.mkdir(os.path.join(self._directory, name))
+        time_file = column_file(os.path.join(self._directory, name, 't.npy'))
+        value_files = [column_file(os.path.join(self._directory, name, key + '.npy')) for key in keys]
+        self._blocks.append([block, time_file, value_files, 0])
+        block.set_store(self)
+        for key, unit in zip(keys, units):
+            trace = self._manifest['traces'].setdefault(key, {'unit': unit, 'parts': []})
+            trace['parts'].append({'time': name + '/t.npy', 'values': '%s/%s.npy' % (name, key)})
+        self._write_manifest()
+
+    def meta(self, values):
+        # a dict saved as is in the manifest, e.g. the start times of the sources
+        for key, value in values.items():
+            if isinstance(value, dict) and isinstance(self._manifest['meta'].get(key), dict):
+                self._manifest['meta'][key].update(value)
+            else:
+                self._manifest['meta'][key] = value
+        self._write_manifest()
+
+    def tick(self):
+        # called once per sample, the files lag the samples by at most _FLUSH_PERIOD
+        if time.time() - self._last_flush >= self._flush_period:
+            self.flush()
+
+    def flush(self):
+        for entry in self._blocks:
+            block, time_file, value_files, start = entry
+            if len(block) > start:
+                times, values = block.get_rows(start)
+                time_file.append(times)
+                for f, column in zip(value_files, values):
+                    f.append(column)
+                for f in value_files + [time_file]:
+                    f.commit()
+            if self._keep:
+                entry[3] = len(block)
+            else:
+                block.clear()
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        for block, time_file, value_files, start in self._blocks:
+            for f in value_files + [time_file]:
+                f.close()
+        self._blocks = []
+        self._write_manifest()
+
+
+def read_manifest(directory):
+    return json.load(open(os.path.join(directory, _MANIFEST)))
+
+
+def open_trace(directory, name, manifest=None):
+    #
+    # the (time, values) memmaps of each part of a trace, nothing is read
+    # before they are used. The time and values of a part being written may
+    # not have been appended to the same length yet
+    #
+    if manifest is None:
+        manifest = read_manifest(directory)
+    parts = []
+    for part in manifest['traces'][name]['parts']:
+        times = numpy.load(os.path.join(directory, part['time']), mmap_mode='r')
+        values = numpy.load(os.path.join(directory, part['values']), mmap_mode='r')
+        n = min(len(times), len(values))
+        parts.append((times[:n], values[:n]))
+    return parts
+
+
+def load_trace(directory, name, manifest=None):
+    # the samples of a trace without the missing ones, in time order
+    times = []
+    values = []
+    for t, v in open_trace(directory, name, manifest):
+        present = v == v
+        times.append(t[present])
+        values.append(v[present])
+    if not times:
+        return numpy.empty(0), numpy.empty(0)
+    times = numpy.concatenate(times)
+    values = numpy.concatenate(values)
+    order = numpy.argsort(times, kind='mergesort')
+    return times[order], values[order]
+
+
+def export_run(directory, npz_path=None, mat_path=None):
+    manifest = read_manifest(directory)
+    meta = manifest['meta']
+
+    arrays = {}
+    for name in manifest['traces']:
+        arrays[str(name) + '_t'], arrays[str(name)] = load_trace(directory, name, manifest)
+    for key, value in meta.get('start_time', {}).items():
+        arrays[str(key)] = value
+    # e.g. the statistics of the sampling schedule
+    for key, value in meta.items():
+        if key not in ('start_time', 'timelength', 'period'):
+            arrays[str(key)] = numpy.asarray(value)
+
+    if npz_path is not None:
+        if not npz_path.endswith(".npz"):
+            npz_path = npz_path + ".npz"
+        numpy.savez(npz_path, **arrays)
+
+    if mat_path is not None:
+        if not mat_path.endswith(".mat"):
+            mat_path = mat_path + ".mat"
+        for key in ('timelength', 'period'):
+            if key in meta:
+                arrays[key] = meta[key]
+        mat_writer.save_variables(mat_path, sorted(arrays.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Run directory, as given to server-fetch.py --run-dir")
+    parser.add_argument("-o","--outfile", dest="outfile", default=None, help="Path to the output file (numpy .npz format)")
+    parser.add_argument("-m","--outfile-matlab", dest="outfile_mat", default=None, help="Path to the output file (matlab .mat format)")
+    args = parser.parse_args()
+
+    export_run(args.directory, args.outfile, args.outfile_mat)
+    sys.exit(0)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Stand-in for ipmitool, ipmi-sensors and snmpwalk that prints the output of
+# our Dell and FB servers without talking to a BMC. It is meant to be used as
+# the query wrapper of server-fetch.py, e.g.
+#
+#   server-fetch.py -i -s -f hosts.txt -w "python fake-bmc.py --delay 0.2"
+#
+# runs "python fake-bmc.py --delay 0.2 ipmitool -c -I lanplus ..." instead of
+# the real query. "ipmitool ... shell" reads commands from stdin like the real
+# shell, then --delay is only paid once for the session setup and each command
+# costs --query-delay.
+#
+# With --farm HOST:PORT the output is asked to the query port of bmc_farm.py,
+# its servers are named by the ipmi host and the snmp community of the query.
+#
+
+import os
+import sys
+import time
+import random
+import socket
+
+_NR_FB_SOCKETS = 2
+_NR_FB_CPUS = 32                # two hardware threads per core
+_FARM_TIMEOUT = 2.              # [sec] per attempt
+_FARM_ATTEMPTS = 2
+_MAX_DATAGRAM = 65507
+
+
+def _dell_sdr_list_full():
+    lines = []
+    for i in range(1, 7):
+        lines.append("Fan%d RPM,%d,RPM,ok" % (i, 120*random.randint(28, 34)))
+    lines.append("Inlet Temp,%d,degrees C,ok" % random.randint(20, 22))
+    lines.append("Exhaust Temp,%d,degrees C,ok" % random.randint(28, 32))
+    lines.append("Temp,%d,degrees C,ok" % random.randint(38, 45))
+    lines.append("Temp,%d,degrees C,ok" % random.randint(38, 45))
+    lines.append("CPU Usage,%d,percent,ok" % random.randint(0, 100))
+    lines.append("IO Usage,%d,percent,ok" % random.randint(0, 5))
+    lines.append("MEM Usage,%d,percent,ok" % random.randint(0, 20))
+    lines.append("SYS Usage,%d,percent,ok" % random.randint(0, 100))
+    lines.append("Current 1,%.1f,Amps,ok" % random.uniform(0.4, 1.2))
+    lines.append("Current 2,%.1f,Amps,ok" % random.uniform(0.0, 0.4))
+    lines.append("Voltage 1,%d,Volts,ok" % random.randint(228, 234))
+    lines.append("Voltage 2,%d,Volts,ok" % random.randint(228, 234))
+    lines.append("Pwr Consumption,%d,Watts,ok" % random.randint(120, 300))
+    return lines
+
+
+def _fb_ipmi_sensors():
+    lines = []
+    lines.append("257,Outlet Cntr Temp,%.2f,C,'OK'" % random.randint(20, 30))
+    lines.append("263,Inlet Temp      ,%.2f,C,'OK'" % random.randint(19, 23))
+    lines.append("265,P0 Therm Margin ,%.2f,C,'OK'" % -random.randint(40, 70))
+    lines.append("266,P1 Therm Margin ,%.2f,C,'OK'" % -random.randint(40, 70))
+    lines.append("273,P0 DIMM Temp    ,%.2f,C,'OK'" % random.randint(21, 25))
+    lines.append("274,P1 DIMM Temp    ,%.2f,C,'OK'" % random.randint(21, 25))
+    lines.append("326,SYS_Fan0        ,%.2f,RPM,'OK'" % (25*random.randint(80, 120)))
+    lines.append("327,SYS_Fan1        ,%.2f,RPM,'OK'" % (25*random.randint(80, 120)))
+    return lines
+
+
+def _fb_sdr_list_full():
+    # the FB sensors as printed by ipmitool -c
+    lines = []
+    for l in _fb_ipmi_sensors():
+        sid, name, value, unit, status = l.split(',')
+        unit = {'C': 'degrees C'}.get(unit, unit)
+        lines.append("%s,%d,%s,ok" % (name.strip(), float(value), unit))
+    return lines
+
+
+def _farm_query(farm, args):
+    #
+    # the output lines of the command line args for a server of the farm at
+    # HOST:PORT, see bmc_farm.py. None when the farm cannot answer it
+    #
+    host, sep, port = farm.partition(':')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(_FARM_TIMEOUT)
+    reply = None
+    try:
+        for attempt in range(_FARM_ATTEMPTS):
+            sock.sendto('\0'.join(args), (host, int(port)))
+            try:
+                reply = sock.recv(_MAX_DATAGRAM)
+                break
+            except socket.timeout:
+                continue
+    finally:
+        sock.close()
+    if reply is None:
+        sys.stderr.write("fake-bmc: no answer from the farm at %s\n" % farm)
+        return None
+    status, sep, out = reply.partition('\n')
+    if status != '0':
+        sys.stderr.write("fake-bmc: %s\n" % reply[2:].strip())
+        return None
+    return out.splitlines()
+
+
+def _ipmitool_shell(kind, query_delay, farm=None, args=None):
+    #
+    # a prompt is printed before reading each command, as ipmitool does
+    #
+    while True:
+        sys.stdout.write('ipmitool> ')
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line:
+            return
+        cmd = line.strip()
+        if cmd in ('exit', 'quit'):
+            return
+        if cmd.startswith('echo'):
+            sys.stdout.write(cmd[4:].strip() + '\n')
+        elif cmd == 'sdr list full':
+            if query_delay > 0:
+                time.sleep(random.uniform(0.5*query_delay, 1.5*query_delay))
+            if farm is not None:
+                # the command line of the shell, with the command instead of shell
+                lines = _farm_query(farm, args[:-1] + cmd.split()) or []
+            elif kind == 'fb':
+                lines = _fb_sdr_list_full()
+            else:
+                lines = _dell_sdr_list_full()
+            sys.stdout.write('\n'.join(lines) + '\n')
+        elif cmd:
+            sys.stdout.write('Invalid command: %s\n' % cmd)
+        sys.stdout.flush()
+
+
+def _snmpwalk(mib, nr_cpus=_NR_FB_CPUS):
+    if mib.endswith('temperatureProbeReading'):
+        # inlet, exhaust, CPU 1, CPU 2 in tens of degrees Celsius
+        return [str(random.randint(200, 220)), str(random.randint(280, 320)),
+                str(random.randint(380, 450)), str(random.randint(380, 450))]
+    if mib.endswith('coolingDeviceReading'):
+        return [str(120*random.randint(28, 34)) for i in range(6)]
+    if mib.endswith('lmTempSensorsValue'):
+        # socket average followed by the cores, in thousandths of a degree
+        values = []
+        for sockid in range(_NR_FB_SOCKETS):
+            for core in range(nr_cpus//(2*_NR_FB_SOCKETS) + 1):
+                values.append(str(1000*random.randint(30, 60)))
+        return values
+    if mib.endswith('hrProcessorLoad'):
+        return [str(random.randint(0, 100)) for i in range(nr_cpus)]
+    return []
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    delay = 0.
+    query_delay = 0.
+    kind = 'dell'
+    nr_cpus = _NR_FB_CPUS
+    farm = None
+    while args and args[0].startswith('--'):
+        if args[0] == '--delay' and len(args) > 1:
+            delay = float(args[1])
+            args = args[2:]
+        elif args[0] == '--query-delay' and len(args) > 1:
+            query_delay = float(args[1])
+            args = args[2:]
+        elif args[0] == '--kind' and len(args) > 1:
+            # the sensors printed by ipmitool, ipmi-sensors always prints the FB ones
+            kind = args[1]
+            args = args[2:]
+        elif args[0] == '--cpus' and len(args) > 1:
+            # the FB node walked by snmpwalk
+            nr_cpus = int(args[1])
+            args = args[2:]
+        elif args[0] == '--farm' and len(args) > 1:
+            # HOST:PORT of the queries of bmc_farm.py
+            farm = args[1]
+            args = args[2:]
+        else:
+            sys.stderr.write("fake-bmc: unknown option %s\n" % args[0])
+            sys.exit(1)
+
+    if not args:
+        sys.stderr.write("usage: fake-bmc.py [--delay SEC] [--query-delay SEC] [--kind dell|fb] [--cpus N] [--farm HOST:PORT] ipmitool|ipmi-sensors|snmpwalk ARGS...\n")
+        sys.exit(1)
+
+    # the BMC round trip
+    if delay > 0:
+        time.sleep(random.uniform(0.5*delay, 1.5*delay))
+
+    tool = os.path.basename(args[0])
+    if tool == 'ipmitool' and args[-1] == 'shell':
+        _ipmitool_shell(kind, query_delay, farm, args)
+        sys.exit(0)
+    elif farm is not None:
+        lines = _farm_query(farm, args)
+        if lines is None:
+            sys.exit(1)
+    elif tool == 'ipmitool' and kind == 'fb':
+        lines = _fb_sdr_list_full()
+    elif tool == 'ipmitool':
+        lines = _dell_sdr_list_full()
+    elif tool == 'ipmi-sensors':
+        lines = _fb_ipmi_sensors()
+    elif tool == 'snmpwalk':
+        lines = _snmpwalk(args[-1], nr_cpus)
+    else:
+        sys.stderr.write("fake-bmc: unknown tool %s\n" % tool)
+        sys.exit(1)
+
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.exit(0)
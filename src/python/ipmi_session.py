@@ -0,0 +1,204 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# A long-lived "ipmitool shell" co-process, so that the RMCP+ session setup and
+# the SDR repository walk are paid once and not at every sample. Each query is
+# followed by an "echo" of a unique marker, the answer is everything printed
+# before the marker.
+#
+
+import os
+import time
+import shlex
+import select
+import subprocess
+
+_READ_SIZE = 65536
+_PROMPT = 'ipmitool> '
+
+#
+# ipmitool prints these when the BMC dropped or refused the session
+#
+_SESSION_ERRORS = ('Unable to establish', 'Error: Unable', 'Activate Session', 'Close Session',
+                   'Insufficient privilege', 'session timeout')
+
+
+class ipmi_session_error(Exception):
+    pass
+
+
+class ipmi_session_timeout(ipmi_session_error):
+    # no answer in time, the co-process was killed
+    pass
+
+
+class ipmi_session(object):
+    def __init__(self, cmd, query, timeout=5.):
+        assert isinstance(cmd, str)
+        assert isinstance(query, str)
+        assert timeout > 0
+        self._cmd = cmd
+        self._query = query
+        self._timeout = timeout
+        self._proc = None
+        self._buffer = ''
+        self._marker = None
+        self._serial = 0
+
+        # latency bookkeeping, see get_stats()
+        self._nr_connects = 0
+        self._nr_first = 0
+        self._first_latency = 0.
+        self._nr_reused = 0
+        self._reused_latency = 0.
+        self._is_first = False
+        self._sent_at = None
+
+    def _start(self):
+        self._proc = subprocess.Popen(shlex.split(self._cmd), shell=False, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self._buffer = ''
+        self._nr_connects += 1
+        self._is_first = True
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.write('exit\n')
+            self._proc.stdin.close()
+        except IOError:
+            pass
+        if self._proc.poll() is None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+        self._proc.stdout.close()
+        self._proc.wait()
+        self._proc = None
+
+    def send(self):
+        #
+        # send the query without waiting for the answer, it is read by
+        # receive() so that other queries can run in the meantime
+        #
+        if self._proc is None or self._proc.poll() is not None:
+            self.close()
+            self._start()
+        self._serial += 1
+        self._marker = '__ipmi_session_%d_%d__' % (os.getpid(), self._serial)
+        self._sent_at = time.time()
+        try:
+            self._proc.stdin.write('%s\necho %s\n' % (self._query, self._marker))
+            self._proc.stdin.flush()
+        except IOError:
+            # the co-process died, receive() reports it
+            pass
+
+    def _read_until_marker(self, deadline=None):
+        fd = self._proc.stdout.fileno()
+        if deadline is None:
+            deadline = self._sent_at + self._timeout
+        deadline = min(deadline, self._sent_at + self._timeout)
+        while True:
+            idx = self._buffer.find(self._marker)
+            if idx >= 0:
+                answer = self._buffer[:idx]
+                self._buffer = self._buffer[idx + len(self._marker):].lstrip('\r\n')
+                return answer
+            left = deadline - time.time()
+            if left <= 0:
+                raise ipmi_session_timeout('no answer within %.3f [sec]' % (deadline - self._sent_at))
+            readable, w, x = select.select([fd], [], [], left)
+            if not readable:
+                continue
+            data = os.read(fd, _READ_SIZE)
+            if not data:
+                raise ipmi_session_error('ipmitool exited')
+            self._buffer = self._buffer + data
+
+    def receive(self, deadline=None):
+        #
+        # with a deadline (time.time()) earlier than the timeout of the
+        # session, a query still unanswered then is given up and the session
+        # closed, it is reopened by the next send()
+        #
+        try:
+            answer = self._read_until_marker(deadline)
+        except ipmi_session_error:
+            self.close()
+            raise
+
+        lines = []
+        for l in answer.splitlines():
+            # the prompt is printed before every command we write
+            while l.startswith(_PROMPT):
+                l = l[len(_PROMPT):]
+            if not l:
+                continue
+            for e in _SESSION_ERRORS:
+                if e in l:
+                    self.close()
+                    raise ipmi_session_error(l)
+            lines.append(l)
+        if not lines:
+            # a live session always has sensors to report
+            self.close()
+            raise ipmi_session_error('empty answer')
+
+        latency = time.time() - self._sent_at
+        if self._is_first:
+            self._nr_first += 1
+            self._first_latency += latency
+            self._is_first = False
+        else:
+            self._nr_reused += 1
+            self._reused_latency += latency
+        return '\n'.join(lines) + '\n'
+
+    def query(self, deadline=None):
+        #
+        # one reconnect is attempted when the BMC dropped the session, not
+        # when it did not answer in time
+        #
+        self.send()
+        try:
+            return self.receive(deadline)
+        except ipmi_session_timeout:
+            raise
+        except ipmi_session_error:
+            self.send()
+            return self.receive(deadline)
+
+    def get_stats(self):
+        #
+        # the first answer of a session pays the handshake and SDR walk just
+        # like a fresh ipmitool process, the difference to the answers of the
+        # reused session is what the reuse saves at every sample
+        #
+        stats = {'connects': self._nr_connects, 'reused': self._nr_reused,
+                 'first_latency': None, 'reused_latency': None, 'saved_per_sample': None}
+        if self._nr_first:
+            stats['first_latency'] = self._first_latency/self._nr_first
+        if self._nr_reused:
+            stats['reused_latency'] = self._reused_latency/self._nr_reused
+        if self._nr_first and self._nr_reused:
+            stats['saved_per_sample'] = stats['first_latency'] - stats['reused_latency']
+        return stats
@@ -0,0 +1,421 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Level 5 MAT-file writer that streams each variable to the file as it is
+# given, instead of building a dict of all of them for scipy.io.savemat. The
+# files are the uncompressed ones written by savemat, a 1-D array is a row
+# vector and a scalar a 1x1 matrix.
+#
+# A file opened with append=True can get new variables, have its variables
+# replaced and its row vectors extended with new samples. Each variable is
+# then written with as much room again as its data after it, inside its
+# miMATRIX element: the readers move to the next variable with the size of
+# the element and skip it. Samples are appended in place while the room
+# lasts, when a variable outgrows it the file is rewritten once with the room
+# of the grown variables doubled and renamed over the old one. The changes
+# are applied by close().
+#
+
+import os
+import time
+import struct
+import collections
+import numpy
+
+_HEADER_SIZE = 128
+_TAG = struct.Struct('<II')
+_COPY_SIZE = 1024*1024
+
+_MI_INT8 = 1
+_MI_INT32 = 5
+_MI_UINT32 = 6
+_MI_MATRIX = 14
+_MI_UTF8 = 16
+_MX_CHAR = 4
+_MX_LOGICAL = 0x02      # array flag
+
+# dtype -> (miTYPE of the data, mxCLASS of the array)
+_TYPES = {
+    numpy.dtype('<f8'): (9, 6),
+    numpy.dtype('<f4'): (7, 7),
+    numpy.dtype('i1'): (1, 8),
+    numpy.dtype('u1'): (2, 9),
+    numpy.dtype('<i2'): (3, 10),
+    numpy.dtype('<u2'): (4, 11),
+    numpy.dtype('<i4'): (5, 12),
+    numpy.dtype('<u4'): (6, 13),
+    numpy.dtype('<i8'): (12, 14),
+    numpy.dtype('<u8'): (13, 15),
+}
+_MI_DTYPES = dict((mi, dtype) for dtype, (mi, mx) in _TYPES.items())
+_CLASS_TYPES = dict((mx, mi) for dtype, (mi, mx) in _TYPES.items())
+
+
+def _pad8(n):
+    return (n + 7) & ~7
+
+
+def _as_matrix(value):
+    #
+    # the array saved for a value, its matlab dims and array flags, as
+    # savemat does it. A string is a row of chars
+    #
+    if isinstance(value, numpy.ndarray) and value.dtype.kind in 'SU' and value.ndim == 0:
+        value = value[()]
+    if isinstance(value, (str, unicode)):
+        if isinstance(value, str):
+            value = value.decode('utf-8')
+        a = numpy.frombuffer(value.encode('utf-8'), dtype=numpy.uint8)
+        return a, (1, len(value)) if len(value) else (0, 0), None
+    a = numpy.asarray(value)
+    flags = 0
+    if a.dtype == numpy.bool_:
+        a = a.astype(numpy.uint8)
+        flags = _MX_LOGICAL
+    a = a.astype(a.dtype.newbyteorder('<'), copy=False)
+    if a.dtype not in _TYPES:
+        raise ValueError('cannot save arrays of %s' % a.dtype)
+    if a.ndim == 0:
+        dims = (1, 1)
+    elif a.ndim == 1:
+        dims = (1, len(a)) if len(a) else (0, 0)
+    else:
+        dims = a.shape
+    # matlab stores the columns one after the other
+    return numpy.ascontiguousarray(a.T), dims, flags
+
+
+def _write_zeros(f, n):
+    while n > 0:
+        chunk = min(n, _COPY_SIZE)
+        f.write('\0'*chunk)
+        n = n - chunk
+
+
+class mat_variable(object):
+    #
+    # where a variable lives in the file. offset is its miMATRIX tag, size
+    # the size of the element after the tag, data the offset of the tag of
+    # the real part and nbytes the size of the real part
+    #
+    def __init__(self, name, offset, size, dims=None, dims_offset=None, data=None, nbytes=0, mi_type=None):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.dims = dims
+        self.dims_offset = dims_offset
+        self.data = data
+        self.nbytes = nbytes
+        self.mi_type = mi_type
+
+    def get_end(self):
+        return self.offset + _TAG.size + self.size
+
+    def is_row(self):
+        return self.dims is not None and len(self.dims) == 2 and (self.dims[0] == 1 or self.dims == (0, 0))
+
+
+def _element_size(name, dims, nbytes, room):
+    # the size of a miMATRIX element after its tag
+    if len(name) <= 4:
+        name_size = 8
+    else:
+        name_size = _TAG.size + _pad8(len(name))
+    return 16 + _TAG.size + _pad8(4*len(dims)) + name_size + _TAG.size + _pad8(nbytes + room)
+
+
+def _write_element(f, name, value, room=0):
+    #
+    # write a variable at the current position of f, room bytes are left
+    # free after its data. Returns its mat_variable
+    #
+    data, dims, flags = _as_matrix(value)
+    if flags is None:
+        mi_type, mx_class, flags = _MI_UTF8, _MX_CHAR, 0
+    else:
+        mi_type, mx_class = _TYPES[data.dtype]
+    nbytes = data.nbytes
+    offset = f.tell()
+    size = _element_size(name, dims, nbytes, room)
+    f.write(_TAG.pack(_MI_MATRIX, size))
+    f.write(_TAG.pack(_MI_UINT32, 8) + struct.pack('<II', mx_class | (flags << 8), 0))
+    dims_offset = f.tell()
+    f.write(_TAG.pack(_MI_INT32, 4*len(dims)) + struct.pack('<%di' % len(dims), *dims))
+    _write_zeros(f, _pad8(4*len(dims)) - 4*len(dims))
+    if len(name) <= 4:
+        # small data element
+        f.write(struct.pack('<HH', _MI_INT8, len(name)) + name + '\0'*(4 - len(name)))
+    else:
+        f.write(_TAG.pack(_MI_INT8, len(name)) + name + '\0'*(_pad8(len(name)) - len(name)))
+    data_offset = f.tell()
+    f.write(_TAG.pack(mi_type, nbytes))
+    # views of the caller's buffers are written without a copy
+    data.tofile(f)
+    _write_zeros(f, _pad8(nbytes + room) - nbytes)
+    return mat_variable(name, offset, size, tuple(dims), dims_offset, data_offset, nbytes, mi_type)
+
+
+def _read_subelement(data, pos):
+    # (type, payload, position after it) of a tag at pos, in either format
+    mi_type, n = _TAG.unpack_from(data, pos)
+    if mi_type >> 16:
+        return mi_type & 0xffff, data[pos + 4:pos + 4 + (mi_type >> 16)], pos + 8
+    return mi_type, data[pos + 8:pos + 8 + n], pos + 8 + _pad8(n)
+
+
+def read_variables(path):
+    #
+    # the mat_variables of a file, in file order. The compressed variables,
+    # the arrays that are not numeric and the ones stored in a smaller type
+    # (as matlab does) are listed without dims, they are copied as they are
+    #
+    variables = []
+    f = open(path, 'rb')
+    header = f.read(_HEADER_SIZE)
+    if len(header) != _HEADER_SIZE or header[126:128] != 'IM':
+        raise IOError('%s is not a little endian level 5 MAT-file' % path)
+    while True:
+        offset = f.tell()
+        tag = f.read(_TAG.size)
+        if len(tag) < _TAG.size:
+            break
+        mi_type, size = _TAG.unpack(tag)
+        if mi_type != _MI_MATRIX:
+            variables.append(mat_variable(None, offset, size))
+            f.seek(size, 1)
+            continue
+        # the flags, dims and name come first and are small
+        head = f.read(min(size, 512))
+        flags_type, flags, pos = _read_subelement(head, 0)
+        dims_type, dims, pos = _read_subelement(head, pos)
+        dims_offset = offset + _TAG.size + pos - _pad8(len(dims)) - _TAG.size
+        name_type, name, pos = _read_subelement(head, pos)
+        var = mat_variable(name, offset, size)
+        mx_class = struct.unpack_from('<I', flags)[0] & 0xff
+        if mx_class in _CLASS_TYPES and pos + _TAG.size <= len(head):
+            real_type, nbytes = _TAG.unpack_from(head, pos)
+            if real_type == _CLASS_TYPES[mx_class]:
+                var.dims = struct.unpack('<%di' % (len(dims)//4), dims)
+                var.dims_offset = dims_offset
+                var.data = offset + _TAG.size + pos
+                var.nbytes = nbytes
+                var.mi_type = real_type
+        variables.append(var)
+        f.seek(offset + _TAG.size + size)
+    f.close()
+    return variables
+
+
+class mat_writer(object):
+    def __init__(self, path, append=False, grow=None):
+        #
+        # with append an existing file is changed, otherwise a new one is
+        # written. With grow its variables get room to be appended to later,
+        # by default when appending
+        #
+        assert isinstance(path, str)
+        self._path = path
+        self._room = append if grow is None else grow
+        self._variables = []
+        self._names = {}
+        # name -> the arrays queued by append(), name -> value queued by write()
+        self._appended = {}
+        self._replaced = collections.OrderedDict()
+        self._file = None
+        if append and os.path.exists(path):
+            self._variables = read_variables(path)
+            self._names = dict((var.name, var) for var in self._variables if var.name is not None)
+        else:
+            self._file = open(path, 'wb')
+            text = 'MATLAB 5.0 MAT-file, Platform: %s, Created on: %s' % (os.name, time.asctime())
+            self._file.write(text[:116].ljust(116) + '\0'*8 + struct.pack('<H', 0x0100) + 'IM')
+
+    def get_names(self):
+        return [var.name for var in self._variables if var.name is not None]
+
+    def get_length(self, name):
+        # nr. of values of a row vector in the file, 0 if it is not there
+        var = self._names.get(name)
+        if var is None or not var.is_row():
+            return 0
+        return var.dims[1]
+
+    def _add(self, var):
+        self._variables.append(var)
+        self._names[var.name] = var
+
+    def write(self, name, value):
+        assert isinstance(name, str)
+        assert len(name) > 0
+        if self._file is None:
+            # replaced when the file is closed
+            self._appended.pop(name, None)
+            self._replaced[name] = value
+            return
+        assert name not in self._names, "%s is already written" % name
+        room = 0
+        if self._room:
+            room = _as_matrix(value)[0].nbytes
+        self._add(_write_element(self._file, name, value, room))
+
+    def append(self, name, values):
+        #
+        # extend the row vector name with values, it is a new variable if
+        # it is not in the file yet
+        #
+        assert isinstance(name, str)
+        values = numpy.asarray(values)
+        assert values.ndim == 1
+        if name in self._replaced:
+            self._replaced[name] = numpy.concatenate((numpy.ravel(self._replaced[name]), values))
+        elif name not in self._names:
+            self.write(name, values)
+        elif self._file is not None:
+            raise ValueError('%s is already written' % name)
+        elif not self._names[name].is_row():
+            raise ValueError('%s is not a row vector of numbers' % name)
+        else:
+            self._appended.setdefault(name, []).append(values)
+
+    def _fits(self, var, nbytes):
+        # whether nbytes of data fit in the element of the variable
+        return var.dims is not None and var.data + _TAG.size + _pad8(nbytes) <= var.get_end()
+
+    def _appended_size(self, var):
+        itemsize = _MI_DTYPES[var.mi_type].itemsize
+        return var.nbytes + itemsize*sum(len(values) for values in self._appended[var.name])
+
+    def _append_in_place(self, f, var):
+        dtype = _MI_DTYPES[var.mi_type]
+        f.seek(var.data + _TAG.size + var.nbytes)
+        n = 0
+        for values in self._appended[var.name]:
+            numpy.ascontiguousarray(values, dtype=dtype).tofile(f)
+            n = n + len(values)
+        var.nbytes = var.nbytes + n*dtype.itemsize
+        _write_zeros(f, _pad8(var.nbytes) - var.nbytes)
+        f.seek(var.data)
+        f.write(_TAG.pack(var.mi_type, var.nbytes))
+        var.dims = (1, var.dims[0]*var.dims[1] + n)
+        f.seek(var.dims_offset + _TAG.size)
+        f.write(struct.pack('<ii', *var.dims))
+
+    def _replace_in_place(self, f, var, value):
+        # the element keeps its size, the readers skip what is left of it
+        f.seek(var.offset)
+        new = _write_element(f, var.name, value)
+        f.seek(var.offset)
+        f.write(_TAG.pack(_MI_MATRIX, var.size))
+        new.size = var.size
+        return new
+
+    def _read_row(self, f, var):
+        dtype = _MI_DTYPES[var.mi_type]
+        f.seek(var.data + _TAG.size)
+        return numpy.fromfile(f, dtype=dtype, count=var.nbytes//dtype.itemsize)
+
+    def _rewrite(self):
+        #
+        # a new file with the changes and room for the changed variables to
+        # grow, the others are copied as they are
+        #
+        tmp_path = self._path + '.tmp'
+        src = open(self._path, 'rb')
+        dst = open(tmp_path, 'wb')
+        dst.write(src.read(_HEADER_SIZE))
+        variables = []
+        for var in self._variables:
+            if var.name in self._replaced:
+                value = self._replaced.pop(var.name)
+                variables.append(_write_element(dst, var.name, value, _as_matrix(value)[0].nbytes))
+            elif var.name in self._appended:
+                values = numpy.concatenate([self._read_row(src, var)] + self._appended[var.name])
+                variables.append(_write_element(dst, var.name, values, values.nbytes))
+            else:
+                shift = dst.tell() - var.offset
+                src.seek(var.offset)
+                n = _TAG.size + var.size
+                while n > 0:
+                    chunk = src.read(min(n, _COPY_SIZE))
+                    dst.write(chunk)
+                    n = n - len(chunk)
+                var.offset = var.offset + shift
+                if var.dims is not None:
+                    var.dims_offset = var.dims_offset + shift
+                    var.data = var.data + shift
+                variables.append(var)
+        src.close()
+        self._variables = []
+        self._names = {}
+        for var in variables:
+            self._add(var)
+        self._write_new(dst)
+        dst.flush()
+        os.fsync(dst.fileno())
+        dst.close()
+        os.rename(tmp_path, self._path)
+
+    def _write_new(self, f):
+        # the variables that are not in the file yet, at its end
+        f.seek(0, 2)
+        for name, value in self._replaced.items():
+            self._add(_write_element(f, name, value, _as_matrix(value)[0].nbytes))
+        self._replaced.clear()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            return
+        #
+        # the samples that fit in the room of their variable are appended
+        # in place, so is a replaced variable written over the old one.
+        # Anything else needs a new file
+        #
+        in_place = True
+        for name, value in self._replaced.items():
+            if name in self._names and not self._fits(self._names[name], _as_matrix(value)[0].nbytes):
+                in_place = False
+        for name in self._appended:
+            if not self._fits(self._names[name], self._appended_size(self._names[name])):
+                in_place = False
+        if not in_place:
+            self._rewrite()
+        else:
+            f = open(self._path, 'r+b')
+            for name in self._appended:
+                self._append_in_place(f, self._names[name])
+            for name in [name for name in self._replaced if name in self._names]:
+                var = self._replace_in_place(f, self._names[name], self._replaced.pop(name))
+                self._variables[self._variables.index(self._names[name])] = var
+                self._names[name] = var
+            self._write_new(f)
+            f.close()
+        self._appended = {}
+
+
+def save_variables(path, variables):
+    #
+    # write the (name, value) pairs one at a time, the values can be
+    # produced by a generator so that they do not all exist at once
+    #
+    writer = mat_writer(path)
+    for name, value in variables:
+        writer.write(name, value)
+    writer.close()
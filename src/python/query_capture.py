@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Capture of the raw output of the BMC queries of a run, so that it can be
+# replayed through the parsers of server-fetch.py without the hardware. A
+# capture is _MAGIC then frames
+#
+#   <tag:4s><time:f64><payload length:u32><payload>
+#
+#   META   0, a JSON dict: the server and query kinds first, then the start
+#          times of the sources
+#   TICK   the offset of the tick from the first one, empty
+#   WALK   0, the first walk of the snmp subtrees with a sensor per value
+#   IPMI   the time of the ipmi sample, the output of ipmitool/ipmi-sensors
+#   SNMP   the time of the snmp sample, <subtree>\0<snmpwalk output> per
+#          subtree queried, joined by \0
+#
+# The frames are appended as the queries complete and flushed once per tick,
+# a capture cut by a crash is read up to its last complete frame. The values
+# of the native snmp client are captured as the output of snmpwalk -Oqv.
+#
+# Usage: query_capture.py FILE prints a summary of a capture.
+#
+
+import sys
+import json
+import time
+import struct
+import argparse
+import collections
+
+_MAGIC = 'OCSCAP01'
+_FRAME = struct.Struct('<4sdI')
+_TAGS = ('META', 'TICK', 'WALK', 'IPMI', 'SNMP')
+_FLUSH_PERIOD = 1.          # [sec]
+
+
+def join_walks(mibs, outputs):
+    return '\0'.join(sum([[mib, out] for mib, out in zip(mibs, outputs)], []))
+
+
+def split_walks(payload):
+    # (subtrees, outputs) of a WALK or SNMP frame
+    if not payload:
+        return [], []
+    fields = payload.split('\0')
+    return fields[0::2], fields[1::2]
+
+
+def format_walk(values):
+    # the values of the native client as snmpwalk -Oqv prints them
+    return ''.join('%r\n' % float(value) for value in values)
+
+
+class query_capture(object):
+    def __init__(self, path, meta, flush_period=_FLUSH_PERIOD):
+        assert isinstance(path, str)
+        assert isinstance(meta, dict)
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._flush_period = flush_period
+        self._last_flush = time.time()
+        self.meta(meta)
+
+    def _write(self, tag, t, payload):
+        self._file.write(_FRAME.pack(tag, t, len(payload)))
+        self._file.write(payload)
+
+    def meta(self, values):
+        # also the sink of the start times of the traces
+        self._write('META', 0., json.dumps(values))
+
+    def tick(self, offset):
+        if time.time() - self._last_flush >= self._flush_period:
+            self._file.flush()
+            self._last_flush = time.time()
+        self._write('TICK', offset, '')
+
+    def add_walks(self, mibs, outputs):
+        self._write('WALK', 0., join_walks(mibs, outputs))
+
+    def add_ipmi(self, meas_t, output):
+        self._write('IPMI', meas_t, output)
+
+    def add_snmp(self, meas_t, mibs, outputs):
+        self._write('SNMP', meas_t, join_walks(mibs, outputs))
+
+    def close(self):
+        self._file.close()
+
+
+def read_frames(path):
+    #
+    # the (tag, time, payload) of the frames of a capture, up to the first
+    # truncated or unknown one
+    #
+    data = open(path, 'rb').read()
+    if not data.startswith(_MAGIC):
+        raise IOError('%s is not a capture' % path)
+    pos = len(_MAGIC)
+    while pos + _FRAME.size <= len(data):
+        tag, t, n = _FRAME.unpack_from(data, pos)
+        start = pos + _FRAME.size
+        if tag not in _TAGS or start + n > len(data):
+            break
+        yield tag, t, data[start:start + n]
+        pos = start + n
+
+
+def read_meta(path):
+    # the META frame written when the capture was opened
+    for tag, t, payload in read_frames(path):
+        if tag == 'META':
+            return json.loads(payload)
+        break
+    raise IOError('%s has no META frame' % path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="Capture, as given to server-fetch.py --capture")
+    args = parser.parse_args()
+
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    last_tick = 0.
+    for tag, t, payload in read_frames(args.path):
+        counts[tag] += 1
+        sizes[tag] += len(payload)
+        if tag == 'TICK':
+            last_tick = t
+    print "%s: %s" % (args.path, json.dumps(read_meta(args.path), sort_keys=True))
+    print "  %d ticks over %.1f [sec]" % (counts['TICK'], last_tick)
+    for tag in _TAGS:
+        if counts[tag]:
+            print "  %s %8d frames %10d bytes" % (tag, counts[tag], sizes[tag])
+    sys.exit(0)
@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Binary format of the relayed samples. The stream is a series of frames
+#
+#   <payload length:u32><type:1s><payload>
+#
+# S  schema     a JSON dict with the column names and units, the names of the
+#               times at the head of each sample and free meta data (e.g. the
+#               start times of the sources)
+# K  key frame  <times:f64 * nr. of times><values:f32 * nr. of columns>
+# D  delta      <times:f64 * nr. of times><bitmap of the changed columns>
+#               <values of the changed columns:f32>, relative to the frame
+#               before it
+# E  error      a JSON dict with the reason a subscription was refused
+# R  reply      a JSON dict answering a query
+#
+# A viewer always gets a schema and a key frame first, and again whenever the
+# relay had to drop frames for it or the schema changed. The bitmap has one bit
+# per column, most significant bit first, a column changed when the bits of
+# its float32 value changed (so NaN -> NaN is unchanged).
+#
+# A viewer gets all the sensors at every sample until it sends a subscription,
+# a JSON dict on one line
+#
+#   {"sensors": "u_*,x_i", "rate": 0.2, "aggregate": "mean"}
+#
+# sensors   name patterns of the columns to send (default all)
+# rate      [Hz] frames per second, every sample when missing or 0
+# aggregate what a frame holds of the samples since the one before it: the
+#           last one, their mean or their min and max (the columns <name>_min
+#           followed by the columns <name>_max)
+#
+# or a query, a JSON dict on one line with the name of the query and its
+# arguments, answered with an R frame (a REPLY:<JSON> line on a text relay)
+#
+#   {"query": "phases", "recent": true}
+#
+# phases    the time spent in each phase of the ticks of the collector, of
+#           its last laps or of the whole run
+# queries   per source the nr. of queries, of the ones given up at their
+#           deadline and of the failed ones
+# rollup    the samples of a sensor between t0 and t1 (the whole run when
+#           missing, in [sec] from the start of its source) in at most
+#           points buckets (default 1000), with their min, max, mean and
+#           count, from the server-fetch.py --rollup resolution that holds
+#           them, e.g. {"query": "rollup", "sensor": "x_i", "points": 200}
+# window    the samples of a sensor between t0 and t1 (the whole run when
+#           missing), the first limit of them (default and at most 1000).
+#           When the window has more, "next" is the t0 of the next page
+# at        the value of each of the sensors ("x_i,u_1" or a list) at t
+# latest    the last n samples (default 1) of each of the sensors, of all of
+#           them when missing, at most 1000 samples in all
+#
+# The samples are {"t": [...], "value": [...]}, a missed one is null. The
+# times are in [sec] from the start of the source of the sensor, as in the
+# output files of server-fetch.py. A viewer catching up with the history when
+# it connects pages through a window. The replies are encoded on the relay
+# thread, so they are kept small enough not to hold up the frames of the
+# other viewers.
+#
+# The reply is {"query": <name>, "result": ...} or {"query": <name>, "error":
+# <reason>}. It does not change what the viewer is sent.
+#
+# Usage: relay_protocol.py [HOST] [PORT] [-s PATTERNS] [-r RATE] [-a AGGREGATE]
+# prints the samples of a relay, with -q QUERY [-A KEY=VALUE ...] the reply to
+# the query.
+#
+
+import sys
+import json
+import fnmatch
+import struct
+import socket
+import argparse
+import numpy
+
+_FRAME = struct.Struct('<Ic')
+_VERSION = 1
+_READ_SIZE = 65536
+_AGGREGATES = ('last', 'mean', 'minmax')
+_TIME_EPS = 1e-6    # [sec] tolerance on the end of a window
+
+
+def _frame(kind, payload):
+    return _FRAME.pack(len(payload), kind) + payload
+
+
+class frame_encoder(object):
+    def __init__(self, names, units, times=(), delta=False):
+        assert len(names) == len(units)
+        assert isinstance(delta, bool)
+        self._names = list(names)
+        self._units = list(units)
+        self._times = list(times)
+        self._delta = delta
+        self._meta = {}
+        self._schema = None
+        self._last = None
+        self._pack_times = struct.Struct('<%dd' % len(self._times))
+        self._pack_values = struct.Struct('<%df' % len(self._names))
+
+    def set_meta(self, key, value):
+        # returns True when the schema changed and has to be sent again
+        if self._meta.get(key) == value:
+            return False
+        self._meta[key] = value
+        self._schema = None
+        return True
+
+    def get_schema(self):
+        if self._schema is None:
+            schema = {'version': _VERSION, 'names': self._names, 'units': self._units,
+                      'times': self._times, 'delta': self._delta, 'meta': self._meta}
+            self._schema = _frame('S', json.dumps(schema))
+        return self._schema
+
+    def encode(self, times, values):
+        #
+        # returns (frame, key frame) of a sample, they are the same frame
+        # unless delta encoding is on. None times are sent as NaN
+        #
+        assert len(times) == len(self._times)
+        assert len(values) == len(self._names)
+        head = self._pack_times.pack(*[numpy.nan if t is None else t for t in times])
+        packed = self._pack_values.pack(*values)
+        key = _frame('K', head + packed)
+        if not self._delta:
+            return key, key
+
+        # compared as bits, the float32 rounding and NaN are taken care of
+        bits = numpy.frombuffer(packed, dtype='<u4')
+        if self._last is None:
+            changed = numpy.ones(len(bits), dtype=bool)
+        else:
+            changed = bits != self._last
+        self._last = bits
+        delta = _frame('D', head + numpy.packbits(changed).tostring() + bits[changed].tostring())
+        return delta, key
+
+
+def subscription_request(patterns=('*',), rate=None, aggregate='last'):
+    return json.dumps({'sensors': ','.join(patterns), 'rate': rate, 'aggregate': aggregate}) + '\n'
+
+
+def query_request(name, **args):
+    return json.dumps(dict(args, query=name)) + '\n'
+
+
+def parse_request(line):
+    # the JSON dict a viewer sent, a subscription or a query
+    try:
+        request = json.loads(line)
+    except ValueError:
+        raise ValueError('a request is a JSON dict on one line')
+    if not isinstance(request, dict):
+        raise ValueError('a request is a JSON dict on one line')
+    return request
+
+
+def answer_query(queries, request):
+    #
+    # the reply to a query, queries maps its name to a function of the request
+    # returning a JSON-able result or raising ValueError for bad arguments. A
+    # missing or mistyped argument it did not check is an error reply too
+    #
+    name = request.get('query')
+    if not isinstance(name, basestring) or name not in queries:
+        return {'query': name, 'error': 'unknown query, expected one of %s' % ', '.join(sorted(queries))}
+    try:
+        return {'query': name, 'result': queries[name](request)}
+    except KeyError as e:
+        return {'query': name, 'error': 'missing argument %s' % e}
+    except (ValueError, TypeError) as e:
+        return {'query': name, 'error': str(e)}
+
+
+def parse_subscription(line):
+    #
+    # (patterns, period, aggregate) of a subscription, it is the channel of
+    # the relay so viewers with the same subscription share their frames
+    #
+    request = parse_request(line)
+    patterns = request.get('sensors') or '*'
+    if isinstance(patterns, basestring):
+        patterns = patterns.split(',')
+    if not isinstance(patterns, list):
+        raise ValueError('the sensors are a list of name patterns')
+    patterns = tuple(sorted(set(str(p).strip() for p in patterns if str(p).strip())))
+    rate = request.get('rate') or 0
+    if not isinstance(rate, (int, float)) or rate < 0:
+        raise ValueError('the rate must be a positive number of frames per second')
+    period = 1./rate if rate > 0 else 0.
+    aggregate = request.get('aggregate') or 'last'
+    if aggregate not in _AGGREGATES:
+        raise ValueError('the aggregate must be one of %s' % ', '.join(_AGGREGATES))
+    return patterns, period, str(aggregate)
+
+
+class window_aggregate(object):
+    #
+    # the aggregate of all the columns over windows ending on the multiples of
+    # the period, updated with every sample so a window costs the same
+    # whatever its length. The subscriptions with the same period and
+    # aggregate share it and only pick their columns when a window ends
+    #
+    def __init__(self, period=0., aggregate='last'):
+        assert period >= 0
+        assert aggregate in _AGGREGATES
+        self._period = period
+        self._aggregate = aggregate
+        self._next = None
+        self._n = 0
+        self._value = None
+        self._max = None
+        self._count = None      # samples of each column in the window, for the mean
+
+    def add(self, t, values):
+        #
+        # values is a float64 array of all the columns and t the time of the
+        # sample [sec], NaN where a column was missed. Returns the aggregate
+        # at the end of each window, NaN for a column missed in all of it
+        #
+        if self._aggregate == 'last':
+            self._value = values
+        elif self._aggregate == 'mean':
+            present = values == values
+            if self._n == 0:
+                # values is shared by all the windows, it is not changed
+                self._value = numpy.where(present, values, 0.)
+                self._count = present.astype(int)
+            else:
+                numpy.add(self._value, values, out=self._value, where=present)
+                self._count += present
+        elif self._n == 0:
+            self._value = numpy.array(values)
+            self._max = numpy.array(values)
+        else:
+            # fmin and fmax skip the NaN
+            numpy.fmin(self._value, values, self._value)
+            numpy.fmax(self._max, values, self._max)
+        self._n += 1
+
+        if self._period > 0:
+            if self._next is not None and t + _TIME_EPS < self._next:
+                return None
+            # like the sensor groups, a window ends on a multiple of the period
+            self._next = (numpy.floor((t + _TIME_EPS)/self._period) + 1)*self._period
+
+        if self._aggregate == 'mean':
+            value = numpy.where(self._count > 0, self._value/numpy.maximum(self._count, 1), numpy.nan)
+        elif self._aggregate == 'minmax':
+            value = numpy.concatenate((self._value, self._max))
+        else:
+            value = self._value
+        self._n = 0
+        return value
+
+
+class subscription(object):
+    # the frames of the columns matching the patterns
+    def __init__(self, names, units, times, patterns, period=0., aggregate='last', delta=False):
+        assert aggregate in _AGGREGATES
+        columns = [i for i, name in enumerate(names) if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+        if not columns:
+            raise ValueError('no sensor matches %s' % ','.join(patterns))
+        nr_names = len(names)
+        self._all = len(columns) == nr_names
+        names = [names[i] for i in columns]
+        units = [units[i] for i in columns]
+        if aggregate == 'minmax':
+            # the min and max of the window are concatenated
+            columns = columns + [nr_names + i for i in columns]
+            names = [name + '_min' for name in names] + [name + '_max' for name in names]
+            units = units + units
+        self._columns = numpy.array(columns, dtype=numpy.intp)
+        self._encoder = frame_encoder(names, units, times, delta)
+        self._encoder.set_meta('period', period)
+        self._encoder.set_meta('aggregate', aggregate)
+
+    def set_meta(self, key, value):
+        return self._encoder.set_meta(key, value)
+
+    def get_schema(self):
+        return self._encoder.get_schema()
+
+    def encode(self, times, value):
+        # (frame, key frame) of the aggregate of a window
+        if not self._all:
+            value = value[self._columns]
+        return self._encoder.encode(times, value)
+
+
+class sample_publisher(object):
+    #
+    # the binary relay of the samples. The sampling loop only hands each
+    # sample to the relay thread, which keeps the windows and subscriptions
+    # of the channels and encodes their frames. A slow subscriber costs a
+    # frame per window, and nothing per sample unless it is the first with
+    # its period and aggregate
+    #
+    def __init__(self, relay, names, units, times=(), delta=False, queries=None):
+        assert len(names) == len(units)
+        self._relay = relay
+        # name -> function of the request, see answer_query
+        self._queries = queries or {}
+        self._names = list(names)
+        self._units = list(units)
+        self._times = list(times)
+        self._delta = delta
+        # set in the sampling thread, _thread_meta is its copy in the relay thread
+        self._meta = {}
+        self._thread_meta = {}
+        # only used in the relay thread, channel -> subscription and
+        # (period, aggregate) -> window_aggregate
+        self._subscriptions = {}
+        self._windows = {}
+        self._channels = None
+        self._window_channels = {}
+        self._subscriptions[None] = self._new_subscription(('*',), 0., 'last')
+        relay.set_header(self._subscriptions[None].get_schema())
+        relay.set_subscribe(self._subscribe)
+
+    def _new_subscription(self, patterns, period, aggregate):
+        sub = subscription(self._names, self._units, self._times, patterns, period, aggregate, self._delta)
+        for key, value in self._thread_meta.items():
+            sub.set_meta(key, value)
+        return sub
+
+    def set_meta(self, key, value):
+        # e.g. the start times of the sources, sent in the schema
+        if self._meta.get(key) == value:
+            return
+        self._meta[key] = value
+        self._relay.run_in_thread(self._set_meta, key, value)
+
+    def publish(self, t, times, values):
+        # values is a fresh list of the columns, t the time of the sample [sec]
+        self._relay.run_in_thread(self._publish, t, times, values)
+
+    def _set_meta(self, key, value):
+        self._thread_meta[key] = value
+        for channel, sub in self._subscriptions.items():
+            if sub.set_meta(key, value):
+                self._relay.set_header(sub.get_schema(), channel)
+
+    def _set_channels(self, channels):
+        # the channels are (patterns, period, aggregate), None is everything
+        self._channels = channels
+        self._window_channels = {}
+        for channel in channels:
+            if channel is None:
+                self._window_channels.setdefault((0., 'last'), []).append(channel)
+            else:
+                self._window_channels.setdefault(channel[1:], []).append(channel)
+        in_use = set(channels)
+        for channel in self._subscriptions.keys():
+            if channel is not None and channel not in in_use:
+                # the last viewer of the channel left
+                del self._subscriptions[channel]
+        for key in self._windows.keys():
+            if key not in self._window_channels:
+                del self._windows[key]
+        for key in self._window_channels:
+            if key not in self._windows:
+                self._windows[key] = window_aggregate(*key)
+
+    def _publish(self, t, times, values):
+        values = numpy.array(values, dtype=float)
+        channels = self._relay.get_channels()
+        if channels is not self._channels:
+            self._set_channels(channels)
+        for key, window_channels in self._window_channels.items():
+            value = self._windows[key].add(t, values)
+            if value is None:
+                continue
+            for channel in window_channels:
+                # only a delta frame needs its key frame, a full queue then drops them all
+                frame, key_frame = self._subscriptions[channel].encode(times, value)
+                self._relay.publish(frame, key_frame if self._delta else None, channel)
+
+    def _subscribe(self, line):
+        try:
+            request = parse_request(line)
+            if 'query' in request:
+                return None, _frame('R', json.dumps(answer_query(self._queries, request)))
+            channel = parse_subscription(line)
+            if channel not in self._subscriptions:
+                self._subscriptions[channel] = self._new_subscription(*channel)
+                self._relay.set_header(self._subscriptions[channel].get_schema(), channel)
+        except ValueError as e:
+            return None, _frame('E', json.dumps({'error': str(e)}))
+        return channel, None
+
+
+class frame_decoder(object):
+    #
+    # feed() it the bytes read from the relay as they come, it returns the
+    # complete samples as (times, values) where times maps the time names to
+    # their value and values is a float32 array in the order of get_names()
+    #
+    def __init__(self):
+        self._buf = ''
+        self._schema = None
+        self._values = None
+        # the replies to the queries, in the order they came
+        self.replies = []
+        self.nr_frames = 0
+        self.nr_bytes = 0
+
+    def get_names(self):
+        return self._schema['names'] if self._schema is not None else []
+
+    def get_units(self):
+        return self._schema['units'] if self._schema is not None else []
+
+    def get_meta(self):
+        return self._schema['meta'] if self._schema is not None else {}
+
+    def _decode(self, kind, payload):
+        if kind == 'E':
+            raise IOError('relay: %s' % json.loads(payload).get('error'))
+        if kind == 'R':
+            self.replies.append(json.loads(payload))
+            return None
+        if kind == 'S':
+            self._schema = json.loads(payload)
+            if self._schema.get('version') != _VERSION:
+                raise IOError('unknown relay protocol version %s' % self._schema.get('version'))
+            self._values = None
+            return None
+        if kind not in ('K', 'D'):
+            raise IOError('unknown relay frame type %r' % kind)
+        if self._schema is None:
+            raise IOError('relay frame before the schema')
+
+        nr_times = len(self._schema['times'])
+        nr_columns = len(self._schema['names'])
+        pos = 8*nr_times
+        times = numpy.frombuffer(payload[:pos], dtype='<f8')
+        if kind == 'K':
+            self._values = numpy.frombuffer(payload[pos:], dtype='<f4').copy()
+        else:
+            if self._values is None:
+                raise IOError('relay delta frame before a key frame')
+            nr_bitmap = (nr_columns + 7)//8
+            bitmap = numpy.frombuffer(payload[pos:pos + nr_bitmap], dtype=numpy.uint8)
+            changed = numpy.unpackbits(bitmap)[:nr_columns].astype(bool)
+            self._values[changed] = numpy.frombuffer(payload[pos + nr_bitmap:], dtype='<f4')
+        if len(self._values) != nr_columns:
+            raise IOError('relay frame with %d values for %d columns' % (len(self._values), nr_columns))
+        return dict(zip(self._schema['times'], times.tolist())), self._values.copy()
+
+    def feed(self, data):
+        self._buf += data
+        self.nr_bytes += len(data)
+        samples = []
+        pos = 0
+        while pos + _FRAME.size <= len(self._buf):
+            n, kind = _FRAME.unpack_from(self._buf, pos)
+            if pos + _FRAME.size + n > len(self._buf):
+                break
+            payload = self._buf[pos + _FRAME.size:pos + _FRAME.size + n]
+            pos = pos + _FRAME.size + n
+            self.nr_frames += 1
+            sample = self._decode(kind, payload)
+            if sample is not None:
+                samples.append(sample)
+        self._buf = self._buf[pos:]
+        return samples
+
+
+def read_relay(host, port, request=None):
+    # the samples of a relay until it closes the connection
+    sock = socket.create_connection((host, port))
+    decoder = frame_decoder()
+    try:
+        if request is not None:
+            sock.sendall(request)
+        while True:
+            data = sock.recv(_READ_SIZE)
+            if not data:
+                return
+            for sample in decoder.feed(data):
+                yield decoder, sample
+    finally:
+        sock.close()
+
+
+def parse_query_args(items):
+    # the KEY=VALUE arguments of a query, the values are JSON or strings
+    args = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep or not key:
+            raise ValueError('expected KEY=VALUE, got %s' % item)
+        try:
+            args[key] = json.loads(value)
+        except ValueError:
+            args[key] = value
+    return args
+
+
+def query_relay(host, port, request, text=False, timeout=10.):
+    # the reply of a relay to a query_request, text for a text relay
+    sock = socket.create_connection((host, port), timeout)
+    decoder = frame_decoder()
+    buf = ''
+    try:
+        sock.sendall(request)
+        while True:
+            data = sock.recv(_READ_SIZE)
+            if not data:
+                raise IOError('the relay closed the connection before replying')
+            if not text:
+                decoder.feed(data)
+                if decoder.replies:
+                    return decoder.replies[0]
+                continue
+            buf += data
+            lines = buf.split('\n')
+            for line in lines[:-1]:
+                if line.startswith('REPLY:'):
+                    return json.loads(line[len('REPLY:'):])
+            buf = lines[-1]
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("host", nargs='?', default='localhost', help="Host of the relay (default localhost)")
+    parser.add_argument("port", nargs='?', default=9001, help="TCP port of the relay (default 9001)")
+    parser.add_argument("-s","--sensors", dest="sensors", default=None, help="Only the sensors matching these patterns (e.g. u_*,x_i)")
+    parser.add_argument("-r","--rate", dest="rate", default=None, help="Frames per second (default every sample)")
+    parser.add_argument("-a","--aggregate", dest="aggregate", default='last', choices=_AGGREGATES, help="What a frame holds of the samples since the one before it (default last)")
+    parser.add_argument("-q","--query", dest="query", default=None, help="Print the reply to this query (e.g. phases) and exit")
+    parser.add_argument("--all", dest="all", action='store_true', help="With -q phases, the whole run instead of the last laps")
+    parser.add_argument("-A","--arg", dest="query_args", default=[], action='append', help="With -q, an argument of the query as KEY=VALUE (e.g. sensor=x_i)")
+    parser.add_argument("--text", dest="text", action='store_true', help="With -q, the relay sends text (--relay-format text)")
+    args = parser.parse_args()
+
+    if args.query is not None:
+        try:
+            query_args = parse_query_args(args.query_args)
+        except ValueError as e:
+            print e
+            sys.exit(1)
+        query_args.setdefault('recent', not args.all)
+        reply = query_relay(args.host, int(args.port), query_request(args.query, **query_args), args.text)
+        print json.dumps(reply, indent=1, sort_keys=True)
+        sys.exit(1 if 'error' in reply else 0)
+
+    request = None
+    if args.sensors is not None or args.rate is not None or args.aggregate != 'last':
+        patterns = (args.sensors or '*').split(',')
+        rate = float(args.rate) if args.rate is not None else None
+        request = subscription_request(patterns, rate, args.aggregate)
+    for decoder, (times, values) in read_relay(args.host, int(args.port), request):
+        print ' '.join('%s=%.3f' % item for item in sorted(times.items())) + ' ' + \
+            ' '.join('%s=%g' % (name, v) for name, v in zip(decoder.get_names(), values))
+    sys.exit(0)
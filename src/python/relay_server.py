@@ -0,0 +1,340 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Fan-out of the collected samples to any number of viewers. The sockets are
+# served by an epoll loop on a background thread, publish() only queues the
+# message, so a slow or dead viewer never delays the sampling. Each client has
+# a bounded queue, when it is full the oldest message is dropped.
+#
+# A client that just connected, or whose channel got a new header, gets the
+# header before its next message. Messages that depend on the ones before
+# them (relay_protocol delta frames) are published with a self-contained key
+# message: a client whose queue is full then drops all its queued messages and
+# gets the header and the key message instead. A client missing its header is
+# sent the key message rather than the delta.
+#
+# A client can ask for its own stream by sending a line, the subscribe
+# callback maps it to a channel and the client then only gets the messages
+# published on that channel. Work that must not slow down the sampling (e.g.
+# encoding a message per channel) is handed to the relay thread with
+# run_in_thread().
+#
+
+import os
+import fcntl
+import errno
+import socket
+import select
+import threading
+import collections
+
+_QUEUE_LENGTH = 256     # messages queued per client
+_READ_SIZE = 4096
+_BACKLOG = 128
+_READ_EVENTS = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+
+
+class relay_client(object):
+    def __init__(self, sock, addr, queue_length):
+        self.sock = sock
+        self.addr = addr
+        # a closed python 2 socket has no fileno
+        self.fd = sock.fileno()
+        self.closed = False
+        self.queue = collections.deque(maxlen=queue_length)
+        # whether the client got a header and key message since it fell behind
+        self.synced = False
+        # the queued message carrying the header, dropping it unsyncs the client
+        self.head = None
+        self.channel = None
+        self.request = ''
+        # the message being sent, it is never dropped half way
+        self.sending = None
+        self.offset = 0
+        self.nr_sent = 0
+        self.nr_dropped = 0
+
+    def fileno(self):
+        return self.fd
+
+    def has_data(self):
+        return self.sending is not None or len(self.queue) > 0
+
+
+class relay_server(object):
+    def __init__(self, host='localhost', port=0, queue_length=_QUEUE_LENGTH):
+        assert queue_length > 0
+        self._queue_length = queue_length
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(_BACKLOG)
+        self._listener.setblocking(0)
+
+        # publish() wakes the loop up with a byte on this pipe, a full pipe
+        # already means a wakeup is pending
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        flags = fcntl.fcntl(self._wakeup_w, fcntl.F_GETFL)
+        fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._lock = threading.Lock()
+        #
+        # the loop only waits for output on the clients with queued messages,
+        # so a wakeup costs the clients that got a message and not all of them
+        #
+        self._poll = select.epoll()
+        self._poll.register(self._listener.fileno(), select.EPOLLIN)
+        self._poll.register(self._wakeup_r, select.EPOLLIN)
+        self._pending = set()
+        self._writing = set()
+        self._clients = {}
+        self._channels = {None: {}}
+        self._channel_list = None
+        self._headers = {None: ''}
+        self._subscribe = None
+        self._tasks = collections.deque()
+        self._running = False
+        self._thread = None
+
+        self._nr_connected = 0
+        self._nr_published = 0
+        self._nr_dropped = 0
+
+    def get_port(self):
+        return self._listener.getsockname()[1]
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._running = False
+            self._wake()
+            self._thread.join()
+            self._thread = None
+        for client in list(self._clients.values()):
+            self._drop_client(client)
+        self._listener.close()
+        self._poll.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError:
+            pass
+
+    def set_header(self, header, channel=None):
+        # sent before the first key message of every client of the channel, a
+        # new header is sent again to all of them
+        with self._lock:
+            if header == self._headers.get(channel):
+                return
+            self._headers[channel] = header
+            for client in self._channels.get(channel, {}).values():
+                client.synced = False
+
+    def set_subscribe(self, subscribe):
+        #
+        # subscribe(line) is called in the relay thread with every line a
+        # client sends, it returns (channel, reply) where channel is None to
+        # keep the current one and reply a message for the client or None
+        #
+        self._subscribe = subscribe
+
+    def run_in_thread(self, func, *args):
+        self._tasks.append((func, args))
+        self._wake()
+
+    def get_channels(self):
+        # the channels with at least one client, the same list until they change
+        with self._lock:
+            if self._channel_list is None:
+                self._channel_list = [channel for channel, clients in self._channels.items() if clients]
+            return self._channel_list
+
+    def publish(self, msg, key=None, channel=None):
+        #
+        # queue msg for every client of the channel and return at once. A
+        # full queue drops its oldest message, or with a key message all of
+        # them, so that the clients are never left with a gap in the messages
+        # they get
+        #
+        with self._lock:
+            for client in self._channels.get(channel, {}).values():
+                if len(client.queue) == self._queue_length:
+                    if key is None:
+                        if client.queue.popleft() is client.head:
+                            client.synced = False
+                        client.nr_dropped += 1
+                        self._nr_dropped += 1
+                    else:
+                        client.nr_dropped += len(client.queue)
+                        self._nr_dropped += len(client.queue)
+                        client.queue.clear()
+                        client.synced = False
+                if not client.synced:
+                    client.head = self._headers.get(channel, '') + (msg if key is None else key)
+                    client.queue.append(client.head)
+                    client.synced = True
+                else:
+                    client.queue.append(msg)
+                self._pending.add(client)
+            self._nr_published += 1
+        self._wake()
+
+    def get_stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'connected': self._nr_connected,
+                    'channels': len([c for c in self._channels.values() if c]),
+                    'published': self._nr_published, 'dropped': self._nr_dropped}
+
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self._listener.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = relay_client(sock, addr, self._queue_length)
+            self._poll.register(client.fd, _READ_EVENTS)
+            with self._lock:
+                self._clients[client.fd] = client
+                self._channels[None][client.fd] = client
+                self._channel_list = None
+                self._nr_connected += 1
+
+    def _drop_client(self, client):
+        with self._lock:
+            self._clients.pop(client.fd, None)
+            self._channels.get(client.channel, {}).pop(client.fd, None)
+            self._channel_list = None
+        if not client.closed:
+            self._poll.unregister(client.fd)
+            self._writing.discard(client.fd)
+        client.closed = True
+        try:
+            client.sock.close()
+        except socket.error:
+            pass
+
+    def _read(self, client):
+        # a viewer only sends subscription lines, or hangs up
+        try:
+            data = client.sock.recv(_READ_SIZE)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self._drop_client(client)
+            return
+        if self._subscribe is None:
+            return
+        client.request += data
+        while '\n' in client.request:
+            line, client.request = client.request.split('\n', 1)
+            try:
+                self._subscribe_client(client, line)
+            except Exception as e:
+                # a line the callback chokes on only costs the client that sent it
+                print " ! relay viewer dropped, %r failed: %r" % (line[:80], e)
+                self._drop_client(client)
+                return
+        if len(client.request) > _READ_SIZE:
+            self._drop_client(client)
+
+    def _subscribe_client(self, client, line):
+        channel, reply = self._subscribe(line)
+        with self._lock:
+            if reply is not None:
+                # the queue may be full, resync the client after the reply
+                client.queue.append(reply)
+                client.synced = False
+                self._pending.add(client)
+            if channel is not None and channel != client.channel:
+                self._channels[client.channel].pop(client.fd, None)
+                self._channels.setdefault(channel, {})[client.fd] = client
+                client.channel = channel
+                client.synced = False
+                self._channel_list = None
+
+    def _send(self, client):
+        while True:
+            if client.sending is None:
+                with self._lock:
+                    if not client.queue:
+                        return
+                    client.sending = client.queue.popleft()
+                client.offset = 0
+            try:
+                n = client.sock.send(client.sending[client.offset:])
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                self._drop_client(client)
+                return
+            client.offset += n
+            if client.offset < len(client.sending):
+                return
+            client.sending = None
+            client.nr_sent += 1
+
+    def _serve(self):
+        while self._running:
+            while self._tasks:
+                func, args = self._tasks.popleft()
+                try:
+                    func(*args)
+                except Exception as e:
+                    # a failed task costs its frame, the viewers are still served
+                    print " ! relay task %s failed: %r" % (getattr(func, '__name__', func), e)
+            with self._lock:
+                pending = self._pending
+                self._pending = set()
+            for client in pending:
+                if not client.closed and client.fd not in self._writing:
+                    self._poll.modify(client.fd, _READ_EVENTS | select.EPOLLOUT)
+                    self._writing.add(client.fd)
+            try:
+                events = self._poll.poll()
+            except IOError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd == self._listener.fileno():
+                    self._accept()
+                elif fd == self._wakeup_r:
+                    os.read(self._wakeup_r, _READ_SIZE)
+                elif fd in self._clients:
+                    client = self._clients[fd]
+                    if event & _READ_EVENTS:
+                        self._read(client)
+                    if event & select.EPOLLOUT and not client.closed:
+                        self._send(client)
+                        if not client.closed and not client.has_data():
+                            self._poll.modify(fd, _READ_EVENTS)
+                            self._writing.discard(fd)
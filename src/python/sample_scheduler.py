@@ -0,0 +1,315 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Sampling on a grid of absolute deadlines k*period of a monotonic clock, so
+# that the time spent in the queries does not accumulate as drift, with the
+# start jitter and the overrun of every tick kept in log-linear histograms.
+# The time spent in each phase of the ticks (spawning the queries, waiting for
+# the BMC, parsing, ...) is kept the same way by phase_timer.
+#
+
+import time
+import ctypes
+import ctypes.util
+import numpy
+
+_CLOCK_MONOTONIC = 1
+
+#
+# python 2 has no time.monotonic, ask the C library for the clock instead
+#
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_clock_gettime = None
+if not hasattr(time, 'monotonic'):
+    for _lib in (ctypes.util.find_library('rt'), ctypes.util.find_library('c')):
+        try:
+            _clock_gettime = ctypes.CDLL(_lib, use_errno=True).clock_gettime
+        except (OSError, AttributeError, TypeError):
+            continue
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        break
+_ts = _timespec()
+
+
+def monotonic():
+    # [sec] since an arbitrary point, never jumps with the wall clock
+    if _clock_gettime is None:
+        if hasattr(time, 'monotonic'):
+            return time.monotonic()
+        # no monotonic clock available, at least keep running
+        return time.time()
+    if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(_ts)) != 0:
+        raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+    return _ts.tv_sec + _ts.tv_nsec*1e-9
+
+
+class latency_histogram(object):
+    #
+    # HDR-style histogram of durations with 1 [us] resolution: values below
+    # 2*_SUB_BUCKETS [us] are counted exactly, above that each power of two
+    # is split in _SUB_BUCKETS buckets, i.e. the error is below 1/_SUB_BUCKETS
+    # of the value at any magnitude
+    #
+    _SUB_BITS = 7
+    _SUB_BUCKETS = 1 << _SUB_BITS
+    _MAX_VALUE = (1 << 36) - 1    # [us] ~19 hours, larger values are clamped
+
+    def __init__(self):
+        n = self._index(self._MAX_VALUE) + 1
+        self._counts = numpy.zeros(n, dtype=numpy.int64)
+        self._nr = 0
+        self._sum = 0.
+        self._min = None
+        self._max = None
+
+    def _index(self, us):
+        shift = max(0, us.bit_length() - self._SUB_BITS - 1)
+        return (shift << self._SUB_BITS) + (us >> shift)
+
+    def _lower_bounds(self):
+        # [us] the smallest value counted in each bucket
+        index = numpy.arange(len(self._counts))
+        shift = numpy.maximum(0, (index >> self._SUB_BITS) - 1)
+        return (index - (shift << self._SUB_BITS)) << shift
+
+    def record(self, value):
+        # value in [sec], negative values count as 0
+        us = min(max(0, int(value*1e6)), self._MAX_VALUE)
+        self._counts[self._index(us)] += 1
+        self._nr += 1
+        self._sum += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def get_count(self):
+        return self._nr
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def get_mean(self):
+        if self._nr == 0:
+            return None
+        return self._sum/self._nr
+
+    def get_percentile(self, p):
+        # [sec] the lower bound of the bucket holding the p-th percentile
+        assert 0 <= p <= 100
+        if self._nr == 0:
+            return None
+        rank = max(1, int(numpy.ceil(p/100.*self._nr)))
+        index = numpy.searchsorted(numpy.cumsum(self._counts), rank)
+        return self._lower_bounds()[index]*1e-6
+
+    def to_array(self):
+        # the non-empty buckets as rows of (lower bound [sec], count)
+        used = numpy.nonzero(self._counts)[0]
+        return numpy.column_stack((self._lower_bounds()[used]*1e-6, self._counts[used].astype(float)))
+
+
+_OVERRUN_POLICIES = ('skip', 'catch-up', 'stretch')
+_RECENT_PHASES = 256        # durations of a phase kept for the live view
+
+
+class deadline_scheduler(object):
+    #
+    # overrun policies, when a tick ends after the next deadline
+    # skip      drop the deadlines that passed, the grid keeps its phase
+    # catch-up  run the missed ticks back to back until on the grid again
+    # stretch   start the next tick now and move the grid to it
+    #
+    def __init__(self, period, policy='skip'):
+        assert isinstance(period, (int, float))
+        assert period > 0
+        assert policy in _OVERRUN_POLICIES, "unknown overrun policy %s" % policy
+        self._period = float(period)
+        self._policy = policy
+        self._start = None
+        self._deadline = None
+        self._tick_deadline = None
+        self._last_start = None
+        self._nr_ticks = 0
+        self._nr_late = 0
+        self._nr_skipped = 0
+        self._jitter = latency_histogram()
+        self._overrun = latency_histogram()
+
+    def get_policy(self):
+        return self._policy
+
+    def wait(self):
+        #
+        # sleep until the next deadline, returns the start jitter of the tick
+        #
+        if self._deadline is None:
+            self._start = monotonic()
+            self._deadline = self._start
+        while True:
+            left = self._deadline - monotonic()
+            if left <= 0:
+                break
+            time.sleep(left)
+        self._last_start = monotonic()
+        jitter = self._last_start - self._deadline
+        self._tick_deadline = self._deadline
+        self._jitter.record(jitter)
+        self._nr_ticks += 1
+        return jitter
+
+    def done(self):
+        #
+        # the tick is over, returns its overrun past the next deadline
+        #
+        assert self._tick_deadline is not None
+        now = monotonic()
+        next_deadline = self._tick_deadline + self._period
+        overrun = max(0., now - next_deadline)
+        self._overrun.record(overrun)
+        if overrun > 0:
+            self._nr_late += 1
+            if self._policy == 'skip':
+                missed = int(overrun//self._period) + 1
+                self._nr_skipped += missed
+                next_deadline = next_deadline + missed*self._period
+            elif self._policy == 'stretch':
+                next_deadline = now
+        self._deadline = next_deadline
+        self._tick_deadline = None
+        return overrun
+
+    def get_tick_offset(self):
+        # [sec] from the first tick to the deadline of the running one
+        assert self._tick_deadline is not None
+        return self._tick_deadline - self._start
+
+    def get_next_offset(self):
+        # [sec] from the first tick to the next deadline
+        if self._deadline is None:
+            return 0.
+        return self._deadline - self._start
+
+    def get_rate(self):
+        # [Hz] achieved sampling rate, from the start of the first to the last tick
+        if self._nr_ticks < 2:
+            return 0.
+        return (self._nr_ticks - 1)/(self._last_start - self._start)
+
+    def get_late_ratio(self):
+        if self._nr_ticks == 0:
+            return 0.
+        return self._nr_late/float(self._nr_ticks)
+
+    def get_variables(self, prefix='sched'):
+        # what is saved along the traces
+        return {prefix + '_policy': self._policy,
+                prefix + '_period': self._period,
+                prefix + '_ticks': self._nr_ticks,
+                prefix + '_late': self._nr_late,
+                prefix + '_skipped': self._nr_skipped,
+                prefix + '_rate': self.get_rate(),
+                prefix + '_jitter': self._jitter.to_array(),
+                prefix + '_overrun': self._overrun.to_array()}
+
+    def print_stats(self):
+        if self._nr_ticks == 0:
+            return
+        print "Schedule (%s): %d ticks at %.4f Hz of %.4f Hz, %d late, %d skipped" % \
+            (self._policy, self._nr_ticks, self.get_rate(), 1./self._period, self._nr_late, self._nr_skipped)
+        for name, hist in (('jitter', self._jitter), ('overrun', self._overrun)):
+            print "  %-7s p50 %.6f p99 %.6f p99.9 %.6f max %.6f [sec]" % \
+                (name, hist.get_percentile(50), hist.get_percentile(99), hist.get_percentile(99.9), hist.get_max())
+
+
+class phase_timer(object):
+    #
+    # where the time of the ticks goes. A phase is timed from a stamp to the
+    # next one with lap(), every time it runs: in a histogram over the whole
+    # run and in a ring of its last durations, so that the live view shows
+    # the recent ticks and not the average since the start. A lap costs a
+    # clock read and a histogram update, a few [us]
+    #
+    def __init__(self, recent=_RECENT_PHASES):
+        assert recent > 0
+        self._recent = recent
+        # name -> [histogram, ring of the last durations, nr. recorded]
+        self._phases = {}
+        # in the order the phases first ran
+        self._names = []
+
+    def stamp(self):
+        return monotonic()
+
+    def lap(self, phase, start):
+        # the phase ran from start to now, returns now as the start of the next
+        now = monotonic()
+        self.record(phase, now - start)
+        return now
+
+    def record(self, phase, duration):
+        entry = self._phases.get(phase)
+        if entry is None:
+            entry = [latency_histogram(), numpy.zeros(self._recent), 0]
+            self._phases[phase] = entry
+            self._names.append(phase)
+        entry[0].record(duration)
+        entry[1][entry[2] % self._recent] = duration
+        entry[2] += 1
+
+    def get_names(self):
+        return list(self._names)
+
+    def get_summary(self, recent=False):
+        #
+        # phase -> dict of count, mean, p50, p99 and max [sec], of the whole
+        # run or of the last durations of each phase. It can be asked from
+        # another thread while sampling, it is then off by the laps running
+        #
+        summary = {}
+        for name in list(self._names):
+            hist, ring, n = self._phases[name]
+            if recent:
+                last = ring[:min(n, self._recent)]
+                summary[name] = {'count': len(last), 'mean': float(last.mean()),
+                                 'p50': float(numpy.percentile(last, 50)), 'p99': float(numpy.percentile(last, 99)),
+                                 'max': float(last.max())}
+            else:
+                summary[name] = {'count': hist.get_count(), 'mean': hist.get_mean(),
+                                 'p50': hist.get_percentile(50), 'p99': hist.get_percentile(99),
+                                 'max': hist.get_max()}
+        return summary
+
+    def get_variables(self, prefix='phase'):
+        # what is saved along the traces, a histogram per phase as in get_variables of deadline_scheduler
+        return dict((prefix + '_' + name, self._phases[name][0].to_array()) for name in self._names)
+
+    def print_stats(self):
+        if not self._names:
+            return
+        print "Phases: %d" % len(self._names)
+        for name in self._names:
+            hist = self._phases[name][0]
+            print "  %-12s %8d laps  mean %.6f p50 %.6f p99 %.6f max %.6f [sec]" % \
+                (name, hist.get_count(), hist.get_mean(), hist.get_percentile(50), hist.get_percentile(99), hist.get_max())
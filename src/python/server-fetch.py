@@ -23,13 +23,26 @@ import sys
 import datetime
 import re
 import time
+import json
 import argparse
 import subprocess
 import numpy
-import scipy
-import scipy.io
 import shlex
-import socket
+import select
+import collections
+import fnmatch
+import snmp_client
+import ipmi_session
+import trace_recorder
+import trace_codec
+import column_store
+import query_capture
+import mat_writer
+import trace_grid
+import trace_rollup
+import sample_scheduler
+import relay_server
+import relay_protocol
 
 _COLLECT_DELL = 0
 _COLLECT_FB = 1
@@ -37,563 +50,1361 @@ _MAX_SAMPLING_PERIOD = 100   # [Hz]
 _TCP_IP = 'localhost'
 _TCP_PORT = 9001
 _BUFFER_SIZE = 1024
+_COLUMN_CAPACITY = 64       # initial nr. of samples of a block
+_RESERVED_SAMPLES = 16384   # max. nr. of samples of a block allocated before a run
+_FLEET_REPORT_PERIOD = 10.  # [sec]
+_FLEET_READ_SIZE = 65536
+_QUERY_BUDGET = 0.8         # share of the tick the queries of a sample may take
+_QUERY_DRAIN_TIME = 0.01    # [sec] past the deadline, to read what was already printed
 
-class data_trace(object):
-    def __init__(self, name):
+#
+# the quality of each query of a source, logged with its time. A query that
+# did not answer is stored as a row of NaN
+#
+_QUERY_OK = 0
+_QUERY_LATE = 1             # killed at the deadline, for snmp also some subtrees only
+_QUERY_FAILED = 2           # the session or the agent gave up
+
+#
+# the BMC endpoints of the servers in our lab, used when no inventory is given
+#
+_DEFAULT_TARGETS = {
+    _COLLECT_DELL: dict(ipmi_host='192.168.21.151', snmp_host='192.168.21.151',
+                        user='ltu', password='LTU123', community='public'),
+    _COLLECT_FB: dict(ipmi_host='10.0.100.122', snmp_host='10.0.100.10',
+                      user='sics', password='sics', community='LTU'),
+}
+_SERVER_KINDS = {'dell': _COLLECT_DELL, 'fb': _COLLECT_FB}
+
+#
+# the sensors of each server model, a row per sensor:
+#
+#   (key, source, query, index, scale, unit)
+#
+# For 'ipmi' the query is the SDR name and index counts the rows printed with
+# that name (the two Dell "Temp" rows), for 'snmp' it is the subtree walked
+# and index the position of the value in the walk. An snmp row without index
+# is a sensor per value of the walk, its key is formatted with the position
+# and their number (e.g. the cores of the node) is taken from the first walk.
+# The raw value is divided by scale to get the unit sent in the relay schema.
+# The key names the trace in the output files and the relay. The times of a
+# source count from its own start time (s_t_ipmi, s_t_snmp), so a key read by
+# both sources (the Dell temperatures and fans) is a trace per source named
+# <key>_ipmi and <key>_snmp.
+#
+_MIB_DELL_TEMP = 'IDRAC-MIB-SMIv2::temperatureProbeReading'   # inlet, exhaust, CPU 1, CPU 2 [tenths of degC]
+_MIB_DELL_FAN = 'IDRAC-MIB-SMIv2::coolingDeviceReading'       # fan 1 to 6
+_MIB_FB_TEMP = 'LM-SENSORS-MIB::lmTempSensorsValue'           # socket 0 average, its cores, then socket 1 [mdegC]
+_MIB_FB_LOAD = 'HOST-RESOURCES-MIB::hrProcessorLoad'          # a value per logical cpu
+
+_SENSORS = {
+    _COLLECT_DELL: [
+        ('x_i', 'ipmi', 'Inlet Temp', 0, 1., 'degC'),
+        ('x_o', 'ipmi', 'Exhaust Temp', 0, 1., 'degC'),
+        ('x_s0', 'ipmi', 'Temp', 0, 1., 'degC'),
+        ('x_s1', 'ipmi', 'Temp', 1, 1., 'degC'),
+    ] + [('u_%d' % i, 'ipmi', 'Fan%d RPM' % i, 0, 1., 'RPM') for i in range(1, 7)] + [
+        ('l_c', 'ipmi', 'CPU Usage', 0, 1., '%'),
+        ('l_io', 'ipmi', 'IO Usage', 0, 1., '%'),
+        ('l_m', 'ipmi', 'MEM Usage', 0, 1., '%'),
+        ('l_s', 'ipmi', 'SYS Usage', 0, 1., '%'),
+        ('c_1', 'ipmi', 'Current 1', 0, 1., 'A'),
+        ('c_2', 'ipmi', 'Current 2', 0, 1., 'A'),
+        ('v_1', 'ipmi', 'Voltage 1', 0, 1., 'V'),
+        ('v_2', 'ipmi', 'Voltage 2', 0, 1., 'V'),
+        ('p_c', 'ipmi', 'Pwr Consumption', 0, 1., 'W'),
+        ('x_i', 'snmp', _MIB_DELL_TEMP, 0, 10., 'degC'),
+        ('x_o', 'snmp', _MIB_DELL_TEMP, 1, 10., 'degC'),
+        ('x_s0', 'snmp', _MIB_DELL_TEMP, 2, 10., 'degC'),
+        ('x_s1', 'snmp', _MIB_DELL_TEMP, 3, 10., 'degC'),
+    ] + [('u_%d' % (i + 1), 'snmp', _MIB_DELL_FAN, i, 1., 'RPM') for i in range(6)],
+
+    _COLLECT_FB: [
+        ('x_i', 'ipmi', 'Inlet Temp', 0, 1., 'degC'),
+        ('x_o', 'ipmi', 'Outlet Cntr Temp', 0, 1., 'degC'),
+        ('x_s0', 'ipmi', 'P0 Therm Margin', 0, 1., 'degC'),
+        ('x_s1', 'ipmi', 'P1 Therm Margin', 0, 1., 'degC'),
+        ('x_d0', 'ipmi', 'P0 DIMM Temp', 0, 1., 'degC'),
+        ('x_d1', 'ipmi', 'P1 DIMM Temp', 0, 1., 'degC'),
+        ('u_1', 'ipmi', 'SYS_Fan0', 0, 1., 'RPM'),
+        ('u_2', 'ipmi', 'SYS_Fan1', 0, 1., 'RPM'),
+        ('x_%d', 'snmp', _MIB_FB_TEMP, None, 1000., 'degC'),
+        ('l_%d', 'snmp', _MIB_FB_LOAD, None, 1., '%'),
+    ],
+}
+_SOURCES = ('ipmi', 'snmp')
+
+_GROUP_TIME_EPS = 1e-6      # [sec] tolerance on the group deadlines
+_RELAY_FORMATS = ('text', 'binary', 'delta')
+_RELAY_QUERY_SAMPLES = 1000   # max. nr. of samples of a query reply, encoded on the relay thread
+
+
+def _decode_walk(out):
+    #
+    # snmpwalk -Oqv prints one value per line, converted at once without
+    # splitting the lines. A value that is not a number ends the walk there,
+    # the sensors after it are missing
+    #
+    return numpy.fromstring(out, sep=' ')
+
+def _spawn(cmd):
+    # start a query, its output is retrieved later with _communicate
+    return subprocess.Popen(shlex.split(cmd), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+def _kill(p):
+    try:
+        p.kill()
+    except OSError:
+        pass
+    p.stdout.close()
+    p.stderr.close()
+    p.wait()
+
+def _communicate(p, deadline=None):
+    #
+    # communicate() drains the pipes while waiting, a large output cannot fill
+    # them and block the child before it exits. With a deadline (time.time())
+    # the pipes are drained the same way, a query still running then is
+    # killed and None returned
+    #
+    if deadline is None:
+        out, err = p.communicate()
+        return out
+    out_fd = p.stdout.fileno()
+    open_fds = set([out_fd, p.stderr.fileno()])
+    poller = select.poll()
+    for fd in open_fds:
+        poller.register(fd, select.POLLIN | select.POLLHUP)
+    chunks = []
+    while open_fds:
+        left = deadline - time.time()
+        events = poller.poll(max(left, 0.)*1000.)
+        if not events or left < -_QUERY_DRAIN_TIME:
+            _kill(p)
+            return None
+        for fd, event in events:
+            data = os.read(fd, _FLEET_READ_SIZE)
+            if data:
+                if fd == out_fd:
+                    chunks.append(data)
+                continue
+            poller.unregister(fd)
+            open_fds.discard(fd)
+    # the output is complete, the exit follows
+    while p.poll() is None:
+        if time.time() > deadline + _QUERY_DRAIN_TIME:
+            _kill(p)
+            return None
+        time.sleep(1e-3)
+    p.stdout.close()
+    p.stderr.close()
+    return ''.join(chunks)
+
+
+class bmc_target(object):
+    def __init__(self, name, server_choice, wrapper=None, **endpoints):
         assert isinstance(name, str)
         assert len(name) > 0
+        assert(server_choice in (_COLLECT_DELL, _COLLECT_FB))
+
+        self.name = name
+        self.server_choice = server_choice
+        self.wrapper = wrapper
+        #
+        # ipmi_host, snmp_host, user, password and community, the lab defaults
+        # of the server type are used for the ones that are not given
+        #
+        config = dict(_DEFAULT_TARGETS[server_choice])
+        for key, value in endpoints.items():
+            assert key in config, "unknown bmc_target field %s" % key
+            config[key] = value
+        for key, value in config.items():
+            setattr(self, key, value)
+
+    def wrap(self, cmd):
+        # the wrapper is prepended to every query, e.g. to run a fake BMC tool
+        if self.wrapper:
+            return self.wrapper + ' ' + cmd
+        return cmd
+
+
+def read_inventory(path, wrapper=None):
+    #
+    # one host per line: <name> <dell|fb> [ipmi_host=..] [snmp_host=..]
+    # [user=..] [password=..] [community=..], '#' starts a comment
+    #
+    targets = []
+    for nr, line in enumerate(open(path)):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) < 2 or fields[1] not in _SERVER_KINDS:
+            print "%s:%d: expected '<name> <dell|fb> [key=value ...]'" % (path, nr + 1)
+            sys.exit(1)
+        endpoints = {}
+        for f in fields[2:]:
+            key, sep, value = f.partition('=')
+            if not sep:
+                print "%s:%d: expected key=value, got '%s'" % (path, nr + 1, f)
+                sys.exit(1)
+            endpoints[key] = value
+        targets.append(bmc_target(fields[0], _SERVER_KINDS[fields[1]], wrapper, **endpoints))
+    return targets
 
+
+def _stamp(start_trace, cur_time):
+    # time relative to the first sample of the source owning start_trace
+    if start_trace.get_start_time() is None:
+        start_trace.save_start_time(cur_time)
+    return cur_time - start_trace.get_start_time()
+
+
+class sample_block(object):
+    #
+    # the samples of the sensors of one source in one group, a time per
+    # sample and a float64 column per sensor. The buffers are preallocated and
+    # double when full, the columns are stored one after the other so that
+    # the samples of a sensor are exported as a view and not copied. A sample
+    # is written as one row, a sensor missing from it is NaN there
+    #
+    def __init__(self, nr_columns, capacity=_COLUMN_CAPACITY, name=''):
+        assert nr_columns > 0
+        assert capacity > 0
+        assert isinstance(name, str)
         self._name = name
-        self._data = []
-        self._time = []
+        self._time = numpy.empty(capacity)
+        self._data = numpy.empty((nr_columns, capacity))
+        self._n = 0
+        # the last value of each column that was not missing, for the relay
+        self._last = numpy.zeros(nr_columns)
+        self._recorder = None
+        self._recorder_ids = None
+        self._keep = True
+        self._store = None
+        self._rollup = None
+
+    def __len__(self):
+        return self._n
 
     def get_name(self):
         return self._name
-    
+
+    def get_nr_columns(self):
+        return len(self._last)
+
+    def reserve(self, n):
+        capacity = len(self._time)
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity = 2*capacity
+        time = numpy.empty(capacity)
+        time[:self._n] = self._time[:self._n]
+        data = numpy.empty((len(self._data), capacity))
+        data[:, :self._n] = self._data[:, :self._n]
+        # views exported earlier keep the old buffers alive, they stay valid
+        self._time = time
+        self._data = data
+
+    def set_recorder(self, recorder, ids, keep=True):
+        #
+        # every row written from now on is also written to the recorder with
+        # the trace ids of the columns, unless keep is set it is not kept
+        #
+        assert isinstance(recorder, trace_recorder.trace_recorder)
+        assert isinstance(keep, bool)
+        assert len(ids) == self.get_nr_columns()
+        assert self._n == 0
+        self._recorder = recorder
+        self._recorder_ids = numpy.array(ids, dtype=numpy.uint16)
+        self._keep = keep
+
+    def set_rollup(self, rollup, keep=True):
+        #
+        # every row written from now on is also added to the rollup, unless
+        # keep is set it is not kept, see trace_rollup.py
+        #
+        assert isinstance(rollup, trace_rollup.trace_rollup)
+        assert isinstance(keep, bool)
+        assert self._n == 0
+        self._rollup = rollup
+        self._keep = self._keep and keep
+
+    def get_rollup(self):
+        return self._rollup
+
+    def set_store(self, store):
+        # a column_store writing the rows out, it may also clear them
+        assert self._n == 0
+        self._store = store
+
+    def write(self, time, values):
+        assert isinstance(time, float)
+        assert len(values) == len(self._last)
+        numpy.copyto(self._last, values, where=values == values)
+        if self._recorder is not None:
+            self._recorder.add_row(self._recorder_ids, time, values)
+        if self._rollup is not None:
+            self._rollup.add(time, values)
+        if not self._keep and self._store is None:
+            return
+        if self._n == len(self._time):
+            self.reserve(self._n + 1)
+        self._time[self._n] = time
+        self._data[:, self._n] = values
+        self._n += 1
+
+    def get_column(self, column):
+        # views of the times and the values of a column
+        return self._time[:self._n], self._data[column, :self._n]
+
+    def keeps_rows(self):
+        # all the rows written are in memory, a column_store may clear them once written
+        return self._keep and (self._store is None or self._store.get_keep())
+
+    def find(self, t):
+        # the index of the last row at or before t, -1 for none, the rows are written in time order
+        return int(self._time[:self._n].searchsorted(t, 'right')) - 1
+
+    def get_window(self, column, t0, t1):
+        # views of the times and the values of a column with t0 <= time <= t1
+        times = self._time[:self._n]
+        first = times.searchsorted(t0, 'left')
+        last = times.searchsorted(t1, 'right')
+        return self._time[first:last], self._data[column, first:last]
+
+    def get_latest(self, column, n):
+        # views of the times and the values of the last n rows of a column
+        start = max(self._n - n, 0)
+        return self._time[start:self._n], self._data[column, start:self._n]
+
+    def get_rows(self, start):
+        # views of the times and the columns of the rows from start on
+        return self._time[start:self._n], self._data[:, start:self._n]
+
+    def clear(self):
+        # forget the rows, e.g. once they are on disk, the last values stay
+        self._n = 0
+
+    def get_last(self):
+        return self._last
+
+
+def _gather_plan(columns):
+    #
+    # (nr. of values, [(block, columns of the block, positions)]) reading the
+    # last values of the (block, column) pairs with a take per block
+    #
+    blocks = []
+    parts = []
+    for position, (block, column) in enumerate(columns):
+        if block not in blocks:
+            blocks.append(block)
+            parts.append((block, [], []))
+        block, block_columns, positions = parts[blocks.index(block)]
+        block_columns.append(column)
+        positions.append(position)
+    return len(columns), [(block, numpy.array(c, dtype=numpy.intp), numpy.array(p, dtype=numpy.intp))
+                          for block, c, p in parts]
+
+def _read_last(plan):
+    # a new array of the last values of a _gather_plan
+    n, parts = plan
+    values = numpy.zeros(n)
+    for block, columns, positions in parts:
+        values[positions] = block.get_last()[columns]
+    return values
+
+
+def parse_group(spec):
+    #
+    # "NAME=PERIOD:PATTERN[,PATTERN...]", e.g. "slow=10:x_d*,x_i", the
+    # patterns are matched against the trace names with fnmatch
+    #
+    name, sep, rest = spec.partition('=')
+    period, sep2, patterns = rest.partition(':')
+    if not sep or not sep2 or not name or not patterns:
+        raise ValueError('expected NAME=PERIOD:PATTERN[,PATTERN...], got "%s"' % spec)
+    period = float(period)
+    if period <= 0:
+        raise ValueError('the period of group %s must be positive' % name)
+    return name, period, tuple(p for p in patterns.split(',') if p)
+
+
+def _base_period(periods):
+    #
+    # the tick of a scheduler serving all the periods, their greatest common
+    # divisor with a resolution of 1 [ms]
+    #
+    base = 0
+    for p in periods:
+        ms = max(1, int(round(p*1000.)))
+        while ms:
+            base, ms = ms, base % ms
+    return base/1000.
+
+
+class sensor_group(object):
+    #
+    # sensors sampled with the same period. While it is due a group writes a
+    # row in its block of each source that is queried, its sensors are not
+    # stored in the ticks where it is not due
+    #
+    def __init__(self, name, period, patterns=('*',)):
+        assert isinstance(name, str)
+        assert period is None or period > 0
+        self.name = name
+        self.period = period
+        self.patterns = patterns
+        self.traces = []
+        self.queries = set()
+        self.due = True
+        # source -> (block, the columns of the source's values stored in it)
+        self._blocks = {}
+        self._next_due = 0.
+
+    def matches(self, trace_name):
+        for p in self.patterns:
+            if fnmatch.fnmatchcase(trace_name, p):
+                return True
+        return False
+
+    def set_block(self, source, columns):
+        assert source not in self._blocks
+        block = sample_block(len(columns), name='%s-%s' % (self.name, source))
+        self._blocks[source] = (block, numpy.array(columns, dtype=numpy.intp))
+        return block
+
+    def get_blocks(self):
+        return [block for block, columns in self._blocks.values()]
+
+    def update_due(self, offset):
+        # offset of the tick from the first one [sec]
+        self.due = offset + _GROUP_TIME_EPS >= self._next_due
+        if self.due:
+            # deadlines missed by a late tick are not made up for
+            self._next_due = (numpy.floor((offset + _GROUP_TIME_EPS)/self.period) + 1)*self.period
+        return self.due
+
+    def store(self, source, time, values):
+        # values holds all the columns of the source
+        if self.due and source in self._blocks:
+            block, columns = self._blocks[source]
+            block.write(time, values[columns])
+
+
+def _json_samples(times, values):
+    # for a relay viewer, a missed sample is null
+    return {'t': times.tolist(), 'value': [None if v != v else v for v in values.tolist()]}
+
+
+def _sensor_names(names):
+    # a list or a comma separated string of a relay request
+    if isinstance(names, basestring):
+        names = names.split(',')
+    return [str(name) for name in names]
+
+
+def _query_arg(request, name, convert, default=None):
+    #
+    # an argument of a relay query, a bad or missing one (without default) is
+    # a ValueError answered to the viewer
+    #
+    value = request.get(name, default)
+    if value is None:
+        raise ValueError('missing argument %s' % name)
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise ValueError('bad argument %s=%r' % (name, value))
+
+
+def _time_arg(request, name):
+    # an optional time [sec] of a relay query
+    if request.get(name) is None:
+        return None
+    return _query_arg(request, name, float)
+
+
+def _count_arg(request, name, default):
+    n = _query_arg(request, name, int, default)
+    if n <= 0:
+        raise ValueError('argument %s must be positive' % name)
+    return n
+
+
+class data_trace(object):
+    #
+    # the samples of a key of _SENSORS, stored in a column of the block of
+    # the source that reads it. The start times of the sources are traces
+    # without a column
+    #
+    def __init__(self, name, unit=''):
+        assert isinstance(name, str)
+        assert len(name) > 0
+        self._name = name
+        self._unit = unit
+        self._column = None     # (block, column)
+        self._start_time = None
+        self._meta_sinks = []
+
+    def get_name(self):
+        return self._name
+
+    def get_unit(self):
+        return self._unit
+
+    def add_column(self, block, column):
+        # a single source, its times have its own start time
+        assert isinstance(block, sample_block)
+        assert 0 <= column < block.get_nr_columns()
+        assert self._column is None
+        self._column = (block, column)
+
+    def get_column(self):
+        return self._column
+
+    def is_sampled(self):
+        return self._column is not None
+
+    def add_meta_sink(self, sink):
+        #
+        # the samples are written out by the blocks, the start time here to
+        # the meta() of a trace_recorder or a column_store
+        #
+        self._meta_sinks.append(sink)
+
     def save_start_time(self, start_time):
         assert isinstance(start_time, float)
         self._start_time = start_time
+        for sink in self._meta_sinks:
+            sink.meta({'start_time': {self._name: start_time}})
 
-    def append(self, time, value):
-        assert isinstance(time, float)
-        assert isinstance(value,float)
-        self._time.append(time)
-        self._data.append(value)
+    def __len__(self):
+        return len(self.get_time_with_data()[1])
 
     def get_time_with_data(self):
-        return numpy.array(self._time), numpy.array(self._data)
+        #
+        # views of the block column when the trace never missed a sample,
+        # otherwise a copy of the samples without the missed ones
+        #
+        if self._column is None:
+            return numpy.empty(0), numpy.empty(0)
+        block, column = self._column
+        time, data = block.get_column(column)
+        present = data == data
+        if not present.all():
+            time, data = time[present], data[present]
+        return time, data
+
+    def _get_kept_column(self):
+        if self._column is None:
+            raise ValueError('%s is not sampled' % self._name)
+        block, column = self._column
+        if not block.keeps_rows():
+            raise ValueError('the samples of %s are not kept in memory without -o or -m' % self._name)
+        return self._column
+
+    def window(self, t0=None, t1=None):
+        #
+        # the samples with t0 <= time <= t1, found by binary search. Views of
+        # the block column, a missed sample is NaN there
+        #
+        if t0 is None:
+            t0 = -numpy.inf
+        if t1 is None:
+            t1 = numpy.inf
+        block, column = self._get_kept_column()
+        return block.get_window(column, t0, t1)
+
+    def at(self, t):
+        # the value of the last sample at or before t, NaN before the first one or when it was missed
+        block, column = self._get_kept_column()
+        i = block.find(t)
+        if i < 0:
+            return numpy.nan
+        return float(block.get_column(column)[1][i])
+
+    def latest(self, n):
+        # the last n samples, views like window
+        assert n > 0
+        block, column = self._get_kept_column()
+        return block.get_latest(column, n)
 
     def get_last_value(self):
-        if len(self._data):
-            return self._data[-1]
-        return 0
+        # 0 before the first sample
+        if self._column is None:
+            return 0.
+        block, column = self._column
+        return float(block.get_last()[column])
+
+    def query_rollup(self, t0=None, t1=None, max_points=1000):
+        # see trace_rollup.query
+        if self._column is None or self._column[0].get_rollup() is None:
+            raise ValueError('no rollup of %s' % self._name)
+        block, column = self._column
+        return block.get_rollup().query(column, t0, t1, max_points)
 
     def get_start_time(self):
         return self._start_time
 
 
 class server(object):
-    def __init__(self, _use_ipmi, _use_snmp, server_choice, conn):
+    def __init__(self, _use_ipmi, _use_snmp, server_choice, relay, concurrent=False, target=None, native_snmp=False,
+                 use_ipmi_session=False, overrun_policy='skip', groups=None, relay_format='text',
+                 query_budget=_QUERY_BUDGET):
         assert(server_choice in (_COLLECT_DELL, _COLLECT_FB))
         assert(isinstance(_use_ipmi, bool))
         assert(isinstance(_use_snmp, bool))
+        assert(isinstance(concurrent, bool))
+        assert(isinstance(native_snmp, bool))
+        assert(isinstance(use_ipmi_session, bool))
+        assert(relay_format in _RELAY_FORMATS)
+        assert(0 < query_budget <= 1)
+        if target is None:
+            target = bmc_target('default', server_choice)
+        assert(isinstance(target, bmc_target))
+        assert(target.server_choice == server_choice)
         self._use_ipmi = _use_ipmi
         self._use_snmp = _use_snmp
+        self._concurrent = concurrent
+        self._target = target
+        self._native_snmp = native_snmp
+        self._snmp_session = None
+        self._use_ipmi_session = use_ipmi_session
+        self._ipmi_session = None
+        self._overrun_policy = overrun_policy
+        self._scheduler = None
+        self._query_budget = query_budget
+        self._phases = sample_scheduler.phase_timer()
         self.server_choice = server_choice
-        self.conn = conn
+        self._relay = relay
 
         #
-        # table of variables we are going to collect
-        # x_i       inlet temperature                       # [tens of degrees Celsius]
-        # x_o       exhaust temperature                     # [tens of degrees Celsius]
-        # x_j       temperature of the j-th component       # [tens of degrees Celsius]
-        # ! j=1 -> CPU 1, j=2 -> CPU 2
-        # u_j       speed of the j-th fan                   # [RPM]
-        # ! j=1 -> Fan 1, j=2 -> Fan 2, ...
-        # t         time vector
-        # l_c       CPU load
-        # l_io      IO load
-        # l_m       Memory load
-        # l_s       System load
+        # a trace per key of _SENSORS, the values of a source are a vector
+        # with a column per row of its sensors, scaled and stored at once
         #
-
         self._s_t_ipmi = data_trace('s_t_ipmi')
-        self._x_i = data_trace('x_i')	# todo: explain
-        self._x_o = data_trace('x_o')
-        self._x_s0 = data_trace('x_s0')
-        self._x_s1 = data_trace('x_s1')
-        self._x_d0 = data_trace('x_d0')
-        self._x_d1 = data_trace('x_d1')
-        self._u_1 = data_trace('u_1')
-        self._u_2 = data_trace('u_2')
-        self._u_3 = data_trace('u_3')
-        self._u_4 = data_trace('u_4')
-        self._u_5 = data_trace('u_5')
-        self._u_6 = data_trace('u_6')
-        self._l_c = data_trace('l_c')
-        self._l_io = data_trace('l_io')
-        self._l_m = data_trace('l_m')
-        self._l_s = data_trace('l_s')
-        self._c_1 = data_trace('c_1')
-        self._c_2 = data_trace('c_2')
-        self._v_1 = data_trace('v_1')
-        self._v_2 = data_trace('v_2')
-        self._p_c = data_trace('p_c')
-
         self._s_t_snmp = data_trace('s_t_snmp')
-        self._x_0 = data_trace('x_0')
-        self._x_1 = data_trace('x_1')
-        self._x_2 = data_trace('x_2')
-        self._x_3 = data_trace('x_3')
-        self._x_4 = data_trace('x_4')
-        self._x_5 = data_trace('x_5')
-        self._x_6 = data_trace('x_6')
-        self._x_7 = data_trace('x_7')
-        self._x_8 = data_trace('x_8')
-        self._x_9 = data_trace('x_9')
-        self._x_10 = data_trace('x_10')
-        self._x_11 = data_trace('x_11')
-        self._x_12 = data_trace('x_12')
-        self._x_13 = data_trace('x_13')
-        self._x_14 = data_trace('x_14')
-        self._x_15 = data_trace('x_15')
-        self._x_16 = data_trace('x_16')
-        self._x_17 = data_trace('x_17')
-        self._x_18 = data_trace('x_18')
-
-        self._l_0 = data_trace('l_0')
-        self._l_1 = data_trace('l_1')
-        self._l_2 = data_trace('l_2')
-        self._l_3 = data_trace('l_3')
-        self._l_4 = data_trace('l_4')
-        self._l_5 = data_trace('l_5')
-        self._l_6 = data_trace('l_6')
-        self._l_7 = data_trace('l_7')
-        self._l_8 = data_trace('l_8')
-        self._l_9 = data_trace('l_9')
-        self._l_10 = data_trace('l_10')
-        self._l_11 = data_trace('l_11')
-        self._l_12 = data_trace('l_12')
-        self._l_13 = data_trace('l_13')
-        self._l_14 = data_trace('l_14')
-        self._l_15 = data_trace('l_15')
-        self._l_16 = data_trace('l_16')
-        self._l_17 = data_trace('l_17')
-        self._l_18 = data_trace('l_18')
-        self._l_19 = data_trace('l_19')
-        self._l_20 = data_trace('l_20')
-        self._l_21 = data_trace('l_21')
-        self._l_22 = data_trace('l_22')
-        self._l_23 = data_trace('l_23')
-        self._l_24 = data_trace('l_24')
-        self._l_25 = data_trace('l_25')
-        self._l_26 = data_trace('l_26')
-        self._l_27 = data_trace('l_27')
-        self._l_28 = data_trace('l_28')
-        self._l_29 = data_trace('l_29')
-        self._l_30 = data_trace('l_30')
-        self._l_31 = data_trace('l_31')
-        
-   
-    def fetch_snmp(self, meas_t, zero_pwr):
+        # the time and the quality of every query of a source, see _QUERY_OK
+        self._query_log = dict((source, sample_block(1, name='q_' + source)) for source in _SOURCES)
+        self._query_counts = dict((source, numpy.zeros(_QUERY_FAILED + 1, dtype=int)) for source in _SOURCES)
+        self._traces = {}
+        self._sensors = dict((source, []) for source in _SOURCES)
+        self._scales = {}
+        self._mibs = []
+        self._sized_mibs = []
+        sources = {}
+        for key, source, query, index, scale, unit in _SENSORS[server_choice]:
+            assert source in _SOURCES
+            sources.setdefault(key, set()).add(source)
+            if source == 'snmp' and query not in self._mibs:
+                self._mibs.append(query)
+            if index is None and query not in self._sized_mibs:
+                assert source == 'snmp'
+                self._sized_mibs.append(query)
+        # the keys read by both sources, a trace per source
+        self._shared_keys = set(key for key in sources if len(sources[key]) > 1)
+        # subtree -> nr. of values of its first walk
+        self._walk_sizes = {}
+        self._ipmi_sensors = {}
+        self._snmp_walks = {}
+        self._recorder = None
+        self._recorder_keep = True
+        self._column_store = None
+        self._capture = None
+        self._periodic_save = None
+        self._saved_paths = set()
+        self._grid = None
+        self._rollup_args = None
+        self._rollup_keep = True
+
         #
-        # issue the snmp queries
+        # the traces not matched by any of the given groups are sampled with
+        # the period passed to collect
         #
+        self._default_group = sensor_group('default', None)
+        self._groups = [sensor_group(name, period, patterns) for name, period, patterns in (groups or [])]
+        self._groups.append(self._default_group)
+        self._blocks = []
+        self._columns = dict((source, {}) for source in _SOURCES)
 
-        if self.server_choice == _COLLECT_DELL:
-            #cmd_fmt = "snmpget -c public -v 2c -Oqv 192.168.21.151 %s" 
-            # This command retrieves information from one or multiply OIDsreqested.
-            # -c [community string]: By default most SNMP enabled devices uses "public".
-            # -v [SNMP version]: SNMP protocol version, "1" or "2c".
-            # -OQ Removes the type information when displaying varbind values
-            # -Ov Display the varbind value only, not the OID
-            # [IP]: IP address of the device.
-            
-            cmd_fmt = "snmpwalk -c public -v 2c -Oqv 192.168.21.151 %s"
-            # This command retrieves all variables in the subtree below the given OID.
-            
-            mib_x = "IDRAC-MIB-SMIv2::temperatureProbeReading" #OID request for all temp sensors
-            # ...temperatureProbeReading.1.1" #OID request for inlet temp
-            # ...temperatureProbeReading.1.2" #OID request for exhaust temp
-            # ...temperatureProbeReading.1.3" #OID request for CPU 1
-            #mib_x_2 = "IDRAC-MIB-SMIv2::temperatureProbeReading.1.4" #OID request for CPU 2
-            mib_u = "IDRAC-MIB-SMIv2::coolingDeviceReading" 	 #OID request for all fan speeds
-            #mib_u_1 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.1"	 #OID request for fan1 speed
-            #mib_u_2 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.2"	 #OID request for fan2 speed
-            #mib_u_3 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.3"	 #OID request for fan3 speed
-            #mib_u_4 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.4"	 #OID request for fan4 speed
-            #mib_u_5 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.5"	 #OID request for fan5 speed
-            #mib_u_6 = "IDRAC-MIB-SMIv2::coolingDeviceReading.1.6"	 #OID request for fan6 speed
-            #mib_c_1 = "IDRAC-MIB-SMIv2::processorDeviceCurrentSpeed.1.1"
-            #mib_c_2 = "IDRAC-MIB-SMIv2::processorDeviceCurrentSpeed.1.2"
-            #mib_v_1 = "IDRAC-MIB-SMIv2::powerSupplyCurrentInputVoltage.1.1"
-            #mib_v_2 = "IDRAC-MIB-SMIv2::powerSupplyCurrentInputVoltage.1.2"
-            #mib_p_c = "IDRAC-MIB-SMIv2::powerUsageCumulativeWattage.1.1"
-
-            p = subprocess.Popen(shlex.split(cmd_fmt % mib_x), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            snmp_x, err = p.communicate()
-            p = subprocess.Popen(shlex.split(cmd_fmt % mib_u), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            snmp_u, err = p.communicate()
+        #
+        # the snmp sensors of a subtree with a sensor per value are only known
+        # after its first walk, see discover_snmp, so is the relay schema
+        #
+        self._relay_format = relay_format
+        self._relay_publisher = None
+        self._relay_plan = None
+        self._ready = set()
+        self._add_sensors('ipmi')
+        if not _use_snmp or not self._sized_mibs:
+            self._add_sensors('snmp')
 
+    def _add_sensors(self, source):
+        #
+        # the sensors of the rows of _SENSORS of the source, their traces and
+        # their columns in the blocks of the groups
+        #
+        for key, src, query, index, scale, unit in _SENSORS[self.server_choice]:
+            if src != source:
+                continue
+            if index is None:
+                rows = [(key % i, i) for i in range(self._walk_sizes.get(query, 0))]
+            elif key in self._shared_keys:
+                rows = [('%s_%s' % (key, source), index)]
+            else:
+                rows = [(key, index)]
+            for name, position in rows:
+                if name not in self._traces:
+                    self._traces[name] = data_trace(name, unit)
+                self._sensors[source].append((name, query, position, scale))
+        self._scales[source] = numpy.array([scale for key, query, index, scale in self._sensors[source]])
+        for block, keys in self._assign_groups(source):
+            if self._recorder is not None:
+                block.set_recorder(self._recorder, [self._recorder.register(key) for key in keys], self._recorder_keep)
+            if self._column_store is not None:
+                self._column_store.add_block(block, keys, [self._traces[key].get_unit() for key in keys])
+            if self._rollup_args is not None:
+                block.set_rollup(trace_rollup.trace_rollup(block.get_nr_columns(), **self._rollup_args),
+                                 self._rollup_keep)
+        if source == 'ipmi':
+            self._ipmi_sensors = self._resolve_ipmi_sensors()
+        else:
+            self._snmp_walks = self._resolve_snmp_walks()
+        self._ready.add(source)
+        if len(self._ready) == len(_SOURCES) and self._relay is not None:
+            self._setup_relay()
 
-            #
-            # Parse the outputs
-            #
-            def _parse_snmp_temperature(temp_str):
-                # The temps are measured in tens of degrees Celsius
-                return float(temp_str)/10.
+    def _setup_relay(self):
+        #
+        # the relay reads the last values of the traces from the blocks with
+        # a take per block. The binary relay sends the last value of every
+        # sampled trace as a float32 column, delta only sends the columns that
+        # changed. The viewers can subscribe to some of the columns at a lower
+        # rate. The text relay has a line per snmp subtree and one for ipmi
+        #
+        if self._relay_format != 'text':
+            self._relay_traces = [trace for trace in self.get_traces() if trace.is_sampled()]
+            self._relay_plan = _gather_plan([trace.get_column() for trace in self._relay_traces])
+            names = [trace.get_name() for trace in self._relay_traces]
+            units = [trace.get_unit() for trace in self._relay_traces]
+            self._relay_publisher = relay_protocol.sample_publisher(self._relay, names, units, ('t_ipmi', 't_snmp'),
+                                                                    self._relay_format == 'delta', self._relay_queries())
+        else:
+            self._relay_lines = [[key for key, query, index, scale in self._sensors['snmp'] if query == mib]
+                                 for mib in self._mibs]
+            self._relay_lines.append([key for key, query, index, scale in self._sensors['ipmi']])
+            self._relay_keys = sum(self._relay_lines, [])
+            columns = [self._columns['snmp'][key] for keys in self._relay_lines[:-1] for key in keys]
+            columns.extend(self._columns['ipmi'][key] for key in self._relay_lines[-1])
+            self._relay_plan = _gather_plan(columns)
+            self._relay.set_subscribe(self._answer_text_query)
 
-            def _parse_snmp_float(fs_str):
-                # The fans are measured in RPM
-                return float(fs_str)
-            
-            lines = snmp_x.splitlines()
-            meas_x_i = _parse_snmp_temperature(lines[0])
-            meas_x_o = _parse_snmp_temperature(lines[1])
-            meas_x_s0 = _parse_snmp_temperature(lines[2])
-            meas_x_s1 = _parse_snmp_temperature(lines[3])
-            lines = snmp_u.splitlines()
-            meas_u_1 = _parse_snmp_float(lines[0])
-            meas_u_2 = _parse_snmp_float(lines[1])
-            meas_u_3 = _parse_snmp_float(lines[2])
-            meas_u_4 = _parse_snmp_float(lines[3])
-            meas_u_5 = _parse_snmp_float(lines[4])
-            meas_u_6 = _parse_snmp_float(lines[5])
-            #meas_c_1 = _parse_snmp_fanspeed(snmp_c_1)
-            #meas_c_2 = _parse_snmp_fanspeed(snmp_c_2)
-            #meas_v_1 = _parse_snmp_fanspeed(snmp_v_1)
-            #meas_v_2 = _parse_snmp_fanspeed(snmp_v_2)
-            #meas_p_c = _parse_snmp_fanspeed(snmp_p_c)
-            #if zero_pwr == None:
-            #    zero_pwr = meas_p_c
-            #meas_p_c = meas_p_c - zero_pwr
-
-
-            self._x_i.append(meas_t,meas_x_i)
-            self._x_o.append(meas_t,meas_x_o)
-            self._x_s0.append(meas_t,meas_x_s0)
-            self._x_s1.append(meas_t,meas_x_s1)
-            self._u_1.append(meas_t,meas_u_1)
-            self._u_2.append(meas_t,meas_u_2)
-            self._u_3.append(meas_t,meas_u_3)
-            self._u_4.append(meas_t,meas_u_4)
-            self._u_5.append(meas_t,meas_u_5)
-            self._u_6.append(meas_t,meas_u_6)
-            #self._c_1.append(meas_t,meas_c_1)
-            #self._c_2.append(meas_t,meas_c_2)
-            #self._v_1.append(meas_t,meas_v_1)
-            #self._v_2.append(meas_t,meas_v_2)
-            #self._p_c.append(meas_t,meas_p_c)
-
-
-
-        if self.server_choice == _COLLECT_FB:
-            cmd_fmt = "snmpwalk -c LTU -v 2c -Oqv 10.0.100.10 %s"
-
-            mib_x = "LM-SENSORS-MIB::lmTempSensorsValue" #All core temp
-            #mib_x_1 = "LM-SENSORS-MIB::lmTempSensorsValue.1" #Average temp socket 0 
-            #mib_x_2 = "LM-SENSORS-MIB::lmTempSensorsValue.2" #Temp core 0
-            #mib_x_3 = "LM-SENSORS-MIB::lmTempSensorsValue.3" #Temp core 1
-            #mib_x_4 = "LM-SENSORS-MIB::lmTempSensorsValue.4" #Temp core 2
-            #mib_x_5 = "LM-SENSORS-MIB::lmTempSensorsValue.5" #Temp core 3
-            #mib_x_6 = "LM-SENSORS-MIB::lmTempSensorsValue.6" #Temp core 4
-            #mib_x_7 = "LM-SENSORS-MIB::lmTempSensorsValue.7" #Temp core 5
-            #mib_x_8 = "LM-SENSORS-MIB::lmTempSensorsValue.8" #Temp core 6
-            #mib_x_9 = "LM-SENSORS-MIB::lmTempSensorsValue.9" #Temp core 7
-            #mib_x_10 = "LM-SENSORS-MIB::lmTempSensorsValue.10" #Average temp socket 1
-            #mib_x_11 = "LM-SENSORS-MIB::lmTempSensorsValue.11" #Temp core 0
-            #mib_x_12 = "LM-SENSORS-MIB::lmTempSensorsValue.12" #Temp core 1
-            #mib_x_13 = "LM-SENSORS-MIB::lmTempSensorsValue.13" #Temp core 2
-            #mib_x_14 = "LM-SENSORS-MIB::lmTempSensorsValue.14" #Temp core 3
-            #mib_x_15 = "LM-SENSORS-MIB::lmTempSensorsValue.15" #Temp core 4
-            #mib_x_16 = "LM-SENSORS-MIB::lmTempSensorsValue.16" #Temp core 5
-            #mib_x_17 = "LM-SENSORS-MIB::lmTempSensorsValue.17" #Temp core 6
-            #mib_x_18 = "LM-SENSORS-MIB::lmTempSensorsValue.18" #Temp core 7
-
-            mib_l = "HOST-RESOURCES-MIB::hrProcessorLoad" # All core temp 
-            #mib_l_1 = "HOST-RESOURCES-MIB::hrProcessorLoad.196608" # core 0 
-            #mib_l_2 = "HOST-RESOURCES-MIB::hrProcessorLoad.196609" # core 1
-            #mib_l_3 = "HOST-RESOURCES-MIB::hrProcessorLoad.196610" # core 2
-            #mib_l_4 = "HOST-RESOURCES-MIB::hrProcessorLoad.196611" # core 3
-            #mib_l_5 = "HOST-RESOURCES-MIB::hrProcessorLoad.196612" # core 4
-            #mib_l_6 = "HOST-RESOURCES-MIB::hrProcessorLoad.196613" # core 5
-            #mib_l_7 = "HOST-RESOURCES-MIB::hrProcessorLoad.196614" # core 6
-            #mib_l_8 = "HOST-RESOURCES-MIB::hrProcessorLoad.196615" # core 7
-            #mib_l_9 = "HOST-RESOURCES-MIB::hrProcessorLoad.196616" # core 8
-            #mib_l_10 = "HOST-RESOURCES-MIB::hrProcessorLoad.196617" # core 9
-            #mib_l_11 = "HOST-RESOURCES-MIB::hrProcessorLoad.196618" # core 10
-            #mib_l_12 = "HOST-RESOURCES-MIB::hrProcessorLoad.196619" # core 11
-            #mib_l_13 = "HOST-RESOURCES-MIB::hrProcessorLoad.196620" # core 12
-            #mib_l_14 = "HOST-RESOURCES-MIB::hrProcessorLoad.196621" # core 13
-            #mib_l_15 = "HOST-RESOURCES-MIB::hrProcessorLoad.196622" # core 14
-            #mib_l_16 = "HOST-RESOURCES-MIB::hrProcessorLoad.196623" # core 15
-            #mib_l_17 = "HOST-RESOURCES-MIB::hrProcessorLoad.196624" # core 16
-            #mib_l_18 = "HOST-RESOURCES-MIB::hrProcessorLoad.196625" # core 17
-            #mib_l_19 = "HOST-RESOURCES-MIB::hrProcessorLoad.196626" # core 18
-            #mib_l_20 = "HOST-RESOURCES-MIB::hrProcessorLoad.196627" # core 19
-            #mib_l_21 = "HOST-RESOURCES-MIB::hrProcessorLoad.196628" # core 20
-            #mib_l_22 = "HOST-RESOURCES-MIB::hrProcessorLoad.196629" # core 21
-            #mib_l_23 = "HOST-RESOURCES-MIB::hrProcessorLoad.196630" # core 22
-            #mib_l_24 = "HOST-RESOURCES-MIB::hrProcessorLoad.196631" # core 23
-            #mib_l_25 = "HOST-RESOURCES-MIB::hrProcessorLoad.196632" # core 24
-            #mib_l_26 = "HOST-RESOURCES-MIB::hrProcessorLoad.196633" # core 25
-            #mib_l_27 = "HOST-RESOURCES-MIB::hrProcessorLoad.196634" # core 26
-            #mib_l_28 = "HOST-RESOURCES-MIB::hrProcessorLoad.196635" # core 27
-            #mib_l_29 = "HOST-RESOURCES-MIB::hrProcessorLoad.196636" # core 28
-            #mib_l_30 = "HOST-RESOURCES-MIB::hrProcessorLoad.196637" # core 29
-            #mib_l_31 = "HOST-RESOURCES-MIB::hrProcessorLoad.196638" # core 30
-            #mib_l_32 = "HOST-RESOURCES-MIB::hrProcessorLoad.196639" # core 31
-
-            #snmp_x = subprocess.check_output(cmd_fmt % mib_x, shell=True)
-            p = subprocess.Popen(shlex.split(cmd_fmt % mib_x), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            snmp_x, err = p.communicate()
+    def _assign_groups(self, source):
+        #
+        # a sensor is stored by the first group matching its key, the group
+        # gets a block per source with a column per sensor. Returns the new
+        # (block, keys)
+        #
+        blocks = []
+        for group in self._groups:
+            rows = [i for i, (key, query, index, scale) in enumerate(self._sensors[source])
+                    if self._match_group(key) is group]
+            if not rows:
+                continue
+            block = group.set_block(source, rows)
+            keys = [self._sensors[source][i][0] for i in rows]
+            blocks.append((block, keys))
+            for column, key in enumerate(keys):
+                self._traces[key].add_column(block, column)
+                self._columns[source][key] = (block, column)
+                if key not in group.traces:
+                    group.traces.append(key)
 
-            #snmp_l = subprocess.check_output(cmd_fmt % mib_l, shell=True)
-            p = subprocess.Popen(shlex.split(cmd_fmt % mib_l), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            snmp_l, err = p.communicate()
+            # the queries that have to run when the group is due
+            if source == 'ipmi':
+                group.queries.add('ipmi')
+            else:
+                group.queries.update(self._sensors[source][i][1] for i in rows)
+        self._blocks.extend(blocks)
+        return blocks
 
-            #
-            # Parse the outputs
-            #
-            def _parse_core_temperature(temp_str):
-                # The temps are measured in tens of degrees Celsius
-                return float(temp_str)/1000.
+    def _match_group(self, key):
+        for group in self._groups:
+            if group.matches(key):
+                return group
 
-            def _parse_snmp_float(fs_str):
-                # The fans are measured in RPM
-                return float(fs_str)
-            
-            lines = snmp_x.splitlines()
-            meas_x_0 = _parse_core_temperature(lines[0]) #Average temp socket 0
-            meas_x_1 = _parse_core_temperature(lines[1]) #Temp core 0
-            meas_x_2 = _parse_core_temperature(lines[2]) #Temp core 1
-            meas_x_3 = _parse_core_temperature(lines[3]) #Temp core 2
-            meas_x_4 = _parse_core_temperature(lines[4]) #Temp core 3
-            meas_x_5 = _parse_core_temperature(lines[5]) #Temp core 4
-            meas_x_6 = _parse_core_temperature(lines[6]) #Temp core 5
-            meas_x_7 = _parse_core_temperature(lines[7]) #Temp core 6
-            meas_x_8 = _parse_core_temperature(lines[8]) #Temp core 7
-            meas_x_9 = _parse_core_temperature(lines[9]) #Average temp socket 1
-            meas_x_10 = _parse_core_temperature(lines[10]) #Temp core 0
-            meas_x_11 = _parse_core_temperature(lines[11]) #Temp core 1
-            meas_x_12 = _parse_core_temperature(lines[12]) #Temp core 2
-            meas_x_13 = _parse_core_temperature(lines[13]) #Temp core 3
-            meas_x_14 = _parse_core_temperature(lines[14]) #Temp core 4
-            meas_x_15 = _parse_core_temperature(lines[15]) #Temp core 5
-            meas_x_16 = _parse_core_temperature(lines[16]) #Temp core 6
-            meas_x_17 = _parse_core_temperature(lines[17]) #Temp core 7
-        
-            lines = snmp_l.splitlines()
-            meas_l_0 = _parse_snmp_float(lines[0]) #Load core 0
-            meas_l_1 = _parse_snmp_float(lines[1]) #Load core 1
-            meas_l_2 = _parse_snmp_float(lines[2]) #Load core 2
-            meas_l_3 = _parse_snmp_float(lines[3]) #Load core 3
-            meas_l_4 = _parse_snmp_float(lines[4]) #Load core 4
-            meas_l_5 = _parse_snmp_float(lines[5]) #Load core 5
-            meas_l_6 = _parse_snmp_float(lines[6]) #Load core 6
-            meas_l_7 = _parse_snmp_float(lines[7]) #Load core 7
-            meas_l_8 = _parse_snmp_float(lines[8]) #Load core 8
-            meas_l_9 = _parse_snmp_float(lines[9]) #Load core 9
-            meas_l_10 = _parse_snmp_float(lines[10]) #Load core 10
-            meas_l_11 = _parse_snmp_float(lines[11]) #Load core 11
-            meas_l_12 = _parse_snmp_float(lines[12]) #Load core 12
-            meas_l_13 = _parse_snmp_float(lines[13]) #Load core 13
-            meas_l_14 = _parse_snmp_float(lines[14]) #Load core 14
-            meas_l_15 = _parse_snmp_float(lines[15]) #Load core 15
-            meas_l_16 = _parse_snmp_float(lines[16]) #Load core 16
-            meas_l_17 = _parse_snmp_float(lines[17]) #Load core 17
-            meas_l_18 = _parse_snmp_float(lines[18]) #Load core 18
-            meas_l_19 = _parse_snmp_float(lines[19]) #Load core 19
-            meas_l_20 = _parse_snmp_float(lines[20]) #Load core 20
-            meas_l_21 = _parse_snmp_float(lines[21]) #Load core 21
-            meas_l_22 = _parse_snmp_float(lines[22]) #Load core 22
-            meas_l_23 = _parse_snmp_float(lines[23]) #Load core 23
-            meas_l_24 = _parse_snmp_float(lines[24]) #Load core 24
-            meas_l_25 = _parse_snmp_float(lines[25]) #Load core 25
-            meas_l_26 = _parse_snmp_float(lines[26]) #Load core 26
-            meas_l_27 = _parse_snmp_float(lines[27]) #Load core 27
-            meas_l_28 = _parse_snmp_float(lines[28]) #Load core 28
-            meas_l_29 = _parse_snmp_float(lines[29]) #Load core 29
-            meas_l_30 = _parse_snmp_float(lines[30]) #Load core 30
-            meas_l_31 = _parse_snmp_float(lines[31]) #Load core 31
-
-            self._x_0.append(meas_t, meas_x_0)
-            self._x_1.append(meas_t, meas_x_1)
-            self._x_2.append(meas_t, meas_x_2)
-            self._x_3.append(meas_t, meas_x_3)
-            self._x_4.append(meas_t, meas_x_4)
-            self._x_5.append(meas_t, meas_x_5)
-            self._x_6.append(meas_t, meas_x_6)
-            self._x_7.append(meas_t, meas_x_7)
-            self._x_8.append(meas_t, meas_x_8)
-            self._x_9.append(meas_t, meas_x_9)
-            self._x_10.append(meas_t, meas_x_10)
-            self._x_11.append(meas_t, meas_x_11)
-            self._x_12.append(meas_t, meas_x_12)
-            self._x_13.append(meas_t, meas_x_13)
-            self._x_14.append(meas_t, meas_x_14)
-            self._x_15.append(meas_t, meas_x_15)
-            self._x_16.append(meas_t, meas_x_16)
-            self._x_17.append(meas_t, meas_x_17)
-
-            self._l_0.append(meas_t, meas_l_0)
-            self._l_1.append(meas_t, meas_l_1)
-            self._l_2.append(meas_t, meas_l_2)
-            self._l_3.append(meas_t, meas_l_3)
-            self._l_4.append(meas_t, meas_l_4)
-            self._l_5.append(meas_t, meas_l_5)
-            self._l_6.append(meas_t, meas_l_6)
-            self._l_7.append(meas_t, meas_l_7)
-            self._l_8.append(meas_t, meas_l_8)
-            self._l_9.append(meas_t, meas_l_9)
-            self._l_10.append(meas_t, meas_l_10)
-            self._l_11.append(meas_t, meas_l_11)
-            self._l_12.append(meas_t, meas_l_12)
-            self._l_13.append(meas_t, meas_l_13)
-            self._l_14.append(meas_t, meas_l_14)
-            self._l_15.append(meas_t, meas_l_15)
-            self._l_16.append(meas_t, meas_l_16)
-            self._l_17.append(meas_t, meas_l_17)
-            self._l_18.append(meas_t, meas_l_18)
-            self._l_19.append(meas_t, meas_l_19)
-            self._l_20.append(meas_t, meas_l_20)
-            self._l_21.append(meas_t, meas_l_21)
-            self._l_22.append(meas_t, meas_l_22)
-            self._l_23.append(meas_t, meas_l_23)
-            self._l_24.append(meas_t, meas_l_24)
-            self._l_25.append(meas_t, meas_l_25)
-            self._l_26.append(meas_t, meas_l_26)
-            self._l_27.append(meas_t, meas_l_27)
-            self._l_28.append(meas_t, meas_l_28)
-            self._l_29.append(meas_t, meas_l_29)
-            self._l_30.append(meas_t, meas_l_30)
-            self._l_31.append(meas_t, meas_l_31)
-
-
-    def fetch_use_ipmi(self, meas_t):
-        assert isinstance(meas_t, float)
+    def get_groups(self):
+        return self._groups
+
+    def _store(self, source, time, values):
+        # values has a column per sensor of the source, NaN for the missing ones
+        for group in self._groups:
+            group.store(source, time, values)
+
+    def _log_query(self, source, meas_t, quality):
+        self._query_log[source].write(meas_t, numpy.array([float(quality)]))
+        self._query_counts[source][quality] += 1
+
+    def _store_missing(self, source, meas_t, quality):
+        # the query did not answer, its sensors are NaN in the sample
+        self._log_query(source, meas_t, quality)
+        if source in self._ready:
+            values = numpy.empty(len(self._sensors[source]))
+            values.fill(numpy.nan)
+            self._store(source, meas_t, values)
+
+    def get_trace(self, name):
+        return self._traces[name]
+
+    def get_traces(self):
+        traces = self._traces.values() + [self._s_t_ipmi, self._s_t_snmp]
+        return sorted(traces, key=data_trace.get_name)
+
+    def set_recorder(self, recorder, keep=True):
         #
-        # issue the ipmi query
+        # stream the samples to disk while collecting, so that the run
+        # survives a crash and can be exported with trace_recorder.py
+        #
+        for trace in self.get_traces():
+            trace.add_meta_sink(recorder)
+        for block, keys in self._blocks:
+            block.set_recorder(recorder, [recorder.register(key) for key in keys], keep)
+        # the quality of the queries, a query that did not answer leaves no sample
+        for block in self._query_log.values():
+            block.set_recorder(recorder, [recorder.register(block.get_name())], keep)
+        self._recorder = recorder
+        self._recorder_keep = keep
+
+    def set_column_store(self, store, keep=True):
+        #
+        # write the samples of each block to a directory of .npy columns
+        # while collecting, a sensor can be memory-mapped from it with
+        # column_store.open_trace. Unless keep is set the rows are dropped
+        # from memory once written
+        #
+        assert isinstance(store, column_store.column_store)
+        store.set_keep(keep)
+        for trace in self.get_traces():
+            trace.add_meta_sink(store)
+        for block, keys in self._blocks:
+            store.add_block(block, keys, [self._traces[key].get_unit() for key in keys])
+        for block in self._query_log.values():
+            store.add_block(block, [block.get_name()], [''])
+        self._column_store = store
+
+    def set_rollups(self, keep=True, **args):
+        #
+        # sum up the samples of each block at several resolutions while
+        # collecting, args are those of trace_rollup. Unless keep is set the
+        # rows are not kept in memory, which stays bounded however long the
+        # run, the traces are then only queried through query_rollup
+        #
+        for block, keys in self._blocks:
+            block.set_rollup(trace_rollup.trace_rollup(block.get_nr_columns(), **args), keep)
+        for block in self._query_log.values():
+            block.set_rollup(trace_rollup.trace_rollup(1, **args), keep)
+        self._rollup_args = args
+        self._rollup_keep = keep
+
+    def query_rollup(self, name, t0=None, t1=None, max_points=1000):
+        #
+        # dict of the resolution [sec] and the times, min, max, mean and
+        # count of the samples of a trace in t0 <= time <= t1, with times
+        # relative to the start of its source
+        #
+        resolution, times, mins, maxs, means, counts = self._get_sampled(name).query_rollup(t0, t1, max_points)
+        return {'resolution': resolution, 't': times.tolist(), 'min': mins.tolist(), 'max': maxs.tolist(),
+                'mean': means.tolist(), 'count': counts.tolist()}
+
+    def _get_sampled(self, name):
+        if name not in self._traces or not self._traces[name].is_sampled():
+            raise ValueError('unknown sensor %s' % name)
+        return self._traces[name]
+
+    #
+    # the samples kept in memory by time, found by binary search on the
+    # times of the blocks, the times are relative to the start of the source
+    # of each sample as in the output files. See data_trace.window
+    #
+    def window(self, sensor, t0=None, t1=None):
+        return self._get_sampled(sensor).window(t0, t1)
+
+    def at(self, sensors, t):
+        # the value of each sensor at t, see data_trace.at
+        return numpy.array([self._get_sampled(name).at(t) for name in sensors])
+
+    def latest(self, n, sensors=None):
+        # name -> (times, values) of the last n samples of each sensor, of all of them by default
+        if sensors is None:
+            sensors = self._sampled_names()
+        return dict((name, self._get_sampled(name).latest(n)) for name in sensors)
+
+    def _sampled_names(self):
+        return [trace.get_name() for trace in self.get_traces() if trace.is_sampled()]
+
+    def _answer_rollup(self, request):
+        return self.query_rollup(_query_arg(request, 'sensor', str), _time_arg(request, 't0'),
+                                 _time_arg(request, 't1'), _count_arg(request, 'points', 1000))
+
+    def _answer_window(self, request):
+        #
+        # the first limit samples of the window, and the t0 of the next page
+        # when it has more
+        #
+        limit = min(_count_arg(request, 'limit', _RELAY_QUERY_SAMPLES), _RELAY_QUERY_SAMPLES)
+        times, values = self.window(_query_arg(request, 'sensor', str), _time_arg(request, 't0'),
+                                    _time_arg(request, 't1'))
+        reply = _json_samples(times[:limit], values[:limit])
+        if len(times) > limit:
+            reply['next'] = float(times[limit])
+        return reply
+
+    def _answer_at(self, request):
+        names = _query_arg(request, 'sensors', _sensor_names)
+        values = self.at(names, _query_arg(request, 't', float))
+        return dict((name, None if v != v else v) for name, v in zip(names, values.tolist()))
+
+    def _answer_latest(self, request):
+        names = None
+        if request.get('sensors') is not None:
+            names = _query_arg(request, 'sensors', _sensor_names)
+        n = _count_arg(request, 'n', 1)
+        nr_sensors = len(names) if names is not None else len(self._sampled_names())
+        if n*nr_sensors > _RELAY_QUERY_SAMPLES:
+            raise ValueError('at most %d samples per query, ask fewer sensors' % _RELAY_QUERY_SAMPLES)
+        latest = self.latest(n, names)
+        return dict((name, _json_samples(*samples)) for name, samples in latest.items())
+
+    def set_capture(self, capture):
+        #
+        # write the raw output of every query to a query_capture, the run
+        # can then be replayed without the BMC, see replay()
+        #
+        assert isinstance(capture, query_capture.query_capture)
+        for trace in (self._s_t_ipmi, self._s_t_snmp):
+            trace.add_meta_sink(capture)
+        self._capture = capture
+
+    def get_capture_meta(self):
+        # what replay needs to parse the queries as they were captured
+        kind = [name for name, choice in _SERVER_KINDS.items() if choice == self.server_choice][0]
+        return {'server': kind, 'use_ipmi': self._use_ipmi, 'use_snmp': self._use_snmp,
+                'ipmi_session': self._use_ipmi_session}
+
+    def _snmp_mibs(self):
+        #
+        # the snmp subtrees walked at each sample, in the order expected by
+        # store_snmp
+        #
+        return self._mibs
+
+    def _snmp_commands(self, mibs=None):
+        # the snmpwalk queries of one sample, in the order expected by parse_snmp
+        if mibs is None:
+            mibs = self._snmp_mibs()
+        cmd_fmt = self._target.wrap("snmpwalk -c %s -v 2c -Oqv %s %%s" % (self._target.community, self._target.snmp_host))
+        return [cmd_fmt % mib for mib in mibs]
+
+    def _open_snmp_session(self):
+        #
+        # the native client walks every subtree once to learn its OIDs, then
+        # each sample is a single GET of that exact OID set. The session is
+        # kept once all the walks answered, an snmp_error is raised otherwise
+        #
+        host, sep, port = self._target.snmp_host.partition(':')
+        if not sep:
+            port = snmp_client._SNMP_PORT
+        session = snmp_client.snmp_session(host, self._target.community, int(port))
+        try:
+            walks = [session.walk(snmp_client.MIB_OIDS[mib]) for mib in self._snmp_mibs()]
+        except snmp_client.snmp_error:
+            session.close()
+            raise
+        self._snmp_session = session
+        self._snmp_mib_oids = {}
+        self._snmp_oid_sets = {}
+        for mib, walk in zip(self._snmp_mibs(), walks):
+            self._snmp_mib_oids[mib] = [oid for oid, value in walk]
+        if self._capture is not None:
+            self._capture.add_walks(self._snmp_mibs(), [query_capture.format_walk(value for oid, value in walk)
+                                                        for walk in walks])
+        self._learn_walk_sizes(walks)
+
+    def _check_snmp_session(self, meas_t):
+        #
+        # opens the native session when there is none yet, a sample taken
+        # while the agent does not answer is lost and the next one tries again
+        #
+        if self._snmp_session is None:
+            try:
+                self._open_snmp_session()
+            except snmp_client.snmp_error as e:
+                self._snmp_lost(meas_t, e)
+                return False
+        return True
+
+    def _snmp_get_oids(self, mibs):
+        # the OIDs of the subtrees queried together
+        key = tuple(mibs)
+        if key not in self._snmp_oid_sets:
+            oids = []
+            for mib in mibs:
+                oids.extend(self._snmp_mib_oids[mib])
+            self._snmp_oid_sets[key] = oids
+        return self._snmp_oid_sets[key]
+
+    def _store_snmp_values(self, meas_t, zero_pwr, mibs, values):
+        # the values of a GET of the subtrees mibs, split into their walks
+        walks = {}
+        start = 0
+        for mib in mibs:
+            n = len(self._snmp_mib_oids[mib])
+            walks[mib] = values[start:start + n]
+            start = start + n
+        if self._capture is not None:
+            self._capture.add_snmp(meas_t, mibs, [query_capture.format_walk(walks[mib]) for mib in mibs])
+        start = self._phases.stamp()
+        self.store_snmp(meas_t, zero_pwr, [walks.get(mib) for mib in self._snmp_mibs()])
+        self._phases.lap('snmp_store', start)
+        self._log_query('snmp', meas_t, _QUERY_OK)
+
+    def _snmp_lost(self, meas_t, e):
+        if isinstance(e, snmp_client.snmp_timeout):
+            print " ! snmp query given up: %s" % e
+            self._store_missing('snmp', meas_t, _QUERY_LATE)
+        else:
+            print " ! snmp query failed: %s" % e
+            self._store_missing('snmp', meas_t, _QUERY_FAILED)
+
+    def spawn_snmp(self, meas_t, mibs=None):
+        #
+        # start all the snmp queries of one sample without waiting for them,
+        # None when the native session could not be opened
+        #
+        if mibs is None:
+            mibs = self._snmp_mibs()
+        start = self._phases.stamp()
+        if self._native_snmp:
+            if not self._check_snmp_session(meas_t):
+                self._phases.lap('snmp_spawn', start)
+                return None
+            pending = self._snmp_session.send_get(self._snmp_get_oids(mibs))
+        else:
+            pending = [_spawn(cmd) for cmd in self._snmp_commands(mibs)]
+        self._phases.lap('snmp_spawn', start)
+        return pending
+
+    def wait_snmp(self, meas_t, zero_pwr, pending, mibs=None, deadline=None):
+        #
+        # complete the queries started by spawn_snmp, the ones still running
+        # at the deadline (time.time()) are given up
+        #
+        if mibs is None:
+            mibs = self._snmp_mibs()
+        start = self._phases.stamp()
+        if self._native_snmp:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0.)
+            try:
+                values = self._snmp_session.recv_values(pending, self._snmp_get_oids(mibs), timeout)
+            except snmp_client.snmp_error as e:
+                self._phases.lap('snmp_wait', start)
+                self._snmp_lost(meas_t, e)
+                return
+            self._phases.lap('snmp_wait', start)
+            self._store_snmp_values(meas_t, zero_pwr, mibs, values)
+        else:
+            outputs = [_communicate(p, deadline) for p in pending]
+            self._phases.lap('snmp_wait', start)
+            self.parse_snmp(meas_t, zero_pwr, outputs, mibs)
+
+    def fetch_snmp(self, meas_t, zero_pwr, mibs=None, deadline=None):
+        #
+        # issue the snmp queries one after the other, the ones that are not
+        # done by the deadline (time.time()) are given up
+        #
+        if mibs is None:
+            mibs = self._snmp_mibs()
+        if self._native_snmp:
+            if not self._check_snmp_session(meas_t):
+                return
+            start = self._phases.stamp()
+            try:
+                values = self._snmp_session.get(self._snmp_get_oids(mibs), deadline)
+            except snmp_client.snmp_error as e:
+                self._phases.lap('snmp_wait', start)
+                self._snmp_lost(meas_t, e)
+                return
+            self._phases.lap('snmp_wait', start)
+            self._store_snmp_values(meas_t, zero_pwr, mibs, values)
+            return
+        outputs = []
+        for cmd in self._snmp_commands(mibs):
+            if deadline is not None and time.time() >= deadline:
+                outputs.append(None)
+                continue
+            start = self._phases.stamp()
+            p = _spawn(cmd)
+            start = self._phases.lap('snmp_spawn', start)
+            outputs.append(_communicate(p, deadline))
+            self._phases.lap('snmp_wait', start)
+        self.parse_snmp(meas_t, zero_pwr, outputs, mibs)
+
+    def parse_snmp(self, meas_t, zero_pwr, outputs, mibs=None):
+        #
+        # an output is None when its query was given up, the sample keeps
+        # the subtrees that answered
+        #
+        if mibs is None:
+            mibs = self._snmp_mibs()
+        answered = [(mib, out) for mib, out in zip(mibs, outputs) if out is not None]
+        if not answered:
+            print " ! snmp queries killed at the deadline"
+            self._store_missing('snmp', meas_t, _QUERY_LATE)
+            return
+        if self._capture is not None:
+            self._capture.add_snmp(meas_t, [mib for mib, out in answered], [out for mib, out in answered])
+        start = self._phases.stamp()
+        walks = dict((mib, _decode_walk(out)) for mib, out in answered)
+        start = self._phases.lap('snmp_parse', start)
+        self.store_snmp(meas_t, zero_pwr, [walks.get(mib) for mib in self._snmp_mibs()])
+        self._phases.lap('snmp_store', start)
+        if len(answered) < len(outputs):
+            print " ! %d of %d snmp queries killed at the deadline" % (len(outputs) - len(answered), len(outputs))
+            self._log_query('snmp', meas_t, _QUERY_LATE)
+        else:
+            self._log_query('snmp', meas_t, _QUERY_OK)
+
+    def discover_snmp(self, capture_path=None):
+        #
+        # walk the subtrees with a sensor per value once before sampling, so
+        # that the groups, the blocks and the relay schema have their sensors
+        # from the start. Without it they are set up by the first sample. A
+        # replayed run has the walks at the start of its capture
+        #
+        mibs = [mib for mib in self._sized_mibs if mib not in self._walk_sizes]
+        if not mibs:
+            return
+        if capture_path is not None:
+            for tag, t, payload in query_capture.read_frames(capture_path):
+                if tag == 'TICK':
+                    break
+                if tag == 'WALK':
+                    self._learn_captured_walks(payload)
+            return
+        if self._native_snmp:
+            if self._snmp_session is None:
+                try:
+                    self._open_snmp_session()
+                except snmp_client.snmp_error as e:
+                    print " ! snmp walks failed, the sensors are set up by the first sample: %s" % e
+            return
+        outputs = [_communicate(_spawn(cmd)) for cmd in self._snmp_commands(mibs)]
+        if self._capture is not None:
+            self._capture.add_walks(mibs, outputs)
+        walks = dict(zip(mibs, [_decode_walk(out) for out in outputs]))
+        self._learn_walk_sizes([walks.get(mib) for mib in self._snmp_mibs()])
+
+    def _learn_captured_walks(self, payload):
+        mibs, outputs = query_capture.split_walks(payload)
+        walks = dict(zip(mibs, [_decode_walk(out) for out in outputs]))
+        self._learn_walk_sizes([walks.get(mib) for mib in self._snmp_mibs()])
+
+    def _learn_walk_sizes(self, walks):
+        #
+        # the walks in the order of _snmp_mibs. The size of the first walk
+        # that is not empty is kept for the whole run, the snmp sensors are
+        # set up once it is known for all the subtrees
+        #
+        if 'snmp' in self._ready:
+            return
+        for mib, walk in zip(self._snmp_mibs(), walks):
+            if mib in self._sized_mibs and mib not in self._walk_sizes and walk is not None and len(walk):
+                self._walk_sizes[mib] = len(walk)
+        if len(self._walk_sizes) == len(self._sized_mibs):
+            self._add_sensors('snmp')
+
+    def _resolve_snmp_walks(self):
+        # subtree -> (columns of the snmp values, positions in the walk, nr. of positions needed)
+        walks = {}
+        for mib in self._mibs:
+            rows = [(i, index) for i, (key, query, index, scale) in enumerate(self._sensors['snmp']) if query == mib]
+            positions = numpy.array([index for i, index in rows], dtype=numpy.intp)
+            walks[mib] = (numpy.array([i for i, index in rows], dtype=numpy.intp), positions,
+                          positions.max() + 1 if len(rows) else 0)
+        return walks
+
+    def store_snmp(self, meas_t, zero_pwr, walks):
+        #
+        # the walks in the order of _snmp_mibs, None for the ones that were
+        # not queried. Each walk is copied to its columns at once, the
+        # sensors missing from a walk shorter than the first one are NaN
+        #
+        if 'snmp' not in self._ready:
+            self._learn_walk_sizes(walks)
+            if 'snmp' not in self._ready:
+                return
+        values = numpy.empty(len(self._sensors['snmp']))
+        values.fill(numpy.nan)
+        for mib, walk in zip(self._mibs, walks):
+            if walk is None:
+                continue
+            walk = numpy.asarray(walk, dtype=float)
+            columns, positions, size = self._snmp_walks[mib]
+            if len(walk) < size:
+                present = positions < len(walk)
+                columns, positions = columns[present], positions[present]
+            values[columns] = walk[positions]
+        self._store('snmp', meas_t, values/self._scales['snmp'])
+
+
+    def _ipmi_command(self):
+        #
+        # the ipmi query of one sample
         #
         # ! todo: explain the command arguments
         #
         if self.server_choice == _COLLECT_DELL:
-            cmd = "ipmitool -c -I lanplus -U ltu -P LTU123 -H 192.168.21.151 sdr list full"
-            p = subprocess.Popen(shlex.split(cmd), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            ipmi_all, err = p.communicate()
-
-            count = 0
-            lines = ipmi_all.splitlines()
-            for l in lines:
-                match = re.match("Fan1\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_1.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Fan2\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_2.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Fan3\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_3.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Fan4\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_4.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Fan5\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_5.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Fan6\sRPM,(\d+),RPM,ok", l)
-                if match is not None:
-                    self._u_6.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Inlet\sTemp,(\d+),degrees\sC,ok", l)
-                if match is not None:
-                    self._x_i.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("CPU\sUsage,(\d+),percent,ok", l)
-                if match is not None:
-                    self._l_c.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("IO\sUsage,(\d+),percent,ok", l)
-                if match is not None:
-                    self._l_io.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("MEM\sUsage,(\d+),percent,ok", l)
-                if match is not None:
-                    self._l_m.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("SYS\sUsage,(\d+),percent,ok", l)
-                if match is not None:
-                    self._l_s.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Exhaust\sTemp,(\d+),degrees\sC,ok", l)
-                if match is not None:
-                    self._x_o.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Temp,(\d+),degrees\sC,ok", l)
-                if match is not None:
-                    if count == 0:
-                        self._x_s0.append(meas_t, float(match.group(1)))
-                        count +=1
-                    else:
-                        self._x_s1.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Current\s1,([\d\.]+),Amps,ok", l)
-                if match is not None:
-                    self._c_1.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Current\s2,([\d\.]+),Amps,ok", l)
-                if match is not None:
-                    self._c_2.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Voltage\s1,(\d+),Volts,ok", l)
-                if match is not None:
-                    self._v_1.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Voltage\s2,(\d+),Volts,ok", l)
-                if match is not None:
-                    self._v_2.append(meas_t, float(match.group(1)))
-                    continue
-                match = re.match("Pwr\sConsumption,(\d+),Watts,ok", l)
-                if match is not None:
-                    self._p_c.append(meas_t, float(match.group(1)))
-                    continue
-
+            cmd = "ipmitool -c -I lanplus -U %s -P %s -H %s sdr list full"
         elif self.server_choice == _COLLECT_FB:
-	    cmd = "ipmi-sensors -t Temperature -t Fan --comma-separated-output --ignore-not-available-sensors --no-sensor-type-output --no-header-output -u sics -p sics -D LAN_2_0 -h 10.0.100.122"
-            p = subprocess.Popen(shlex.split(cmd), shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            p.wait()
-            ipmi_all, err = p.communicate()
-            lines = ipmi_all.splitlines()
-            for l in lines:
-                #257,Outlet Cntr Temp,21.00,C,'OK'
-                match = re.match("\d+,Outlet\sCntr\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_o.append(meas_t, float(match.group(1)))
-                    continue
-                #263,Inlet Temp      ,21.00,C,'OK'
-                match = re.match("\d+,Inlet\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_i.append(meas_t, float(match.group(1)))
-                    continue
-                #265,P0 Therm Margin ,-68.00,C,'OK'
-                match = re.match("\d+,P0\sTherm\sMargin\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_s0.append(meas_t, float(match.group(1)))
-                    continue
-                #266,P1 Therm Margin ,-69.00,C,'OK'
-                match = re.match("\d+,P1\sTherm\sMargin\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_s1.append(meas_t, float(match.group(1)))
-                    continue
-                #273,P0 DIMM Temp    ,22.00,C,'OK'
-                match = re.match("\d+,P0\sDIMM\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_d0.append(meas_t, float(match.group(1)))
-                    continue
-                #274,P1 DIMM Temp    ,21.00,C,'OK'
-                match = re.match("\d+,P1\sDIMM\sTemp\s*,([+-]?\d+(?:\.\d+)?),C,'OK'", l)
-                if match is not None:
-                    self._x_d1.append(meas_t, float(match.group(1)))
-                    continue
-                #326,SYS_Fan0        ,2475.00,RPM,'OK'
-                match = re.match("\d+,SYS_Fan0\s*,([+-]?\d+(?:\.\d+)?),RPM,'OK'", l)
-                if match is not None:
-                    self._u_1.append(meas_t, float(match.group(1)))
-                    continue
-                #327,SYS_Fan1        ,2475.00,RPM,'OK'
-                match = re.match("\d+,SYS_Fan1\s*,([+-]?\d+(?:\.\d+)?),RPM,'OK'", l)
-                if match is not None:
-                    self._u_2.append(meas_t, float(match.group(1)))
-                    continue
+            cmd = "ipmi-sensors -t Temperature -t Fan --comma-separated-output --ignore-not-available-sensors --no-sensor-type-output --no-header-output -u %s -p %s -D LAN_2_0 -h %s"
+        return self._target.wrap(cmd % (self._target.user, self._target.password, self._target.ipmi_host))
+
+    def _open_ipmi_session(self):
+        #
+        # the FB box is queried with ipmitool too since ipmi-sensors cannot
+        # keep a session open, see parse_ipmi for its output
+        #
+        cmd = "ipmitool -c -I lanplus -U %s -P %s -H %s shell"
+        cmd = self._target.wrap(cmd % (self._target.user, self._target.password, self._target.ipmi_host))
+        self._ipmi_session = ipmi_session.ipmi_session(cmd, "sdr list full")
+
+    def spawn_ipmi(self):
+        # start the ipmi query of one sample without waiting for it
+        start = self._phases.stamp()
+        if self._use_ipmi_session:
+            if self._ipmi_session is None:
+                self._open_ipmi_session()
+            self._ipmi_session.send()
+            pending = self._ipmi_session
+        else:
+            pending = _spawn(self._ipmi_command())
+        self._phases.lap('ipmi_spawn', start)
+        return pending
+
+    def _ipmi_lost(self, meas_t, e):
+        # the session is reopened by the next sample
+        if isinstance(e, ipmi_session.ipmi_session_timeout):
+            print " ! ipmi query given up: %s" % e
+            self._store_missing('ipmi', meas_t, _QUERY_LATE)
+        else:
+            print " ! ipmi session lost: %s" % e
+            self._store_missing('ipmi', meas_t, _QUERY_FAILED)
+
+    def wait_ipmi(self, meas_t, pending, deadline=None):
+        #
+        # complete the query started by spawn_ipmi, it is given up when it
+        # did not answer by the deadline (time.time())
+        #
+        start = self._phases.stamp()
+        if self._use_ipmi_session:
+            try:
+                ipmi_all = pending.receive(deadline)
+            except ipmi_session.ipmi_session_error as e:
+                self._phases.lap('ipmi_wait', start)
+                self._ipmi_lost(meas_t, e)
+                return
+        else:
+            ipmi_all = _communicate(pending, deadline)
+            if ipmi_all is None:
+                self._phases.lap('ipmi_wait', start)
+                print " ! ipmi query killed at the deadline"
+                self._store_missing('ipmi', meas_t, _QUERY_LATE)
+                return
+        self._phases.lap('ipmi_wait', start)
+        self.parse_ipmi(meas_t, ipmi_all)
+
+    def fetch_use_ipmi(self, meas_t, deadline=None):
+        assert isinstance(meas_t, float)
+        #
+        # issue the ipmi query
+        #
+        if not self._use_ipmi_session:
+            self.wait_ipmi(meas_t, self.spawn_ipmi(), deadline)
+            return
+        if self._ipmi_session is None:
+            self._open_ipmi_session()
+        start = self._phases.stamp()
+        try:
+            ipmi_all = self._ipmi_session.query(deadline)
+        except ipmi_session.ipmi_session_error as e:
+            self._phases.lap('ipmi_wait', start)
+            self._ipmi_lost(meas_t, e)
+            return
+        self._phases.lap('ipmi_wait', start)
+        self.parse_ipmi(meas_t, ipmi_all)
+
+    def print_ipmi_session_stats(self):
+        if self._ipmi_session is None:
+            return
+        stats = self._ipmi_session.get_stats()
+        print "ipmi session: %d connects, %d samples on a reused session" % (stats['connects'], stats['reused'])
+        if stats['saved_per_sample'] is not None:
+            print "  first answer %.1f [ms], reused %.1f [ms], saved %.1f [ms] per sample" % \
+                (1e3*stats['first_latency'], 1e3*stats['reused_latency'], 1e3*stats['saved_per_sample'])
+
+    def _resolve_ipmi_sensors(self):
+        # SDR name -> the columns of the ipmi values of its rows, see _SENSORS
+        rows = {}
+        for i, (key, query, index, scale) in enumerate(self._sensors['ipmi']):
+            rows.setdefault(query, []).append((index, i))
+        return dict((name, tuple(i for index, i in sorted(columns))) for name, columns in rows.items())
+
+    def parse_ipmi(self, meas_t, ipmi_all):
+        assert isinstance(meas_t, float)
+        if self._capture is not None:
+            self._capture.add_ipmi(meas_t, ipmi_all)
+        start = self._phases.stamp()
+        #
+        # each line is split once and its sensor name looked up in the table,
+        # a name listed more than once (the Dell "Temp" rows) fills its columns
+        # in the order the rows are printed, extra rows go to the last column
+        #
+        if self.server_choice == _COLLECT_FB and not self._use_ipmi_session:
+            # ipmi-sensors: "<id>,<name>,<value>,<unit>,'OK'"
+            name_idx, value_idx, status_idx, status_ok = 1, 2, 4, "'OK'"
+        else:
+            # ipmitool -c: "<name>,<value>,<unit>,ok"
+            name_idx, value_idx, status_idx, status_ok = 0, 1, 3, 'ok'
+        nr_fields = status_idx + 1
+
+        sensors = self._ipmi_sensors
+        values = [numpy.nan]*len(self._sensors['ipmi'])
+        seen = {}
+        for l in ipmi_all.splitlines():
+            fields = l.split(',')
+            if len(fields) != nr_fields or fields[status_idx] != status_ok:
+                continue
+            columns = sensors.get(fields[name_idx].rstrip())
+            if columns is None:
+                continue
+            try:
+                value = float(fields[value_idx])
+            except ValueError:
+                continue
+            if len(columns) == 1:
+                values[columns[0]] = value
+            else:
+                n = seen.get(columns, 0)
+                seen[columns] = n + 1
+                values[columns[min(n, len(columns) - 1)]] = value
+        start = self._phases.lap('ipmi_parse', start)
+        self._store('ipmi', meas_t, numpy.array(values)/self._scales['ipmi'])
+        self._phases.lap('ipmi_store', start)
+        self._log_query('ipmi', meas_t, _QUERY_OK)
 
     def collect(self, sampling_period, timelength):
         assert isinstance(sampling_period, (int,float))
@@ -608,302 +1419,630 @@ class server(object):
         endtest_time = timelength * 3600
         print "Endtest time %d [sec]" % endtest_time
         
-        late_counter = 0
-        loop_counter = 0
+        #
+        # the ticks start on a grid of absolute deadlines, the time spent in
+        # the queries is not added to the period. With sensor groups the tick
+        # divides all the group periods and each tick only runs the queries
+        # of the groups that are due. The queries of a tick are given up
+        # once they took the query budget share of the tick, so a BMC that
+        # hangs costs a sample and not the run
+        #
+        if self._use_snmp:
+            self.discover_snmp()
+        self._default_group.period = sampling_period
+        periods = [group.period for group in self._groups if group.traces]
+        tick = _base_period(periods or [sampling_period])
+        assert tick >= 1./_MAX_SAMPLING_PERIOD, "the group periods need a %.3f [sec] tick" % tick
+        for group in self._groups:
+            for block in group.get_blocks():
+                block.reserve(min(int(endtest_time/group.period) + 1, _RESERVED_SAMPLES))
+        mibs = self._snmp_mibs()
+        next_save = 0.
+        if self._periodic_save is not None:
+            next_save = self._periodic_save[1]
+        self._scheduler = sample_scheduler.deadline_scheduler(tick, self._overrun_policy)
         while True:
-            loop_counter = loop_counter + 1
+            if self._scheduler.get_next_offset() >= endtest_time:
+                print "Reached end of test: %.2f / %.2f [sec]" % (self._scheduler.get_next_offset(), endtest_time)
+                if self._ipmi_session is not None:
+                    self._ipmi_session.close()
+                break
+            self._scheduler.wait()
+            tick_start = self._phases.stamp()
             cur_time = time.time()
+            deadline = cur_time + self._query_budget*tick
             if zero_time == None:
                 zero_time = cur_time
             meas_t = cur_time - zero_time
-            if meas_t >= endtest_time:
-                print "Reached end of test: %.2f / %.2f [sec]" % (meas_t, endtest_time)
-                break
 
-            if self._use_ipmi:
+            if self._capture is not None:
+                self._capture.tick(self._scheduler.get_tick_offset())
+            queries = set()
+            for group in self._groups:
+                if group.update_due(self._scheduler.get_tick_offset()):
+                    queries.update(group.queries)
+            if 'snmp' not in self._ready:
+                # until they answer their first walk
+                queries.update(self._sized_mibs)
+            due_mibs = [mib for mib in mibs if mib in queries]
+
+            #
+            # in concurrent mode the queries of both sources are only started
+            # here, each source is timestamped when its queries are started
+            #
+            meas_t_ipmi = None
+            meas_t_snmp = None
+            ipmi_proc = None
+            snmp_procs = None
+            if self._use_ipmi and 'ipmi' in queries:
                 cur_time = time.time()
                 if zero_time_ipmi == None:
                     zero_time_ipmi = cur_time
                     self._s_t_ipmi.save_start_time(zero_time_ipmi)
                 meas_t_ipmi = cur_time - zero_time_ipmi
-                self.fetch_use_ipmi(meas_t_ipmi)
+                if self._concurrent:
+                    ipmi_proc = self.spawn_ipmi()
+                else:
+                    self.fetch_use_ipmi(meas_t_ipmi, deadline)
 
-            if self._use_snmp:
+            if self._use_snmp and due_mibs:
                 cur_time = time.time()
                 if zero_time_snmp == None:
                     zero_time_snmp = cur_time
                     self._s_t_snmp.save_start_time(zero_time_snmp)
                 meas_t_snmp = cur_time - zero_time_snmp
-                self.fetch_snmp(meas_t_snmp, zero_pwr)
-           
-            if self.conn:
-                self._relay_data(meas_t_ipmi, meas_t_snmp)
-            
-            # wait until the next sampling time
-            delta_interval = time.time() - cur_time
+                if self._concurrent:
+                    snmp_procs = self.spawn_snmp(meas_t_snmp, due_mibs)
+                else:
+                    self.fetch_snmp(meas_t_snmp, zero_pwr, due_mibs, deadline)
 
-            if not sampling_period - delta_interval <= 0:
-                time.sleep(sampling_period - delta_interval)
-            else:
-                late_counter = late_counter + 1
-                print " ! late %.3fs rate=%.2f" % (delta_interval - sampling_period, late_counter/float(loop_counter))
-
-    def save_numpy(self,path):
-        x_i_time, x_i_data = self._x_i.get_time_with_data()
-        x_o_time, x_o_data = self._x_o.get_time_with_data()
-        x_s0_time,x_s0_data = self._x_s0.get_time_with_data()
-        x_s1_time,x_s1_data = self._x_s1.get_time_with_data()
-        u_1_time, u_1_data = self._u_1.get_time_with_data()
-        u_2_time, u_2_data = self._u_2.get_time_with_data()
-        u_3_time, u_3_data = self._u_3.get_time_with_data()
-        u_4_time, u_4_data = self._u_4.get_time_with_data()
-        u_5_time, u_5_data = self._u_5.get_time_with_data()
-        u_6_time, u_6_data = self._u_6.get_time_with_data()
-        l_c_time, l_c_data = self._l_c.get_time_with_data()
-        l_io_time,l_io_data = self._l_io.get_time_with_data()
-        l_m_time, l_m_data = self._l_m.get_time_with_data()
-        l_s_time, l_s_data = self._l_s.get_time_with_data()
-        v_1_time, v_1_data = self._v_1.get_time_with_data()
-        v_2_time, v_2_data = self._v_2.get_time_with_data()
-        c_1_time, c_1_data = self._c_1.get_time_with_data()
-        c_2_time, c_2_data = self._c_2.get_time_with_data()
-        p_c_time, p_c_data = self._p_c.get_time_with_data()
-        
+            #
+            # all the queries of the tick are running now, so waiting for them
+            # costs the slowest query and not the sum of them
+            #
+            if ipmi_proc is not None:
+                self.wait_ipmi(meas_t_ipmi, ipmi_proc, deadline)
+            if snmp_procs is not None:
+                self.wait_snmp(meas_t_snmp, zero_pwr, snmp_procs, due_mibs, deadline)
+
+            self._finish_tick(self._scheduler.get_tick_offset(), meas_t_ipmi, meas_t_snmp)
+
+            if self._periodic_save is not None and meas_t >= next_save:
+                path, every = self._periodic_save
+                start = self._phases.stamp()
+                self.save_matlab(path, sampling_period, timelength, True, False)
+                self._phases.lap('save', start)
+                next_save = (numpy.floor(meas_t/every) + 1)*every
+
+            self._phases.lap('tick', tick_start)
+            overrun = self._scheduler.done()
+            if overrun > 0:
+                print " ! late %.3fs rate=%.2f" % (overrun, self._scheduler.get_late_ratio())
+
+    def _finish_tick(self, offset, meas_t_ipmi, meas_t_snmp):
+        # the samples of the tick are stored, pass them on
+        if self._relay is not None:
+            self._relay_data(offset, meas_t_ipmi, meas_t_snmp)
+        if self._recorder is None and self._column_store is None:
+            return
+        start = self._phases.stamp()
+        if self._recorder is not None:
+            self._recorder.tick()
+        if self._column_store is not None:
+            self._column_store.tick()
+        self._phases.lap('flush', start)
+
+    def replay(self, path, sampling_period, speed=1.):
+        #
+        # run a capture of query_capture.py through the parsers and the
+        # storage as collect() did, at speed times the pace it was captured
+        # at or as fast as possible when speed is 0. The groups are due at
+        # the offsets of the captured ticks. Returns the nr. of ticks
+        #
+        assert sampling_period > 0
+        assert speed >= 0
+        self._default_group.period = sampling_period
+        start_traces = dict((trace.get_name(), trace) for trace in (self._s_t_ipmi, self._s_t_snmp))
+        zero_time = time.time()
+        tick = None
+        nr_ticks = 0
+        for tag, t, payload in query_capture.read_frames(path):
+            if tag == 'TICK':
+                if tick is not None:
+                    self._finish_tick(*tick)
+                if speed > 0:
+                    delay = zero_time + t/speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                for group in self._groups:
+                    group.update_due(t)
+                tick = [t, None, None]
+                nr_ticks += 1
+            elif tag == 'IPMI' and tick is not None:
+                self.parse_ipmi(t, payload)
+                tick[1] = t
+            elif tag == 'SNMP' and tick is not None:
+                mibs, outputs = query_capture.split_walks(payload)
+                self.parse_snmp(t, None, outputs, mibs)
+                tick[2] = t
+            elif tag == 'WALK':
+                self._learn_captured_walks(payload)
+            elif tag == 'META':
+                for name, start_time in json.loads(payload).get('start_time', {}).items():
+                    start_traces[name].save_start_time(start_time)
+        if tick is not None:
+            self._finish_tick(*tick)
+        return nr_ticks
+
+    def _iter_trace_variables(self):
+        # <key>_t and <key> of every trace of _SENSORS, one trace at a time
+        for key in sorted(self._traces):
+            times, values = self._traces[key].get_time_with_data()
+            yield key + '_t', times
+            yield key, values
+        # q_<source>_t and q_<source>, the quality of each query
+        for source in _SOURCES:
+            times, quality = self._query_log[source].get_column(0)
+            yield 'q_%s_t' % source, times
+            yield 'q_' + source, quality
+
+    def _get_meta_variables(self):
+        #
+        # the start times of the sources, a source that was not used has
+        # none, and the statistics of the schedule
+        #
+        variables = {}
+        for trace in (self._s_t_ipmi, self._s_t_snmp):
+            start_time = trace.get_start_time()
+            if start_time is None:
+                start_time = numpy.array([])
+            variables[trace.get_name()] = start_time
+        variables.update(self._get_run_variables())
+        return variables
+
+    def _get_trace_variables(self):
+        variables = dict(self._iter_trace_variables())
+        variables.update(self._get_meta_variables())
+        return variables
+
+    def set_grid(self, period, method='zoh', max_gap=None, loads=None):
+        #
+        # also save the traces resampled onto a uniform grid, with the loads
+        # of trace_grid.read_stress_loads on the same grid, see trace_grid.py
+        #
+        assert period > 0
+        assert method in trace_grid.METHODS
+        assert max_gap is None or max_gap > 0
+        self._grid = (period, method, max_gap, loads)
+
+    def _get_absolute_parts(self):
+        #
+        # the names of the traces and their (times, values) without the
+        # missing samples, the times are absolute and not from the start of
+        # their source
+        #
+        start_times = {'ipmi': self._s_t_ipmi.get_start_time(), 'snmp': self._s_t_snmp.get_start_time()}
+        names = []
+        parts = []
+        for key in sorted(self._traces):
+            times = []
+            values = []
+            for source in _SOURCES:
+                if key not in self._columns[source] or start_times[source] is None:
+                    continue
+                block, column = self._columns[source][key]
+                t, v = block.get_column(column)
+                present = v == v
+                times.append(t[present] + start_times[source])
+                values.append(v[present])
+            times = numpy.concatenate(times + [numpy.empty(0)])
+            values = numpy.concatenate(values + [numpy.empty(0)])
+            if len(times) and (numpy.diff(times) < 0).any():
+                order = numpy.argsort(times, kind='mergesort')
+                times, values = times[order], values[order]
+            names.append(key)
+            parts.append((times, values))
+        return names, parts
+
+    def _get_grid_variables(self):
+        #
+        # grid, a row per time of grid_t [sec] from grid_s_t and a column per
+        # name of grid_names (comma separated), the loads last
+        #
+        if self._grid is None:
+            return {}
+        period, method, max_gap, loads = self._grid
+        start_times = [t for t in (self._s_t_ipmi.get_start_time(), self._s_t_snmp.get_start_time()) if t is not None]
+        if not start_times:
+            return {}
+        zero_time = min(start_times)
+        names, parts = self._get_absolute_parts()
+        end = max([t[-1] for t, v in parts if len(t)] + [zero_time])
+        grid = trace_grid.uniform_grid(zero_time, end, period)
+        matrix = trace_grid.resample(parts, grid, method, max_gap)
+        if loads is not None:
+            names = names + [name for name, t, v, load_period in loads]
+            # the columns stay contiguous, see trace_grid.py
+            matrix = numpy.concatenate([matrix.T, trace_grid.align_loads(loads, grid).T]).T
+        return {'grid': matrix, 'grid_t': grid - zero_time, 'grid_s_t': zero_time,
+                'grid_names': ','.join(names), 'grid_method': method}
+
+    def save_numpy(self, path):
         if not path.endswith(".npz"):
             path = path + ".npz"
-        numpy.savez(path, x_i_t = x_i_time, x_i = x_i_data, \
-            x_o_t = x_o_time, x_o = x_o_data, \
-            x_s0_t = x_s0_time, x_s0 = x_s0_data, \
-            x_s1_t = x_s1_time, x_s1 = x_s1_data, \
-            u_1_t = u_1_time, u_1 = u_1_data, \
-            u_2_t = u_2_time, u_2 = u_2_data, \
-            u_3_t = u_3_time, u_3 = u_3_data, \
-            u_4_t = u_4_time, u_4 = u_4_data, \
-            u_5_t = u_5_time, u_5 = u_5_data, \
-            u_6_t = u_6_time, u_6 = u_6_data, \
-            l_c_t = l_c_time, l_c = l_c_data, \
-            l_io_t = l_io_time, l_io = l_io_data, \
-            l_m_t = l_m_time, l_m = l_m_data, \
-            l_s_t = l_s_time, l_s = l_s_data, \
-            v_1_t = v_1_time, v_1 = v_1_data, \
-            v_2_t = v_2_time, v_2 = v_2_data, \
-            c_1_t = c_1_time, c_1 = c_1_data, \
-            c_2_t = c_2_time, c_2 = c_2_data, \
-            p_c_t = p_c_time, p_c = p_c_data)
-        
+        variables = self._get_trace_variables()
+        variables.update(self._get_grid_variables())
+        numpy.savez(path, **variables)
 
-    def save_matlab(self, path, period, timelength):
-
-        # IPMI
-        x_i_time, x_i_data = self._x_i.get_time_with_data()
-        x_o_time, x_o_data = self._x_o.get_time_with_data()
-        x_s0_time, x_s0_data = self._x_s0.get_time_with_data()
-        x_s1_time, x_s1_data = self._x_s1.get_time_with_data()
-        x_d0_time, x_d0_data = self._x_d0.get_time_with_data()
-        x_d1_time, x_d1_data = self._x_d1.get_time_with_data()
-        u_1_time, u_1_data = self._u_1.get_time_with_data()
-        u_2_time, u_2_data = self._u_2.get_time_with_data()
-        u_3_time, u_3_data = self._u_3.get_time_with_data()
-        u_4_time, u_4_data = self._u_4.get_time_with_data()
-        u_5_time, u_5_data = self._u_5.get_time_with_data()
-        u_6_time, u_6_data = self._u_6.get_time_with_data()
-        l_c_time, l_c_data = self._l_c.get_time_with_data()
-        l_io_time, l_io_data = self._l_io.get_time_with_data()
-        l_m_time, l_m_data = self._l_m.get_time_with_data()
-        l_s_time, l_s_data = self._l_s.get_time_with_data()
-        v_1_time, v_1_data = self._v_1.get_time_with_data()
-        v_2_time, v_2_data = self._v_2.get_time_with_data()
-        c_1_time, c_1_data = self._c_1.get_time_with_data()
-        c_2_time, c_2_data = self._c_2.get_time_with_data()
-        p_c_time, p_c_data = self._p_c.get_time_with_data()
-
-        # SNMP
-        x_0_time, x_0_data = self._x_0.get_time_with_data()
-        x_1_time, x_1_data = self._x_1.get_time_with_data()
-        x_2_time, x_2_data = self._x_2.get_time_with_data()
-        x_3_time, x_3_data = self._x_3.get_time_with_data()
-        x_4_time, x_4_data = self._x_4.get_time_with_data()
-        x_5_time, x_5_data = self._x_5.get_time_with_data()
-        x_6_time, x_6_data = self._x_6.get_time_with_data()
-        x_7_time, x_7_data = self._x_7.get_time_with_data()
-        x_8_time, x_8_data = self._x_8.get_time_with_data()
-        x_9_time, x_9_data = self._x_9.get_time_with_data()
-        x_10_time, x_10_data = self._x_10.get_time_with_data()
-        x_11_time, x_11_data = self._x_11.get_time_with_data()
-        x_12_time, x_12_data = self._x_12.get_time_with_data()
-        x_13_time, x_13_data = self._x_13.get_time_with_data()
-        x_14_time, x_14_data = self._x_14.get_time_with_data()
-        x_15_time, x_15_data = self._x_15.get_time_with_data()
-        x_16_time, x_16_data = self._x_16.get_time_with_data()
-        x_17_time, x_17_data = self._x_17.get_time_with_data()
-
-        l_0_time, l_0_data = self._l_0.get_time_with_data()
-        l_1_time, l_1_data = self._l_1.get_time_with_data()
-        l_2_time, l_2_data = self._l_2.get_time_with_data()
-        l_3_time, l_3_data = self._l_3.get_time_with_data()
-        l_4_time, l_4_data = self._l_4.get_time_with_data()
-        l_5_time, l_5_data = self._l_5.get_time_with_data()
-        l_6_time, l_6_data = self._l_6.get_time_with_data()
-        l_7_time, l_7_data = self._l_7.get_time_with_data()
-        l_8_time, l_8_data = self._l_8.get_time_with_data()
-        l_9_time, l_9_data = self._l_9.get_time_with_data()
-        l_10_time, l_10_data = self._l_10.get_time_with_data()
-        l_11_time, l_11_data = self._l_11.get_time_with_data()
-        l_12_time, l_12_data = self._l_12.get_time_with_data()
-        l_13_time, l_13_data = self._l_13.get_time_with_data()
-        l_14_time, l_14_data = self._l_14.get_time_with_data()
-        l_15_time, l_15_data = self._l_15.get_time_with_data()
-        l_16_time, l_16_data = self._l_16.get_time_with_data()
-        l_17_time, l_17_data = self._l_17.get_time_with_data()
-        l_18_time, l_18_data = self._l_18.get_time_with_data()
-        l_19_time, l_19_data = self._l_19.get_time_with_data()
-        l_20_time, l_20_data = self._l_20.get_time_with_data()
-        l_21_time, l_21_data = self._l_21.get_time_with_data()
-        l_22_time, l_22_data = self._l_22.get_time_with_data()
-        l_23_time, l_23_data = self._l_23.get_time_with_data()
-        l_24_time, l_24_data = self._l_24.get_time_with_data()
-        l_25_time, l_25_data = self._l_25.get_time_with_data()
-        l_26_time, l_26_data = self._l_26.get_time_with_data()
-        l_27_time, l_27_data = self._l_27.get_time_with_data()
-        l_28_time, l_28_data = self._l_28.get_time_with_data()
-        l_29_time, l_29_data = self._l_29.get_time_with_data()
-        l_30_time, l_30_data = self._l_30.get_time_with_data()
-        l_31_time, l_31_data = self._l_31.get_time_with_data()
-
-        start_time_ipmi = self._s_t_ipmi.get_start_time()
-        start_time_snmp = self._s_t_snmp.get_start_time()
-        
+    def set_periodic_save(self, path, every):
+        # also save the .mat file every so many seconds while collecting
+        assert every > 0
+        self._periodic_save = (path, every)
+
+    def save_matlab(self, path, period, timelength, append=False, with_grid=True):
+        #
+        # the variables are streamed to the file one trace at a time. With
+        # append a later save of the run only adds the samples taken since
+        # the one before, in place in the same file. The samples of a tick
+        # sort after those of the earlier ticks, so they are appended in the
+        # order of a save of the whole run. The grid is computed again at
+        # each save, the periodic saves leave it out
+        #
         if not path.endswith(".mat"):
              path = path + ".mat"
+        writer = mat_writer.mat_writer(path, append and path in self._saved_paths, append)
+        writer.write('timelength', timelength)
+        writer.write('period', period)
+        for name, values in self._iter_trace_variables():
+            new = values[writer.get_length(name):]
+            if len(new) or name not in writer.get_names():
+                writer.append(name, new)
+        for name, value in sorted(self._get_meta_variables().items()):
+            writer.write(name, value)
+        if with_grid:
+            for name, value in sorted(self._get_grid_variables().items()):
+                writer.write(name, value)
+        writer.close()
+        self._saved_paths.add(path)
+
+    def _get_schedule_variables(self):
+        #
+        # how well the sampling grid was kept, the jitter and overrun
+        # histograms are rows of (bucket lower bound [sec], count)
+        #
+        if self._scheduler is None:
+            return {}
+        return self._scheduler.get_variables()
+
+    def _get_run_variables(self):
+        # the schedule and the time spent in each phase of the ticks
+        variables = self._get_schedule_variables()
+        variables.update(self._phases.get_variables())
+        return variables
+
+    def print_schedule_stats(self):
+        if self._scheduler is not None:
+            self._scheduler.print_stats()
+
+    def get_phase_summary(self, recent=True):
+        #
+        # phase -> count, mean, p50, p99 and max [sec] of its last laps, or
+        # of all of them, see phase_timer. Also asked by the relay viewers
+        #
+        return self._phases.get_summary(recent)
+
+    def print_phase_stats(self):
+        self._phases.print_stats()
+
+    def get_query_stats(self):
+        # source -> nr. of queries, of the ones given up and of the failed ones
+        stats = {}
+        for source, counts in self._query_counts.items():
+            stats[source] = {'queries': int(counts.sum()), 'late': int(counts[_QUERY_LATE]),
+                             'failed': int(counts[_QUERY_FAILED])}
+        return stats
 
-        scipy.io.savemat(path, {'timelength':timelength, 'period':period, \
-                    's_t_ipmi':start_time_ipmi, 's_t_snmp':start_time_snmp, \
-                    'x_0':x_0_data,   'x_0_t':x_0_time, \
-                    'x_1':x_1_data,   'x_1_t':x_1_time, \
-                    'x_2':x_2_data,   'x_2_t':x_2_time, \
-                    'x_3':x_3_data,   'x_3_t':x_3_time, \
-                    'x_4':x_4_data,   'x_4_t':x_4_time, \
-                    'x_5':x_5_data,   'x_5_t':x_5_time, \
-                    'x_6':x_6_data,   'x_6_t':x_6_time, \
-                    'x_7':x_7_data,   'x_7_t':x_7_time, \
-                    'x_8':x_8_data,   'x_8_t':x_8_time, \
-                    'x_9':x_9_data,   'x_9_t':x_9_time, \
-                    'x_10':x_10_data, 'x_10_t':x_10_time, \
-                    'x_11':x_11_data, 'x_11_t':x_11_time,\
-                    'x_12':x_12_data, 'x_12_t':x_12_time, \
-                    'x_13':x_13_data, 'x_13_t':x_13_time, \
-                    'x_14':x_14_data, 'x_14_t':x_14_time, \
-                    'x_15':x_15_data, 'x_15_t':x_15_time, \
-                    'x_16':x_16_data, 'x_16_t':x_16_time, \
-                    'x_17':x_17_data, 'x_17_t':x_17_time, \
-                    'l_0':l_0_data,   'l_0_t':l_0_time, \
-                    'l_1':l_1_data,   'l_1_t':l_1_time, \
-                    'l_2':l_2_data,   'l_2_t':l_2_time, \
-                    'l_3':l_3_data,   'l_3_t':l_3_time, \
-                    'l_4':l_4_data,   'l_4_t':l_4_time, \
-                    'l_5':l_5_data,   'l_5_t':l_5_time, \
-                    'l_6':l_6_data,   'l_6_t':l_6_time, \
-                    'l_7':l_7_data,   'l_7_t':l_7_time, \
-                    'l_8':l_8_data,   'l_8_t':l_8_time, \
-                    'l_9':l_9_data,   'l_9_t':l_9_time, \
-                    'l_10':l_10_data, 'l_10_t':l_10_time, \
-                    'l_11':l_11_data, 'l_11_t':l_11_time,\
-                    'l_12':l_12_data, 'l_12_t':l_12_time, \
-                    'l_13':l_13_data, 'l_13_t':l_13_time, \
-                    'l_14':l_14_data, 'l_14_t':l_14_time, \
-                    'l_15':l_15_data, 'l_15_t':l_15_time, \
-                    'l_16':l_16_data, 'l_16_t':l_16_time, \
-                    'l_17':l_17_data, 'l_17_t':l_17_time, \
-                    'l_18':l_18_data, 'l_18_t':l_18_time, \
-                    'l_19':l_19_data, 'l_19_t':l_19_time, \
-                    'l_20':l_20_data, 'l_20_t':l_20_time, \
-                    'l_21':l_21_data, 'l_21_t':l_21_time, \
-                    'l_22':l_22_data, 'l_22_t':l_22_time, \
-                    'l_23':l_23_data, 'l_23_t':l_23_time, \
-                    'l_24':l_24_data, 'l_24_t':l_24_time, \
-                    'l_25':l_25_data, 'l_25_t':l_25_time, \
-                    'l_26':l_26_data, 'l_26_t':l_26_time, \
-                    'l_27':l_27_data, 'l_27_t':l_27_time, \
-                    'l_28':l_28_data, 'l_28_t':l_28_time, \
-                    'l_29':l_29_data, 'l_29_t':l_29_time, \
-                    'l_30':l_30_data, 'l_30_t':l_30_time,\
-                    'l_31':l_31_data, 'l_31_t':l_31_time, \
-                    'x_i':x_i_data,   'x_i_t':x_i_time, \
-                    'x_o':x_o_data,   'x_o_t':x_o_time, \
-                    'x_s0':x_s0_data, 'x_s0_t':x_s0_time, \
-                    'x_s1':x_s1_data, 'x_s1_t':x_s1_time, \
-                    'x_d0':x_d0_data, 'x_d0_t':x_d0_time, \
-                    'x_d1':x_d1_data, 'x_d1_t':x_d1_time, \
-                    'u_1':u_1_data,   'u_1_t':u_1_time, \
-                    'u_2':u_2_data,   'u_2_t':u_2_time, \
-                    'u_3':u_3_data,   'u_3_t':u_3_time, \
-                    'u_4':u_4_data,   'u_4_t':u_4_time, \
-                    'u_5':u_5_data,   'u_5_t':u_5_time, \
-                    'u_6':u_6_data,   'u_6_t':u_6_time, \
-                    'l_c':l_c_data,   'l_c_t':l_c_time, \
-                    'l_io':l_io_data, 'l_io_t':l_io_time,\
-                    'l_m':l_m_data,   'l_m_t':l_m_time, \
-                    'l_s':l_s_data,   'l_s_t':l_s_time, \
-                    'c_1':c_1_data,   'c_1_t':c_1_time, \
-                    'c_2':c_2_data,   'c_2_t':c_2_time, \
-                    'v_1':v_1_data,   'v_1_t':v_1_time, \
-                    'v_2':v_2_data,   'v_2_t':v_2_time, \
-                    'p_c':p_c_data,   'p_c_t':p_c_time, })
-
-    def _relay_data(self, meas_t_ipmi, meas_t_snmp):
-        if self.conn:
+    def print_query_stats(self):
+        for source, stats in sorted(self.get_query_stats().items()):
+            if stats['queries']:
+                print "%s queries: %d, %d given up at the deadline, %d failed" % \
+                    (source, stats['queries'], stats['late'], stats['failed'])
+
+    def _relay_queries(self):
+        # what the relay viewers can ask, see relay_protocol.query_request
+        return {'phases': lambda request: self.get_phase_summary(bool(request.get('recent', True))),
+                'queries': lambda request: self.get_query_stats(),
+                'rollup': self._answer_rollup,
+                'window': self._answer_window,
+                'at': self._answer_at,
+                'latest': self._answer_latest}
+
+    def _answer_text_query(self, line):
+        # the text relay only answers queries, with a REPLY: line
+        try:
+            reply = relay_protocol.answer_query(self._relay_queries(), relay_protocol.parse_request(line))
+        except ValueError as e:
+            reply = {'error': str(e)}
+        return None, 'REPLY:' + json.dumps(reply) + '\n'
+
+    def _relay_data(self, offset, meas_t_ipmi, meas_t_snmp):
+        # offset of the tick from the first one [sec]
+        if self._relay_plan is None:
+            # the snmp sensors are not known yet
+            return
+        phase_start = self._phases.stamp()
+        values = _read_last(self._relay_plan)
+        phase_start = self._phases.lap('relay_read', phase_start)
+        if self._relay_publisher is not None:
+            for trace in (self._s_t_ipmi, self._s_t_snmp):
+                self._relay_publisher.set_meta(trace.get_name(), trace.get_start_time())
+            self._relay_publisher.publish(offset, (meas_t_ipmi, meas_t_snmp), values)
+            self._phases.lap('relay_send', phase_start)
+        elif self._relay is not None:
+            #
+            # SNMP:x_t_snmp,<t>,s_t_snmp,<t>,<key>,<value>,... with a line
+            # per subtree, then IPMI:x_t_ipmi,<t>,s_t_ipmi,<t>,<key>,<value>,...
+            #
+            pairs = ['%s,%s' % pair for pair in zip(self._relay_keys, values.tolist())]
+            lines = []
+            start = 0
+            for keys in self._relay_lines:
+                lines.append(''.join(',' + pair for pair in pairs[start:start + len(keys)]) + '\n')
+                start = start + len(keys)
             msg = 'SNMP:' + 'x_t_snmp,' + str(meas_t_snmp) + ',s_t_snmp,' + str(self._s_t_snmp.get_start_time()) + \
-                ','+ self._x_0.get_name() +',' + str(self._x_0.get_last_value()) + ',x_1,' + str(self._x_1.get_last_value()) + \
-                ',x_2,' + str(self._x_2.get_last_value()) + ',x_3,' + str(self._x_3.get_last_value()) + \
-                ',x_4,' + str(self._x_4.get_last_value()) + ',x_5,' + str(self._x_5.get_last_value()) + \
-                ',x_6,' + str(self._x_6.get_last_value()) + ',x_7,' + str(self._x_7.get_last_value()) + \
-                ',x_8,' + str(self._x_8.get_last_value()) + ',x_9,' + str(self._x_9.get_last_value()) + \
-                ',x_10,' + str(self._x_10.get_last_value()) + ',x_11,' + str(self._x_11.get_last_value()) + \
-                ',x_12,' + str(self._x_12.get_last_value()) + ',x_13,' + str(self._x_13.get_last_value()) + \
-                ',x_14,' + str(self._x_14.get_last_value()) + ',x_15,' + str(self._x_15.get_last_value()) + \
-                ',x_16,' + str(self._x_16.get_last_value()) + ',x_17,' + str(self._x_17.get_last_value()) + '\n' + \
-                ',l_0,' + str(self._l_0.get_last_value()) + ',l_1,' + str(self._l_1.get_last_value()) + \
-                ',l_2,' + str(self._l_2.get_last_value()) + ',l_3,' + str(self._l_3.get_last_value()) + \
-                ',l_4,' + str(self._l_4.get_last_value()) + ',l_5,' + str(self._l_5.get_last_value()) + \
-                ',l_6,' + str(self._l_6.get_last_value()) + ',l_7,' + str(self._l_7.get_last_value()) + \
-                ',l_8,' + str(self._l_8.get_last_value()) + ',l_9,' + str(self._l_9.get_last_value()) + \
-                ',l_10,' + str(self._l_10.get_last_value()) + ',l_11,' + str(self._l_11.get_last_value()) + \
-                ',l_12,' + str(self._l_12.get_last_value()) + ',l_13,' + str(self._l_13.get_last_value()) + \
-                ',l_14,' + str(self._l_14.get_last_value()) + ',l_15,' + str(self._l_15.get_last_value()) + \
-                ',l_16,' + str(self._l_16.get_last_value()) + ',l_17,' + str(self._l_17.get_last_value()) + \
-                ',l_18,' + str(self._l_18.get_last_value()) + ',l_19,' + str(self._l_19.get_last_value()) + \
-                ',l_20,' + str(self._l_20.get_last_value()) + ',l_21,' + str(self._l_21.get_last_value()) + \
-                ',l_22,' + str(self._l_22.get_last_value()) + ',l_23,' + str(self._l_23.get_last_value()) + \
-                ',l_24,' + str(self._l_24.get_last_value()) + ',l_25,' + str(self._l_25.get_last_value()) + \
-                ',l_26,' + str(self._l_26.get_last_value()) + ',l_27,' + str(self._l_27.get_last_value()) + \
-                ',l_28,' + str(self._l_28.get_last_value()) + ',l_29,' + str(self._l_29.get_last_value()) + \
-                ',l_30,' + str(self._l_30.get_last_value()) + ',l_31,' + str(self._l_31.get_last_value()) + '\n' + \
-                'IPMI:' +  'x_t_ipmi,' + str(meas_t_ipmi) + \
-                ',s_t_ipmi,' + str(self._s_t_ipmi.get_start_time()) + ',x_i,' + str(self._x_i.get_last_value()) + \
-                ',x_o,' + str(self._x_0.get_last_value()) + ',x_s0,' + str(self._x_s0.get_last_value()) + \
-                ',x_s1,' + str(self._x_s1.get_last_value()) + ',x_d0,' + str(self._x_d0.get_last_value()) + \
-                ',x_d1,' + str(self._x_d1.get_last_value()) + ',u_1,' + str(self._u_1.get_last_value()) + \
-                ',u_2,' + str(self._u_2.get_last_value()) + ',u_3,' + str(self._u_3.get_last_value()) + \
-                ',u_4,' + str(self._u_4.get_last_value()) + ',u_5,' + str(self._u_5.get_last_value()) + \
-                ',u_6,' + str(self._u_6.get_last_value()) + ',l_c,' + str(self._l_c.get_last_value()) + \
-                ',l_io,' + str(self._l_io.get_last_value()) + ',l_m,' + str(self._l_m.get_last_value()) + \
-                ',l_s,' + str(self._l_s.get_last_value()) + ',c_1,' + str(self._c_1.get_last_value()) + \
-                ',c_2,' + str(self._c_2.get_last_value()) + ',v_1,' + str(self._v_1.get_last_value()) + \
-                ',v_2,' + str(self._v_2.get_last_value()) + ',p_c,' + str(self._p_c.get_last_value()) + '\n'
-
-            conn.send(msg)
+                ''.join(lines[:-1]) + \
+                'IPMI:' + 'x_t_ipmi,' + str(meas_t_ipmi) + ',s_t_ipmi,' + str(self._s_t_ipmi.get_start_time()) + \
+                lines[-1]
+
+            # only queued, the viewers are served by the relay thread
+            self._relay.publish(msg)
+            self._phases.lap('relay_send', phase_start)
+
+
+class fleet_job(object):
+    def __init__(self, srv, source, cmds):
+        self.server = srv
+        self.source = source
+        self.cmds = cmds
+        self.outputs = [None]*len(cmds)
+        self.meas_t = None
+        self.deadline = None
+        self.nr_running = 0
+
+
+class fleet_collector(object):
+    def __init__(self, servers, _use_ipmi, _use_snmp, max_inflight, query_budget=_QUERY_BUDGET):
+        assert len(servers) > 0
+        assert isinstance(max_inflight, int)
+        assert max_inflight > 0
+        assert 0 < query_budget <= 1
+        self._servers = servers
+        self._use_ipmi = _use_ipmi
+        self._use_snmp = _use_snmp
+        self._max_inflight = max_inflight
+        self._query_budget = query_budget
+        self._query_time = None
+
+        self._poller = select.poll()
+        self._running = {}                      # fd -> (job, idx, proc, chunks)
+        self._pending = collections.deque()     # jobs waiting for a free slot
+        self._busy = set()                      # (server, source) not yet parsed
+        self._nr_samples = 0
+        self._nr_skipped = 0
+        self._nr_failed = 0
+        self._nr_late = 0
+        try:
+            from subprocess import DEVNULL # py3k
+        except ImportError:
+            DEVNULL = open(os.devnull, 'wb')
+        self._devnull = DEVNULL
+
+    def _queue_tick(self):
+        for srv in self._servers:
+            for source, use in (('ipmi', self._use_ipmi), ('snmp', self._use_snmp)):
+                if not use:
+                    continue
+                if (srv, source) in self._busy:
+                    # the previous sample of this source did not complete yet
+                    self._nr_skipped += 1
+                    continue
+                if source == 'ipmi':
+                    cmds = [srv._ipmi_command()]
+                else:
+                    cmds = srv._snmp_commands()
+                self._busy.add((srv, source))
+                self._pending.append(fleet_job(srv, source, cmds))
+
+    def _start_jobs(self):
+        while self._pending:
+            job = self._pending[0]
+            if self._running and len(self._running) + len(job.cmds) > self._max_inflight:
+                break
+            self._pending.popleft()
+
+            cur_time = time.time()
+            if job.source == 'ipmi':
+                job.meas_t = _stamp(job.server._s_t_ipmi, cur_time)
+            else:
+                job.meas_t = _stamp(job.server._s_t_snmp, cur_time)
+            # the time in the queue does not count
+            job.deadline = cur_time + self._query_time
+            for idx, cmd in enumerate(job.cmds):
+                p = subprocess.Popen(shlex.split(cmd), shell=False, stdout=subprocess.PIPE, stderr=self._devnull)
+                fd = p.stdout.fileno()
+                self._running[fd] = (job, idx, p, [])
+                self._poller.register(fd, select.POLLIN | select.POLLHUP)
+                job.nr_running += 1
+
+    def _read(self, fd):
+        job, idx, p, chunks = self._running[fd]
+        data = os.read(fd, _FLEET_READ_SIZE)
+        if data:
+            chunks.append(data)
+            return
+
+        # end of output, the query is done
+        self._poller.unregister(fd)
+        del self._running[fd]
+        p.stdout.close()
+        p.wait()
+        job.outputs[idx] = ''.join(chunks)
+        job.nr_running -= 1
+        if job.nr_running == 0:
+            self._complete(job)
+
+    def _expire_jobs(self, cur_time):
+        #
+        # kill the queries still running at the deadline of their job, the
+        # job completes with the outputs it has. Returns the next deadline
+        #
+        next_deadline = None
+        for fd, (job, idx, p, chunks) in self._running.items():
+            if job.deadline > cur_time:
+                if next_deadline is None or job.deadline < next_deadline:
+                    next_deadline = job.deadline
+                continue
+            self._poller.unregister(fd)
+            del self._running[fd]
+            try:
+                p.kill()
+            except OSError:
+                pass
+            p.stdout.close()
+            p.wait()
+            job.nr_running -= 1
+            if job.nr_running == 0:
+                self._nr_late += 1
+                self._complete(job)
+        return next_deadline
+
+    def _complete(self, job):
+        self._busy.discard((job.server, job.source))
+        try:
+            if job.source == 'ipmi':
+                if job.outputs[0] is None:
+                    job.server._store_missing('ipmi', job.meas_t, _QUERY_LATE)
+                    return
+                job.server.parse_ipmi(job.meas_t, job.outputs[0])
+            else:
+                job.server.parse_snmp(job.meas_t, None, job.outputs)
+                if all(out is None for out in job.outputs):
+                    return
+            self._nr_samples += 1
+        except Exception as e:
+            # a host that answers garbage must not stop the rest of the fleet
+            self._nr_failed += 1
+            print " ! %s: cannot parse the %s sample: %s" % (job.server._target.name, job.source, repr(e))
+
+    def _kill_running(self):
+        for fd, (job, idx, p, chunks) in self._running.items():
+            self._poller.unregister(fd)
+            try:
+                p.kill()
+            except OSError:
+                pass
+            p.stdout.close()
+            p.wait()
+        self._running = {}
+        self._pending.clear()
+        self._busy.clear()
+
+    def get_throughput(self, elapsed):
+        if elapsed <= 0:
+            return 0.
+        return self._nr_samples/elapsed
+
+    def collect(self, sampling_period, timelength):
+        assert isinstance(sampling_period, (int,float))
+        assert sampling_period >= 1/_MAX_SAMPLING_PERIOD
+        assert timelength > 0
+        assert isinstance(timelength, (int,float))
+
+        endtest_time = timelength * 3600
+        print "Polling %d hosts, endtest time %d [sec]" % (len(self._servers), endtest_time)
+
+        #
+        # a single loop multiplexes the outputs of all the running queries,
+        # the cost of a host is its parsed traces and not a process or thread
+        #
+        zero_time = time.time()
+        next_tick = zero_time
+        next_report = zero_time + _FLEET_REPORT_PERIOD
+        self._query_time = self._query_budget*sampling_period
+        while True:
+            cur_time = time.time()
+            if cur_time - zero_time >= endtest_time:
+                print "Reached end of test: %.2f / %.2f [sec]" % (cur_time - zero_time, endtest_time)
+                break
+
+            if cur_time >= next_tick:
+                for srv in self._servers:
+                    if srv._recorder is not None:
+                        srv._recorder.tick()
+                    if srv._column_store is not None:
+                        srv._column_store.tick()
+                self._queue_tick()
+                next_tick = next_tick + sampling_period
+                if next_tick <= cur_time:
+                    # do not try to catch up on missed ticks
+                    next_tick = cur_time + sampling_period
+
+            if cur_time >= next_report:
+                print "fleet: %.1f samples/s, %d skipped, %d late, %d failed, %d running" % \
+                    (self.get_throughput(cur_time - zero_time), self._nr_skipped, self._nr_late, self._nr_failed,
+                     len(self._running))
+                next_report = next_report + _FLEET_REPORT_PERIOD
+
+            self._start_jobs()
+
+            wake = min(next_tick, zero_time + endtest_time)
+            next_deadline = self._expire_jobs(time.time())
+            if next_deadline is not None:
+                wake = min(wake, next_deadline)
+            timeout = max(0., wake - time.time())
+            for fd, event in self._poller.poll(timeout*1000.):
+                self._read(fd)
+
+        self._kill_running()
+        elapsed = time.time() - zero_time
+        print "fleet: %d samples in %.1f [sec], %.1f samples/s, %d skipped, %d late, %d failed" % \
+            (self._nr_samples, elapsed, self.get_throughput(elapsed), self._nr_skipped, self._nr_late, self._nr_failed)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-r","--relay", default=False, action='store_true', help="Stream the data continuously to connected client")
+    parser.add_argument("--relay-port", dest="relay_port", default=_TCP_PORT, help="TCP port of the relay (default %d)" % _TCP_PORT)
+    parser.add_argument("--relay-format", dest="relay_format", default='text', choices=_RELAY_FORMATS, help="Text lines, float32 frames or frames of the changed values only, see relay_protocol.py (default text)")
     parser.add_argument("-t","--timelength", dest="timelength", default=1, help="The runtime of the script (default 1h)")
     parser.add_argument("-i","--ipmi", dest='use_ipmi', default=False, action='store_true', help="Use IPMI")
     parser.add_argument("-s","--snmp", dest='use_snmp', default=False, action='store_true', help="Use SNMP")
     parser.add_argument("-fb","--facebook", default=False, action='store_true', help="Collect from Facebook server insted of Dell")
+    parser.add_argument("-c","--concurrent", default=False, action='store_true', help="Run the IPMI and SNMP queries of each sample in parallel")
+    parser.add_argument("-n","--native-snmp", dest='native_snmp', default=False, action='store_true', help="Query SNMP in-process instead of running snmpwalk")
+    parser.add_argument("-k","--ipmi-session", dest='ipmi_session', default=False, action='store_true', help="Keep one ipmitool session open instead of a new one per sample")
+    parser.add_argument("--snmp-host", dest="snmp_host", default=None, help="SNMP agent as host[:port] (default the lab server)")
+    parser.add_argument("-f","--inventory", dest="inventory", default=None, help="Poll all the hosts listed in this file from one process")
+    parser.add_argument("-j","--max-inflight", dest="max_inflight", default=64, help="Max. nr. of queries running at once in fleet mode (default 64)")
+    parser.add_argument("-w","--query-wrapper", dest="query_wrapper", default=None, help="Command prepended to every query (e.g. a fake BMC)")
     parser.add_argument("-T","--preiod", dest="period", default=1, help="The sampling period in seconds (default 1s)")
     parser.add_argument("-o","--outfile", dest="outfile", default=None, help="Path to the output file (numpy .npz format)")
     parser.add_argument("-m","--outfile-matlab", dest="outfile_mat", default=None, help="Path to the output file (matlab .mat format)")
+    parser.add_argument("-S","--save-period", dest="save_period", default=None, help="Also save the matlab file every SEC seconds while collecting, only the new samples are appended")
+    parser.add_argument("--query-budget", dest="query_budget", default=_QUERY_BUDGET, help="Share of the period the queries of a sample may take, the ones still running then are killed and their sensors are missing from the sample (default %.1f)" % _QUERY_BUDGET)
+    parser.add_argument("--overrun", dest="overrun", default='skip', choices=('skip', 'catch-up', 'stretch'), help="What to do when a sample takes longer than the period (default skip)")
+    parser.add_argument("-g","--group", dest="groups", default=[], action='append', help="Sample the traces matching the patterns with their own period, as NAME=PERIOD:PATTERN[,PATTERN...] (e.g. slow=10:x_d*,x_i)")
+    parser.add_argument("-R","--record", dest="record", default=None, help="Stream the samples to PREFIX.NNNN.seg while collecting")
+    parser.add_argument("--codec", dest="codec", default=None, choices=trace_codec.compressors(), help="Record the samples as scaled integers and differenced times, compressed with this, see trace_codec.py")
+    parser.add_argument("-D","--run-dir", dest="run_dir", default=None, help="Write the samples to a directory of .npy columns while collecting, see column_store.py")
+    parser.add_argument("--grid", dest="grid", default=None, help="Also save the traces resampled onto a uniform grid of GRID seconds, as the matrix grid with a column per name of grid_names, see trace_grid.py")
+    parser.add_argument("--grid-method", dest="grid_method", default='zoh', choices=trace_grid.METHODS, help="Value at a grid time: the last sample, linear between the samples around it or the nearest sample (default zoh)")
+    parser.add_argument("--max-gap", dest="max_gap", default=None, help="A grid time further than SEC from the sample it uses is NaN")
+    parser.add_argument("--loads", dest="loads", default=None, help="Add the socket loads of this server-stress.py .mat file to the grid")
+    parser.add_argument("--rollup", dest="rollup", default=None, help="Also sum up the samples in buckets of these periods [sec] (e.g. 10,60,900), asked with the rollup query of the relay. Without -o or -m the samples are then not kept in memory, see trace_rollup.py")
+    parser.add_argument("--capture", dest="capture", default=None, help="Save the raw output of every query to FILE, see query_capture.py")
+    parser.add_argument("--replay", dest="replay", default=None, help="Parse the queries of a capture instead of querying the BMC, the server kind and the period are the captured ones")
+    parser.add_argument("--replay-speed", dest="replay_speed", default=1, help="Pace of the replay relative to the capture, 0 for as fast as possible (default 1)")
     
     args = parser.parse_args()
 
@@ -918,36 +2057,243 @@ if __name__ == "__main__":
         print "The timelength \"%s\" is not a numeric type" % args.timelength
         sys.exit(1)
 
+    try:
+        query_budget = float(args.query_budget)
+    except:
+        print "The query budget \"%s\" is not a numeric type" % args.query_budget
+        sys.exit(1)
+    if not 0 < query_budget <= 1:
+        print "The query budget must be in (0, 1]"
+        sys.exit(1)
+
+    save_period = None
+    if args.save_period is not None:
+        try:
+            save_period = float(args.save_period)
+        except:
+            print "The save period \"%s\" is not a numeric type" % args.save_period
+            sys.exit(1)
+        if args.outfile_mat is None or save_period <= 0:
+            print "A positive --save-period needs a matlab output file (-m)"
+            sys.exit(1)
+
+    codec = None
+    if args.codec is not None:
+        if args.record is None:
+            print "A --codec needs a recording (-R)"
+            sys.exit(1)
+        codec = trace_codec.trace_codec(args.codec)
+
+    rollup_periods = None
+    if args.rollup is not None:
+        try:
+            rollup_periods = [float(p) for p in args.rollup.split(',')]
+        except:
+            print "The rollup periods \"%s\" are not numeric" % args.rollup
+            sys.exit(1)
+        if min(rollup_periods) <= 0:
+            print "The rollup periods must be positive"
+            sys.exit(1)
+
+    grid_period = None
+    max_gap = None
+    loads = None
+    if args.grid is not None:
+        try:
+            grid_period = float(args.grid)
+            if args.max_gap is not None:
+                max_gap = float(args.max_gap)
+        except:
+            print "The grid period \"%s\" and the max. gap \"%s\" must be numeric" % (args.grid, args.max_gap)
+            sys.exit(1)
+        if grid_period <= 0 or (max_gap is not None and max_gap <= 0):
+            print "The grid period and the max. gap must be positive"
+            sys.exit(1)
+        if args.outfile is None and args.outfile_mat is None:
+            print "A --grid needs an output file (-o or -m)"
+            sys.exit(1)
+        if args.loads is not None:
+            try:
+                loads = trace_grid.read_stress_loads(args.loads)
+            except (IOError, KeyError) as e:
+                print "Cannot read the loads of %s: %s" % (args.loads, e)
+                sys.exit(1)
+    elif args.max_gap is not None or args.loads is not None:
+        print "A --max-gap or --loads needs a --grid"
+        sys.exit(1)
+
+    groups = []
+    for spec in args.groups:
+        try:
+            groups.append(parse_group(spec))
+        except ValueError as e:
+            print "Bad sensor group: %s" % e
+            sys.exit(1)
+
     if args.facebook:
         server_choice = _COLLECT_FB
     else:
         server_choice = _COLLECT_DELL
+    use_ipmi = args.use_ipmi
+    use_snmp = args.use_snmp
+    use_ipmi_session = args.ipmi_session
+
+    if args.replay is not None:
+        try:
+            replay_speed = float(args.replay_speed)
+        except:
+            print "The replay speed \"%s\" is not a numeric type" % args.replay_speed
+            sys.exit(1)
+        if replay_speed < 0 or args.inventory is not None or args.capture is not None or save_period is not None:
+            print "A --replay needs a speed >= 0 and cannot be combined with -f, --capture or -S"
+            sys.exit(1)
+        # the queries are parsed as they were captured
+        meta = query_capture.read_meta(args.replay)
+        server_choice = _SERVER_KINDS[meta['server']]
+        use_ipmi = meta['use_ipmi']
+        use_snmp = meta['use_snmp']
+        use_ipmi_session = meta['ipmi_session']
+        period = meta['period']
+        timelength = meta['timelength']
+
+    if args.inventory is not None:
+        try:
+            max_inflight = int(args.max_inflight)
+        except:
+            print "The nr. of queries \"%s\" is not an integer" % args.max_inflight
+            sys.exit(1)
+        if args.relay:
+            print "Relaying is not supported when polling an inventory"
+            sys.exit(1)
+        if groups:
+            print "Sensor groups are not supported when polling an inventory"
+            sys.exit(1)
+        if save_period is not None:
+            print "Periodic saves are not supported when polling an inventory"
+            sys.exit(1)
+        if args.capture is not None:
+            print "Captures are not supported when polling an inventory"
+            sys.exit(1)
+        if loads is not None:
+            print "The loads of one server cannot be added to the grids of an inventory"
+            sys.exit(1)
+        if rollup_periods is not None:
+            print "Rollups are not supported when polling an inventory"
+            sys.exit(1)
+
+        servers = []
+        recorders = []
+        stores = []
+        keep = args.outfile is not None or args.outfile_mat is not None
+        for target in read_inventory(args.inventory, args.query_wrapper):
+            servers.append(server(args.use_ipmi, args.use_snmp, target.server_choice, None, target=target))
+            if grid_period is not None:
+                servers[-1].set_grid(grid_period, args.grid_method, max_gap)
+            if args.record is not None:
+                recorders.append(trace_recorder.trace_recorder(args.record + '-' + target.name, codec=codec))
+                recorders[-1].meta({'period': period, 'timelength': timelength})
+                servers[-1].set_recorder(recorders[-1], keep)
+            if args.run_dir is not None:
+                # a run directory per host
+                stores.append(column_store.column_store(os.path.join(args.run_dir, target.name)))
+                stores[-1].meta({'period': period, 'timelength': timelength})
+                servers[-1].set_column_store(stores[-1], keep)
+        fleet = fleet_collector(servers, args.use_ipmi, args.use_snmp, max_inflight, query_budget)
+        try:
+            fleet.collect(period, timelength)
+        finally:
+            for recorder in recorders:
+                recorder.close()
+            for store in stores:
+                store.close()
 
-    conn=None
+        # one output file per host
+        for srv in servers:
+            if args.outfile is not None:
+                srv.save_numpy(re.sub('[.]npz$', '', args.outfile) + '-' + srv._target.name)
+            if args.outfile_mat is not None:
+                if args.use_ipmi or args.use_snmp:
+                    srv.save_matlab(re.sub('[.]mat$', '', args.outfile_mat) + '-' + srv._target.name, period, timelength)
+        sys.exit(0)
+
+    relay = None
     if args.relay:
-        #server_address = './server_monitor_socket'
-        #try:
-        #    os.unlink(server_address)
-        #except OSError:
-        #    if os.path.exists(server_address):
-        #        raise
-        #s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        #s.bind(server_address)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.bind(_TCP_IP, _TCP_PORT)
-        s.listen(1)
-        print "Waiting for a client to connect ..."
-        conn, addr = s.accept()
-        print "... got a connection: " + addr[0] + ':' + addr[1]
-
-    server = server(args.use_ipmi, args.use_snmp, server_choice, conn)
-    server.collect(period, timelength)
+        #
+        # viewers can connect and leave at any time, the sampling does not
+        # wait for them
+        #
+        relay = relay_server.relay_server(_TCP_IP, int(args.relay_port))
+        relay.start()
+        print "Relaying to the clients of %s:%d" % (_TCP_IP, relay.get_port())
+
+    target = bmc_target('default', server_choice, args.query_wrapper)
+    if args.snmp_host is not None:
+        target.snmp_host = args.snmp_host
+    server = server(use_ipmi, use_snmp, server_choice, relay, args.concurrent, target, args.native_snmp,
+                    use_ipmi_session, args.overrun, groups, args.relay_format, query_budget)
+    capture = None
+    if args.capture is not None:
+        meta = server.get_capture_meta()
+        meta.update({'period': period, 'timelength': timelength})
+        capture = query_capture.query_capture(args.capture, meta)
+        server.set_capture(capture)
+    if use_snmp:
+        server.discover_snmp(args.replay)
+        for mib in server._sized_mibs:
+            print "%s: %d sensors" % (mib, server._walk_sizes.get(mib, 0))
+    for group in server.get_groups():
+        if group is not server._default_group and not group.traces:
+            print "The sensor group %s matches no trace" % group.name
+            sys.exit(1)
+    recorder = None
+    if args.record is not None:
+        recorder = trace_recorder.trace_recorder(args.record, codec=codec)
+        recorder.meta({'period': period, 'timelength': timelength})
+        # the samples are only kept in memory for the output files
+        server.set_recorder(recorder, args.outfile is not None or args.outfile_mat is not None)
+    store = None
+    if args.run_dir is not None:
+        store = column_store.column_store(args.run_dir)
+        store.meta({'period': period, 'timelength': timelength})
+        server.set_column_store(store, args.outfile is not None or args.outfile_mat is not None)
+    if save_period is not None:
+        server.set_periodic_save(args.outfile_mat, save_period)
+    if grid_period is not None:
+        server.set_grid(grid_period, args.grid_method, max_gap, loads)
+    if rollup_periods is not None:
+        server.set_rollups(args.outfile is not None or args.outfile_mat is not None, periods=rollup_periods)
+    try:
+        if args.replay is not None:
+            start = time.time()
+            nr_ticks = server.replay(args.replay, period, replay_speed)
+            print "Replayed %d ticks in %.2f [sec]" % (nr_ticks, time.time() - start)
+        else:
+            server.collect(period, timelength)
+    finally:
+        # a Ctrl-C leaves a complete recording behind
+        if capture is not None:
+            capture.close()
+        if recorder is not None:
+            recorder.meta(dict((k, numpy.asarray(v).tolist()) for k, v in server._get_run_variables().items()))
+            recorder.close()
+        if store is not None:
+            store.meta(dict((k, numpy.asarray(v).tolist()) for k, v in server._get_run_variables().items()))
+            store.close()
+    server.print_ipmi_session_stats()
+    server.print_query_stats()
+    server.print_schedule_stats()
+    server.print_phase_stats()
+    if relay is not None:
+        stats = relay.get_stats()
+        print "relay: %d samples to %d clients, %d messages dropped for slow clients" % \
+            (stats['published'], stats['connected'], stats['dropped'])
+        relay.close()
 
     if args.outfile is not None:
         server.save_numpy(args.outfile)
             
     if args.outfile_mat is not None:
-        if args.use_ipmi or args.use_snmp:
-            server.save_matlab(args.outfile_mat, period, timelength)
+        if use_ipmi or use_snmp:
+            server.save_matlab(args.outfile_mat, period, timelength, save_period is not None)
     
     sys.exit(0)
@@ -26,11 +26,10 @@ import time
 import argparse
 import subprocess
 import numpy
-import scipy
-import scipy.io
 import multiprocessing
 import shlex
 import psutil
+import mat_writer
 
 
 class hw_platform(object):
@@ -277,24 +276,23 @@ def stress_cpus(timelength, period):
 
 			
 def save_matlab(socket_loads, zero_time, timelength, period, path):
-	mdict = {}
+	#
+	# streamed to the file one variable at a time, the signals of the
+	# sockets are never all copied at once
+	#
+	if not path.endswith(".mat"):
+		path = path + ".mat"
+	writer = mat_writer.mat_writer(path)
 	# save nr of sockets
-	mdict['nr_sockets'] = len(socket_loads)
-	mdict['s_t'] = zero_time
-	mdict['timelength'] = timelength
-	mdict['period'] = period
+	writer.write('nr_sockets', len(socket_loads))
+	writer.write('s_t', zero_time)
+	writer.write('timelength', timelength)
+	writer.write('period', period)
 	for load in socket_loads:
 		name = load.get_name()
-		time_var = name + '_time'
-		mdict[time_var] = load.get_time()
-
-		value_var = name + '_values'
-		mdict[value_var] = load.get_values()
-
-		sockid = load.get_socket_id()
-	
-	#print mdict
-	scipy.io.savemat(path, mdict)
+		writer.write(name + '_time', load.get_time())
+		writer.write(name + '_values', load.get_values())
+	writer.close()
 
 
 if __name__ == "__main__":
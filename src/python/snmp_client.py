@@ -0,0 +1,504 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# A minimal SNMPv2c client that keeps one UDP socket open and decodes the BER
+# responses straight into floats, plus a stand-in agent to run it against
+# without hardware. Only what server-fetch.py needs is implemented: GET and
+# GETBULK requests with numeric OIDs and integer/gauge/string values.
+#
+
+import sys
+import time
+import random
+import socket
+import select
+import argparse
+import threading
+
+_SNMP_VERSION_2C = 1
+_SNMP_PORT = 161
+_MAX_DATAGRAM = 65507
+_BULK_REPETITIONS = 32
+
+# ASN.1/BER tags
+_INTEGER = 0x02
+_OCTET_STRING = 0x04
+_NULL = 0x05
+_OID = 0x06
+_SEQUENCE = 0x30
+_COUNTER32 = 0x41
+_GAUGE32 = 0x42
+_TIMETICKS = 0x43
+_COUNTER64 = 0x46
+_NO_SUCH_OBJECT = 0x80
+_NO_SUCH_INSTANCE = 0x81
+_END_OF_MIB_VIEW = 0x82
+
+# PDU tags
+_GET_REQUEST = 0xa0
+_GET_NEXT_REQUEST = 0xa1
+_GET_RESPONSE = 0xa2
+_GET_BULK_REQUEST = 0xa5
+
+_UNSIGNED_TAGS = (_COUNTER32, _GAUGE32, _TIMETICKS, _COUNTER64)
+_MISSING_TAGS = (_NULL, _NO_SUCH_OBJECT, _NO_SUCH_INSTANCE, _END_OF_MIB_VIEW)
+
+#
+# numeric OIDs of the MIB objects walked by server-fetch.py, the client does
+# not load any MIB
+#
+MIB_OIDS = {
+    'IDRAC-MIB-SMIv2::temperatureProbeReading': '1.3.6.1.4.1.674.10892.5.4.700.20.1.6',
+    'IDRAC-MIB-SMIv2::coolingDeviceReading': '1.3.6.1.4.1.674.10892.5.4.700.12.1.6',
+    'LM-SENSORS-MIB::lmTempSensorsValue': '1.3.6.1.4.1.2021.13.16.2.1.3',
+    'HOST-RESOURCES-MIB::hrProcessorLoad': '1.3.6.1.2.1.25.3.3.1.2',
+}
+
+
+class snmp_error(Exception):
+    pass
+
+
+class snmp_timeout(snmp_error):
+    pass
+
+
+def parse_oid(oid):
+    if isinstance(oid, tuple):
+        return oid
+    return tuple(int(x) for x in oid.strip('.').split('.'))
+
+
+def format_oid(oid):
+    return '.'.join(str(x) for x in oid)
+
+
+#
+# BER encoding
+#
+def _encode_length(n):
+    if n < 0x80:
+        return bytearray([n])
+    out = bytearray()
+    while n:
+        out.insert(0, n & 0xff)
+        n >>= 8
+    out.insert(0, 0x80 | len(out))
+    return out
+
+def _encode_tlv(tag, payload):
+    return bytearray([tag]) + _encode_length(len(payload)) + payload
+
+def _encode_integer(value, tag=_INTEGER):
+    out = bytearray()
+    while True:
+        out.insert(0, value & 0xff)
+        value >>= 8
+        if (value == 0 and not out[0] & 0x80) or (value == -1 and out[0] & 0x80):
+            break
+    return _encode_tlv(tag, out)
+
+def _encode_oid(oid):
+    oid = parse_oid(oid)
+    assert len(oid) >= 2
+    out = bytearray([40*oid[0] + oid[1]])
+    for arc in oid[2:]:
+        chunk = bytearray([arc & 0x7f])
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        out += chunk
+    return _encode_tlv(_OID, out)
+
+def _encode_value(value):
+    if value is None:
+        return _encode_tlv(_NULL, bytearray())
+    if isinstance(value, tuple):
+        # an exception value such as (_NO_SUCH_INSTANCE,)
+        return _encode_tlv(value[0], bytearray())
+    if isinstance(value, (int, long)):
+        if value >= 0:
+            return _encode_integer(value, _GAUGE32)
+        return _encode_integer(value)
+    return _encode_tlv(_OCTET_STRING, bytearray(str(value)))
+
+def _encode_varbinds(varbinds):
+    vbs = bytearray()
+    for oid, value in varbinds:
+        vbs += _encode_tlv(_SEQUENCE, _encode_oid(oid) + _encode_value(value))
+    return vbs
+
+def _encode_message(community, pdu_tag, request_id, field1, field2, vbs):
+    # vbs are the varbinds encoded by _encode_varbinds
+    pdu = _encode_integer(request_id) + _encode_integer(field1) + _encode_integer(field2) + \
+          _encode_tlv(_SEQUENCE, vbs)
+    msg = _encode_integer(_SNMP_VERSION_2C) + _encode_tlv(_OCTET_STRING, bytearray(community)) + \
+          _encode_tlv(pdu_tag, pdu)
+    return bytes(_encode_tlv(_SEQUENCE, msg))
+
+
+#
+# BER decoding, buf is a bytearray and pos the offset of a TLV
+#
+def _decode_header(buf, pos):
+    tag = buf[pos]
+    n = buf[pos + 1]
+    pos += 2
+    if n & 0x80:
+        nr_bytes = n & 0x7f
+        n = 0
+        for i in range(nr_bytes):
+            n = (n << 8) | buf[pos + i]
+        pos += nr_bytes
+    return tag, pos, pos + n
+
+def _decode_int(buf, start, end, signed):
+    value = 0
+    for i in range(start, end):
+        value = (value << 8) | buf[i]
+    if signed and end > start and buf[start] & 0x80:
+        value -= 1 << (8*(end - start))
+    return value
+
+def _decode_oid(buf, start, end):
+    first = buf[start]
+    oid = [first // 40, first % 40]
+    arc = 0
+    for i in range(start + 1, end):
+        b = buf[i]
+        arc = (arc << 7) | (b & 0x7f)
+        if not b & 0x80:
+            oid.append(arc)
+            arc = 0
+    return tuple(oid)
+
+def _decode_float(buf, tag, start, end):
+    if tag == _INTEGER:
+        return float(_decode_int(buf, start, end, True))
+    if tag in _UNSIGNED_TAGS:
+        return float(_decode_int(buf, start, end, False))
+    if tag == _OCTET_STRING:
+        try:
+            return float(bytes(buf[start:end]))
+        except ValueError:
+            return float('nan')
+    return float('nan')
+
+def _decode_message(data, want_oids=True):
+    #
+    # returns (pdu tag, community, request id, error status, error index,
+    # varbinds) where varbinds is a list of (oid, value tag, value as float),
+    # the answer to a GET is in request order so its OIDs can be skipped
+    #
+    buf = bytearray(data)
+    tag, pos, end = _decode_header(buf, 0)
+    if tag != _SEQUENCE:
+        raise snmp_error('not an SNMP message')
+    tag, start, pos = _decode_header(buf, pos)                # version
+    tag, start, pos = _decode_header(buf, pos)                # community
+    community = bytes(buf[start:pos])
+    pdu_tag, pos, end = _decode_header(buf, pos)
+    tag, start, pos = _decode_header(buf, pos)
+    request_id = _decode_int(buf, start, pos, True)
+    tag, start, pos = _decode_header(buf, pos)
+    field1 = _decode_int(buf, start, pos, True)
+    tag, start, pos = _decode_header(buf, pos)
+    field2 = _decode_int(buf, start, pos, True)
+    tag, pos, end = _decode_header(buf, pos)
+    varbinds = []
+    while pos < end:
+        tag, vb_start, vb_end = _decode_header(buf, pos)
+        tag, start, oid_end = _decode_header(buf, vb_start)
+        oid = None
+        if want_oids:
+            oid = _decode_oid(buf, start, oid_end)
+        tag, start, pos = _decode_header(buf, oid_end)
+        varbinds.append((oid, tag, _decode_float(buf, tag, start, pos)))
+        pos = vb_end
+    return pdu_tag, community, request_id, field1, field2, varbinds
+
+
+class snmp_session(object):
+    def __init__(self, host, community, port=_SNMP_PORT, timeout=1., retries=1):
+        assert isinstance(community, str)
+        assert timeout > 0
+        assert retries >= 0
+        self._community = community
+        self._timeout = timeout
+        self._retries = retries
+        self._request_id = random.randint(1, 1 << 30)
+        self._get_varbinds = {}
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect((host, int(port)))
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    def _next_request_id(self):
+        self._request_id = (self._request_id % 0x7fffffff) + 1
+        return self._request_id
+
+    def send_get(self, oids):
+        #
+        # send a single GET for the exact OID set, the answer is read with
+        # recv_values so that other queries can run in the meantime
+        #
+        request_id = self._next_request_id()
+        key = tuple(oids)
+        if key not in self._get_varbinds:
+            # there are few OID sets, each one is only encoded once
+            self._get_varbinds[key] = _encode_varbinds([(oid, None) for oid in oids])
+        self._send(_encode_message(self._community, _GET_REQUEST, request_id, 0, 0, self._get_varbinds[key]))
+        return request_id
+
+    def _send(self, msg):
+        try:
+            self._sock.send(msg)
+        except socket.error:
+            # e.g. the refusal of an earlier request, the answer is missed
+            pass
+
+    def _recv(self, request_id, timeout, want_oids=True):
+        # an answer that already arrived is read even when timeout is 0
+        deadline = time.time() + timeout
+        while True:
+            left = max(deadline - time.time(), 0.)
+            readable, w, x = select.select([self._sock], [], [], left)
+            if not readable:
+                return None
+            try:
+                data = self._sock.recv(_MAX_DATAGRAM)
+            except socket.error as e:
+                # nothing listens on the port of the agent
+                raise snmp_error(str(e))
+            try:
+                msg = _decode_message(data, want_oids)
+            except (snmp_error, IndexError):
+                continue
+            if msg[0] == _GET_RESPONSE and msg[2] == request_id:
+                return msg
+            # a late answer to an earlier request, drop it
+
+    def recv_values(self, request_id, oids, timeout=None):
+        if timeout is None:
+            timeout = self._timeout
+        msg = self._recv(request_id, timeout, False)
+        if msg is None:
+            raise snmp_timeout('timeout waiting for request %d' % request_id)
+        pdu_tag, community, request_id, status, index, varbinds = msg
+        if status != 0:
+            raise snmp_error('error status %d at varbind %d' % (status, index))
+        if len(varbinds) != len(oids):
+            raise snmp_error('asked for %d OIDs, got %d' % (len(oids), len(varbinds)))
+        return [value for oid, tag, value in varbinds]
+
+    def get(self, oids, deadline=None):
+        #
+        # with a deadline (time.time()) the attempts stop there, whatever
+        # their timeout
+        #
+        oids = [parse_oid(oid) for oid in oids]
+        for attempt in range(self._retries + 1):
+            request_id = self.send_get(oids)
+            timeout = self._timeout
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.time(), 0.))
+            try:
+                return self.recv_values(request_id, oids, timeout)
+            except snmp_error:
+                if attempt == self._retries or (deadline is not None and time.time() >= deadline):
+                    raise
+
+    def walk(self, root):
+        #
+        # retrieve the subtree below root with GETBULK requests, returns the
+        # list of (oid, value)
+        #
+        root = parse_oid(root)
+        result = []
+        last = root
+        while True:
+            for attempt in range(self._retries + 1):
+                request_id = self._next_request_id()
+                self._send(_encode_message(self._community, _GET_BULK_REQUEST, request_id,
+                                           0, _BULK_REPETITIONS, _encode_varbinds([(last, None)])))
+                msg = self._recv(request_id, self._timeout)
+                if msg is not None:
+                    break
+            else:
+                raise snmp_error('timeout walking %s' % format_oid(root))
+
+            varbinds = msg[5]
+            if not varbinds:
+                return result
+            for oid, tag, value in varbinds:
+                if tag == _END_OF_MIB_VIEW or oid[:len(root)] != root:
+                    return result
+                result.append((oid, value))
+                last = oid
+
+
+def answer_request(data, agents):
+    #
+    # the response to a request or None when it is dropped. agents maps a
+    # community to what answers it: get(oid) returns the value or None and
+    # get_next(oid) the (oid, value) after it or None
+    #
+    pdu_tag, community, request_id, field1, field2, varbinds = _decode_message(data)
+    agent = agents.get(community)
+    if agent is None:
+        # v2c agents silently drop requests from other communities
+        return None
+
+    answer = []
+    if pdu_tag == _GET_REQUEST:
+        for oid, tag, value in varbinds:
+            value = agent.get(oid)
+            answer.append((oid, value if value is not None else (_NO_SUCH_INSTANCE,)))
+    elif pdu_tag in (_GET_NEXT_REQUEST, _GET_BULK_REQUEST):
+        repetitions = 1
+        if pdu_tag == _GET_BULK_REQUEST:
+            repetitions = max(1, field2)
+        for oid, tag, value in varbinds:
+            for i in range(repetitions):
+                entry = agent.get_next(oid)
+                if entry is None:
+                    answer.append((varbinds[-1][0], (_END_OF_MIB_VIEW,)))
+                    break
+                oid, value = entry
+                answer.append((oid, value))
+    else:
+        return None
+    return _encode_message(community, _GET_RESPONSE, request_id, 0, 0, _encode_varbinds(answer))
+
+
+class snmp_agent(object):
+    #
+    # A stand-in SNMPv2c agent answering GET, GETNEXT and GETBULK from a table
+    # of OID -> value (an integer or a string), used to test the client and
+    # server-fetch.py without hardware.
+    #
+    def __init__(self, community, port=0, host='127.0.0.1'):
+        assert isinstance(community, str)
+        self._community = community
+        self._values = {}
+        self._sorted = []
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._thread = None
+
+    def get_port(self):
+        return self._sock.getsockname()[1]
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def set(self, oid, value):
+        oid = parse_oid(oid)
+        with self._lock:
+            if oid not in self._values:
+                self._sorted = sorted(list(self._values.keys()) + [oid])
+            self._values[oid] = value
+
+    def get(self, oid):
+        return self._values.get(oid)
+
+    def get_next(self, oid):
+        # (oid, value) of the first OID after oid, None at the end of the table
+        for candidate in self._sorted:
+            if candidate > oid:
+                return candidate, self._values[candidate]
+        return None
+
+    def _answer(self, data):
+        with self._lock:
+            return answer_request(data, {self._community: self})
+
+    def handle(self):
+        # answer one pending request
+        data, addr = self._sock.recvfrom(_MAX_DATAGRAM)
+        try:
+            reply = self._answer(data)
+        except (snmp_error, IndexError):
+            return
+        if reply is not None:
+            self._sock.sendto(reply, addr)
+
+    def serve_forever(self):
+        while True:
+            self.handle()
+
+    def start(self):
+        assert self._thread is None
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+def fill_agent(agent, kind, nr_temps=18, nr_cpus=32):
+    #
+    # values shaped like the ones of our servers, see fake-bmc.py
+    #
+    if kind == 'dell':
+        temps = MIB_OIDS['IDRAC-MIB-SMIv2::temperatureProbeReading']
+        for i, value in enumerate([210, 300, 410, 390]):
+            agent.set('%s.1.%d' % (temps, i + 1), value + random.randint(-10, 10))
+        fans = MIB_OIDS['IDRAC-MIB-SMIv2::coolingDeviceReading']
+        for i in range(6):
+            agent.set('%s.1.%d' % (fans, i + 1), 120*random.randint(28, 34))
+    elif kind == 'fb':
+        temps = MIB_OIDS['LM-SENSORS-MIB::lmTempSensorsValue']
+        for i in range(nr_temps):
+            agent.set('%s.%d' % (temps, i + 1), 1000*random.randint(30, 60))
+        loads = MIB_OIDS['HOST-RESOURCES-MIB::hrProcessorLoad']
+        for i in range(nr_cpus):
+            agent.set('%s.%d' % (loads, 196608 + i), random.randint(0, 100))
+    else:
+        assert False, "unknown server kind %s" % kind
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k","--kind", dest="kind", default='fb', help="Serve the sensors of a 'dell' or 'fb' server (default fb)")
+    parser.add_argument("-p","--port", dest="port", default=16100, help="UDP port of the stand-in agent (default 16100)")
+    parser.add_argument("-c","--community", dest="community", default=None, help="Community string (default the one of the lab server)")
+    parser.add_argument("-T","--period", dest="period", default=1, help="How often the values change in seconds (default 1s)")
+    args = parser.parse_args()
+
+    community = args.community
+    if community is None:
+        community = {'dell': 'public', 'fb': 'LTU'}[args.kind]
+
+    agent = snmp_agent(community, int(args.port))
+    fill_agent(agent, args.kind)
+    agent.start()
+    print "Stand-in %s agent on udp port %d, community %s" % (args.kind, agent.get_port(), community)
+    try:
+        while True:
+            time.sleep(float(args.period))
+            fill_agent(agent, args.kind)
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compact encoding of the samples of a trace. A block of samples is
+#
+#   header   _HEADER, see encode()
+#   body     the times then the values, compressed together
+#
+# The times are rounded to time_resolution and stored as integer ticks,
+# differenced time_order times: with a steady period the differences of the
+# differences are mostly 0. The values are stored as int8/int16 when they
+# are integers after a scale of _VALUE_SCALES, as the sensors give whole
+# degrees, tenths, RPM and percents, the missing ones (NaN) as the smallest
+# integer. Otherwise they stay float64. Both are stored in the narrowest
+# integer type holding them, then the block is compressed. The values are
+# lossless, the times exact to time_resolution.
+#
+# A block says how it was encoded, decode() needs no codec.
+#
+
+import zlib
+import bz2
+import struct
+import numpy
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+_TIME_RESOLUTION = 1e-6         # [sec]
+_VALUE_SCALES = (1., 10., 100., 1000.)
+_MAX_TIME_ORDER = 2
+
+# n, compressor, time order, time dtype, value dtype, time resolution, value scale, heads of the times
+_HEADER = struct.Struct('<IBBBBdd%dq' % _MAX_TIME_ORDER)
+
+# the ids are saved in the blocks, only append to these
+_INT_DTYPES = (numpy.dtype('<i1'), numpy.dtype('<i2'), numpy.dtype('<i4'), numpy.dtype('<i8'))
+_VALUE_DTYPES = _INT_DTYPES[:2] + (numpy.dtype('<f8'),)
+_COMPRESSOR_NAMES = ('none', 'zlib', 'zlib-fast', 'bz2', 'lz4')
+
+
+def _lz4_compress(data):
+    if lz4 is None:
+        raise IOError('the lz4 module is not installed')
+    return lz4.frame.compress(data)
+
+
+def _lz4_decompress(data):
+    if lz4 is None:
+        raise IOError('the lz4 module is not installed')
+    return lz4.frame.decompress(data)
+
+
+_COMPRESSORS = {
+    'none': (lambda data: data, lambda data: data),
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'zlib-fast': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lz4': (_lz4_compress, _lz4_decompress),
+}
+
+
+def compressors():
+    # the names of the compressors that can be used here
+    return [name for name in _COMPRESSOR_NAMES if name != 'lz4' or lz4 is not None]
+
+
+def _narrow(a):
+    # the id in _INT_DTYPES of the narrowest type holding the int64 array a
+    if not len(a):
+        return 0
+    lo = a.min()
+    hi = a.max()
+    for i, dtype in enumerate(_INT_DTYPES):
+        info = numpy.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return i
+    return len(_INT_DTYPES) - 1
+
+
+def _quantize(values):
+    #
+    # (id in _VALUE_DTYPES, scale, the values to store). The smallest scale
+    # of _VALUE_SCALES giving back the values exactly, the minimum of the
+    # type is kept for NaN
+    #
+    present = values == values
+    for scale in _VALUE_SCALES:
+        q = numpy.round(values[present]*scale)
+        if not numpy.array_equal(q/scale, values[present]):
+            continue
+        if len(q) and (q.min() < -0x7fff or q.max() > 0x7fff):
+            break
+        i = 0 if not len(q) or (q.min() >= -0x7f and q.max() <= 0x7f) else 1
+        stored = numpy.empty(len(values), dtype=_VALUE_DTYPES[i])
+        stored[:] = numpy.iinfo(_VALUE_DTYPES[i]).min
+        stored[present] = q
+        return i, scale, stored
+    return len(_VALUE_DTYPES) - 1, 1., numpy.asarray(values, dtype='<f8')
+
+
+class trace_codec(object):
+    def __init__(self, compressor='zlib', time_order=2, time_resolution=_TIME_RESOLUTION, quantize=True):
+        assert compressor in _COMPRESSOR_NAMES
+        assert 0 <= time_order <= _MAX_TIME_ORDER
+        assert time_resolution > 0
+        assert isinstance(quantize, bool)
+        self._compressor = compressor
+        self._compress = _COMPRESSORS[compressor][0]
+        self._time_order = time_order
+        self._time_resolution = time_resolution
+        self._quantize = quantize
+
+    def get_name(self):
+        return self._compressor
+
+    def encode(self, times, values):
+        times = numpy.asarray(times, dtype=numpy.float64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        assert len(times) == len(values)
+        n = len(times)
+
+        # the first value of each difference, then the remaining differences
+        ticks = numpy.round(times/self._time_resolution).astype(numpy.int64)
+        order = min(self._time_order, n)
+        heads = [0]*_MAX_TIME_ORDER
+        for k in range(order):
+            heads[k] = int(ticks[0])
+            ticks = numpy.diff(ticks)
+        time_dtype = _narrow(ticks)
+
+        if self._quantize:
+            value_dtype, scale, stored = _quantize(values)
+        else:
+            value_dtype, scale, stored = len(_VALUE_DTYPES) - 1, 1., values
+
+        header = _HEADER.pack(n, _COMPRESSOR_NAMES.index(self._compressor), order, time_dtype, value_dtype,
+                              self._time_resolution, scale, *heads)
+        body = ticks.astype(_INT_DTYPES[time_dtype]).tostring() + stored.tostring()
+        return header + self._compress(body)
+
+
+def decode(block):
+    # the (times, values) of an encoded block
+    fields = _HEADER.unpack_from(block)
+    n, compressor, order, time_dtype, value_dtype, resolution, scale = fields[:7]
+    heads = fields[7:]
+    if compressor >= len(_COMPRESSOR_NAMES) or time_dtype >= len(_INT_DTYPES) or value_dtype >= len(_VALUE_DTYPES):
+        raise IOError('unknown trace encoding')
+    body = _COMPRESSORS[_COMPRESSOR_NAMES[compressor]][1](block[_HEADER.size:])
+
+    time_dtype = _INT_DTYPES[time_dtype]
+    value_dtype = _VALUE_DTYPES[value_dtype]
+    if len(body) != (n - order)*time_dtype.itemsize + n*value_dtype.itemsize:
+        raise IOError('corrupt trace block')
+    ticks = numpy.frombuffer(body, dtype=time_dtype, count=n - order).astype(numpy.int64)
+    for k in reversed(range(order)):
+        ticks = numpy.concatenate(([heads[k]], heads[k] + numpy.cumsum(ticks)))
+    times = ticks*resolution
+
+    stored = numpy.frombuffer(body, dtype=value_dtype, offset=(n - order)*time_dtype.itemsize)
+    if value_dtype.kind == 'f':
+        return times, stored.copy()
+    values = stored/scale
+    values[stored == numpy.iinfo(value_dtype).min] = numpy.nan
+    return times, values
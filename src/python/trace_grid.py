@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# The traces of a run resampled onto a common uniform grid, a matrix with a
+# row per grid time and a column per trace, for the system identification.
+# The times are absolute here, the ipmi and snmp traces count from different
+# start times in the output files. Each trace is looked up with a single
+# searchsorted of the whole grid and resampled with array operations, its
+# column is contiguous: the matrix is in the column order of matlab and
+# mat_writer writes it without a copy. The methods are
+#
+#   zoh      the last sample at or before the grid time
+#   linear   between the two samples around the grid time
+#   nearest  the closest sample
+#
+# A grid time before the first sample of a trace or after its last one is NaN
+# whatever the method, so a source that stopped answering is not held to the
+# end of the grid. So is a grid time further than max_gap from the sample it
+# uses (for linear, between two samples further apart than max_gap). The
+# loads of a server-stress.py .mat file are held as the stress applied them,
+# from its start to its end.
+#
+# server-fetch.py --grid PERIOD writes the grid with the output files.
+#
+
+import numpy
+
+try:
+    import scipy.io
+except ImportError:
+    scipy = None
+
+METHODS = ('zoh', 'linear', 'nearest')
+
+
+def uniform_grid(start, end, period):
+    # the times start, start + period, ... up to end, without summing the periods
+    assert period > 0
+    if end < start:
+        return numpy.empty(0)
+    return start + period*numpy.arange(int(numpy.floor((end - start)/period + 1e-9)) + 1)
+
+
+def _resample_trace(times, values, grid, method, max_gap):
+    if not len(times):
+        out = numpy.empty(len(grid))
+        out.fill(numpy.nan)
+        return out
+    # the last sample at or before each grid time, -1 for none
+    idx = times.searchsorted(grid, 'right') - 1
+    prev = numpy.maximum(idx, 0)
+    if method == 'linear':
+        out = numpy.interp(grid, times, values, numpy.nan, numpy.nan)
+        if max_gap is not None and len(times) > 1:
+            exact = times[prev] == grid
+            prev = numpy.minimum(prev, len(times) - 2)
+            out[(times[prev + 1] - times[prev] > max_gap) & ~exact] = numpy.nan
+        return out
+    if method == 'nearest':
+        after = numpy.minimum(idx + 1, len(times) - 1)
+        closer = (idx < 0) | ((idx + 1 < len(times)) & (times[after] - grid < grid - times[prev]))
+        prev = numpy.where(closer, after, prev)
+    out = values[prev]
+    out[(idx < 0) | (grid > times[-1])] = numpy.nan
+    if max_gap is not None:
+        out[numpy.abs(grid - times[prev]) > max_gap] = numpy.nan
+    return out
+
+
+def resample(parts, grid, method='zoh', max_gap=None):
+    #
+    # parts is a list of (times, values) sorted in time, without missing
+    # samples, the grid a sorted array of times. Returns the len(grid) x
+    # len(parts) matrix of the values at the grid times
+    #
+    assert method in METHODS
+    assert max_gap is None or max_gap > 0
+    grid = numpy.asarray(grid, dtype=float)
+    columns = numpy.empty((len(parts), len(grid)))
+    for column, (times, values) in zip(columns, parts):
+        column[:] = _resample_trace(numpy.asarray(times, dtype=float), numpy.asarray(values, dtype=float),
+                                    grid, method, max_gap)
+    return columns.T
+
+
+def read_stress_loads(path):
+    #
+    # [(name, times, values, period)] of the sockets of a server-stress.py
+    # .mat file, the times are absolute
+    #
+    if scipy is None:
+        raise IOError('reading %s needs scipy' % path)
+    mat = scipy.io.loadmat(path)
+    zero_time = float(numpy.asarray(mat['s_t']).ravel()[0])
+    period = float(numpy.asarray(mat['period']).ravel()[0])
+    loads = []
+    for i in range(int(numpy.asarray(mat['nr_sockets']).ravel()[0])):
+        name = 'socket%02d' % i
+        loads.append((name, zero_time + numpy.asarray(mat[name + '_time'], dtype=float).ravel(),
+                      numpy.asarray(mat[name + '_values'], dtype=float).ravel(), period))
+    return loads
+
+
+def align_loads(loads, grid):
+    #
+    # the len(grid) x len(loads) matrix of the loads of read_stress_loads.
+    # server-stress.py applies the value of the last switch strictly before
+    # the time and the first one up to it, NaN before the stress started and
+    # after it ended
+    #
+    grid = numpy.asarray(grid, dtype=float)
+    columns = numpy.empty((len(loads), len(grid)))
+    columns.fill(numpy.nan)
+    for column, (name, times, values, period) in zip(columns, loads):
+        if not len(times):
+            continue
+        idx = numpy.maximum(times.searchsorted(grid) - 1, 0)
+        running = (grid >= times[0]) & (grid < times[-1] + period)
+        column[running] = values[idx[running]]
+    return columns.T
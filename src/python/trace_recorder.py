@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Append-only recording of the collected samples, so that a crash or a Ctrl-C
+# does not lose the run and the memory does not grow with its length.
+#
+# A recording is a series of segment files <prefix>.0000.seg, <prefix>.0001.seg,
+# ... Each segment is
+#
+#   header   _MAGIC
+#   chunks   <tag:4s><payload length:u32><crc32 of payload:u32><payload>
+#   footer   a FOOT chunk indexing the DATA chunks, then <footer offset:u64>_END
+#
+# DATA chunks hold fixed-size records <trace id:u16><time:f64><value:f64>,
+# META chunks a JSON dict (trace names, start times, ...). With a codec the
+# records are written as CDAT chunks instead, holding the samples of each
+# trace as <trace id:u16><length:u32><block of trace_codec.py>. The footer
+# is only written when a segment is closed, a segment without it (e.g. after
+# a crash) is read by scanning its chunks up to the first truncated or
+# corrupt one.
+#
+# Usage: trace_recorder.py PREFIX [-o out.npz] [-m out.mat] converts a
+# recording to the files written by server-fetch.py.
+#
+
+import os
+import sys
+import re
+import json
+import time
+import zlib
+import struct
+import argparse
+import numpy
+import mat_writer
+import trace_codec
+
+_MAGIC = 'OCSREC01'
+_END = 'OCSEND01'
+_CHUNK = struct.Struct('<4sII')
+_RECORD = struct.Struct('<Hdd')
+_TRAILER = struct.Struct('<Q8s')
+_INDEX_ENTRY = struct.Struct('<QIdd')
+_CODED_TRACE = struct.Struct('<HI')
+_RECORD_DTYPE = numpy.dtype([('id', '<u2'), ('t', '<f8'), ('v', '<f8')])
+
+_CHUNK_RECORDS = 4096           # records buffered before a chunk is written
+_CHUNK_PERIOD = 1.              # [sec] max. age of the buffered records
+_FSYNC_PERIOD = 10.             # [sec]
+_SEGMENT_SIZE = 256*1024*1024   # [bytes] a new segment is started above it
+# a codec needs many samples of each trace in a chunk to pay off
+_CODED_CHUNK_RECORDS = 65536
+_CODED_CHUNK_PERIOD = 60.       # [sec]
+
+
+def segment_path(prefix, nr):
+    return '%s.%04d.seg' % (prefix, nr)
+
+
+def _segment_paths(prefix):
+    directory, base = os.path.split(prefix)
+    pattern = re.compile(re.escape(base) + r'\.\d{4}\.seg$')
+    names = [n for n in os.listdir(directory or '.') if pattern.match(n)]
+    return [os.path.join(directory, n) for n in sorted(names)]
+
+
+def _crc(payload):
+    return zlib.crc32(payload) & 0xffffffff
+
+
+class trace_recorder(object):
+    def __init__(self, prefix, chunk_records=None, chunk_period=None,
+                 fsync_period=_FSYNC_PERIOD, segment_size=_SEGMENT_SIZE, codec=None):
+        if chunk_records is None:
+            chunk_records = _CHUNK_RECORDS if codec is None else _CODED_CHUNK_RECORDS
+        if chunk_period is None:
+            chunk_period = _CHUNK_PERIOD if codec is None else _CODED_CHUNK_PERIOD
+        assert isinstance(prefix, str)
+        assert chunk_records > 0
+        assert chunk_period > 0
+        assert fsync_period > 0
+        assert codec is None or isinstance(codec, trace_codec.trace_codec)
+        self._prefix = prefix
+        self._codec = codec
+        self._chunk_records = chunk_records
+        self._chunk_period = chunk_period
+        self._fsync_period = fsync_period
+        self._segment_size = segment_size
+
+        self._ids = {}
+        self._names = []
+        self._nr_names_written = 0
+        self._records = []
+        self._nr_buffered = 0
+        self._index = []
+        self._file = None
+        self._last_chunk = time.time()
+        self._last_fsync = time.time()
+
+        # never overwrite or extend an earlier recording
+        if _segment_paths(prefix):
+            raise IOError('%s is the prefix of an existing recording' % prefix)
+        self._segment_nr = 0
+        self._open_segment()
+
+    def _open_segment(self):
+        self._file = open(segment_path(self._prefix, self._segment_nr), 'wb')
+        self._file.write(_MAGIC)
+        self._index = []
+        # every segment can be read on its own
+        self._nr_names_written = 0
+
+    def _write_chunk(self, tag, payload):
+        if self._nr_names_written < len(self._names):
+            # the names registered since the last chunk, as id -> name
+            new = dict((i, self._names[i]) for i in range(self._nr_names_written, len(self._names)))
+            self._nr_names_written = len(self._names)
+            self._write_chunk('META', json.dumps({'traces': new}))
+        offset = self._file.tell()
+        self._file.write(_CHUNK.pack(tag, len(payload), _crc(payload)))
+        self._file.write(payload)
+        return offset
+
+    def register(self, name):
+        # the id of the trace name in the records
+        if name in self._ids:
+            return self._ids[name]
+        assert len(self._names) < 0xffff
+        self._ids[name] = len(self._names)
+        self._names.append(name)
+        return self._ids[name]
+
+    def meta(self, values):
+        # a dict saved as is, e.g. the start times of the sources
+        self.flush()
+        self._write_chunk('META', json.dumps(values))
+
+    def add(self, trace_id, t, value):
+        self._records.append(_RECORD.pack(trace_id, t, value))
+        self._nr_buffered += 1
+        if self._nr_buffered >= self._chunk_records:
+            self.flush()
+
+    def add_row(self, trace_ids, t, values):
+        # the values of a sample at once, the NaN ones were not sampled
+        present = values == values
+        records = numpy.empty(int(present.sum()), dtype=_RECORD_DTYPE)
+        records['id'] = trace_ids[present]
+        records['t'] = t
+        records['v'] = values[present]
+        self._records.append(records.tostring())
+        self._nr_buffered += len(records)
+        if self._nr_buffered >= self._chunk_records:
+            self.flush()
+
+    def _write_records(self):
+        if not self._nr_buffered:
+            return
+        payload = ''.join(self._records)
+        times = numpy.frombuffer(payload, dtype=_RECORD_DTYPE)['t']
+        if self._codec is not None:
+            offset = self._write_chunk('CDAT', _encode_records(self._codec, payload))
+        else:
+            offset = self._write_chunk('DATA', payload)
+        self._index.append((offset, self._nr_buffered, times.min(), times.max()))
+        self._records = []
+        self._nr_buffered = 0
+        self._last_chunk = time.time()
+
+    def tick(self):
+        # called once per sample, a killed process loses at most the chunk period
+        if self._nr_buffered and time.time() - self._last_chunk >= self._chunk_period:
+            self.flush()
+
+    def flush(self):
+        self._write_records()
+        self._file.flush()
+        if time.time() - self._last_fsync >= self._fsync_period:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.time()
+        if self._file.tell() >= self._segment_size:
+            self._close_segment()
+            self._segment_nr += 1
+            self._open_segment()
+
+    def _close_segment(self):
+        index = ''.join(_INDEX_ENTRY.pack(*entry) for entry in self._index)
+        offset = self._write_chunk('FOOT', index)
+        self._file.write(_TRAILER.pack(offset, _END))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        if self._file is None:
+            return
+        self._write_records()
+        self._close_segment()
+
+
+def _encode_records(codec, payload):
+    # the records of a chunk by trace, a stable sort keeps them in time order
+    records = numpy.frombuffer(payload, dtype=_RECORD_DTYPE)
+    records = records[numpy.argsort(records['id'], kind='mergesort')]
+    ids, starts = numpy.unique(records['id'], return_index=True)
+    ends = list(starts[1:]) + [len(records)]
+    parts = []
+    for trace_id, start, end in zip(ids, starts, ends):
+        block = codec.encode(records['t'][start:end], records['v'][start:end])
+        parts.append(_CODED_TRACE.pack(trace_id, len(block)) + block)
+    return ''.join(parts)
+
+
+def _decode_records(payload):
+    blocks = []
+    pos = 0
+    while pos < len(payload):
+        trace_id, n = _CODED_TRACE.unpack_from(payload, pos)
+        pos = pos + _CODED_TRACE.size
+        times, values = trace_codec.decode(payload[pos:pos + n])
+        pos = pos + n
+        records = numpy.empty(len(times), dtype=_RECORD_DTYPE)
+        records['id'] = trace_id
+        records['t'] = times
+        records['v'] = values
+        blocks.append(records)
+    return blocks
+
+
+def _read_chunks(data):
+    #
+    # the chunks of a segment as (tag, payload), the footer is used when the
+    # segment was closed, otherwise the chunks are scanned until the first one
+    # that is truncated or fails its crc
+    #
+    if not data.startswith(_MAGIC):
+        raise IOError('not a recording segment')
+
+    end = None
+    if len(data) >= len(_MAGIC) + _TRAILER.size:
+        offset, magic = _TRAILER.unpack_from(data, len(data) - _TRAILER.size)
+        if magic == _END and offset < len(data):
+            end = offset
+
+    chunks = []
+    pos = len(_MAGIC)
+    limit = len(data) if end is None else end
+    while pos + _CHUNK.size <= limit:
+        tag, n, crc = _CHUNK.unpack_from(data, pos)
+        payload = data[pos + _CHUNK.size:pos + _CHUNK.size + n]
+        if tag not in ('DATA', 'CDAT', 'META', 'FOOT') or len(payload) != n or _crc(payload) != crc:
+            break
+        if tag != 'FOOT':
+            chunks.append((tag, payload))
+        pos = pos + _CHUNK.size + n
+    return chunks, pos == end
+
+
+def read_recording(prefix):
+    #
+    # returns (traces, meta, complete) where traces maps a name to its (time,
+    # value) arrays, meta merges the META dicts and complete tells whether all
+    # the segments were closed properly
+    #
+    paths = _segment_paths(prefix)
+    if not paths:
+        raise IOError('no segments for %s' % prefix)
+
+    names = {}
+    meta = {}
+    blocks = []
+    complete = True
+    for path in paths:
+        chunks, closed = _read_chunks(open(path, 'rb').read())
+        complete = complete and closed
+        for tag, payload in chunks:
+            if tag == 'META':
+                values = json.loads(payload)
+                for i, name in values.pop('traces', {}).items():
+                    names[int(i)] = str(name)
+                for key, value in values.items():
+                    if isinstance(value, dict) and isinstance(meta.get(key), dict):
+                        meta[key].update(value)
+                    else:
+                        meta[key] = value
+            elif tag == 'CDAT':
+                blocks.extend(_decode_records(payload))
+            else:
+                blocks.append(numpy.frombuffer(payload, dtype=_RECORD_DTYPE))
+
+    if blocks:
+        records = numpy.concatenate(blocks)
+    else:
+        records = numpy.empty(0, dtype=_RECORD_DTYPE)
+
+    # group the records by trace, a stable sort keeps them in time order
+    order = numpy.argsort(records['id'], kind='mergesort')
+    records = records[order]
+    ids = sorted(names.keys())
+    lo = numpy.searchsorted(records['id'], ids, side='left')
+    hi = numpy.searchsorted(records['id'], ids, side='right')
+    traces = {}
+    for i, name in enumerate(names[j] for j in ids):
+        r = records[lo[i]:hi[i]]
+        traces[name] = (numpy.ascontiguousarray(r['t']), numpy.ascontiguousarray(r['v']))
+    return traces, meta, complete
+
+
+def export_recording(prefix, npz_path=None, mat_path=None):
+    traces, meta, complete = read_recording(prefix)
+    if not complete:
+        print "warning: %s was not closed properly, exporting what was recorded" % prefix
+
+    arrays = {}
+    for name, (t, v) in traces.items():
+        arrays[name] = v
+        arrays[name + '_t'] = t
+    for key, value in meta.get('start_time', {}).items():
+        arrays[str(key)] = value
+    # e.g. the statistics of the sampling schedule
+    for key, value in meta.items():
+        if key not in ('start_time', 'timelength', 'period'):
+            arrays[str(key)] = numpy.asarray(value)
+
+    if npz_path is not None:
+        if not npz_path.endswith(".npz"):
+            npz_path = npz_path + ".npz"
+        numpy.savez(npz_path, **arrays)
+
+    if mat_path is not None:
+        if not mat_path.endswith(".mat"):
+            mat_path = mat_path + ".mat"
+        for key in ('timelength', 'period'):
+            if key in meta:
+                arrays[key] = meta[key]
+        mat_writer.save_variables(mat_path, sorted(arrays.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("prefix", help="Prefix of the segment files, as given to server-fetch.py --record")
+    parser.add_argument("-o","--outfile", dest="outfile", default=None, help="Path to the output file (numpy .npz format)")
+    parser.add_argument("-m","--outfile-matlab", dest="outfile_mat", default=None, help="Path to the output file (matlab .mat format)")
+    args = parser.parse_args()
+
+    export_recording(args.prefix, args.outfile, args.outfile_mat)
+    sys.exit(0)
@@ -0,0 +1,222 @@
+#
+# Copyright (c) 2017 Martin Eriksson
+#		2017 Riccardo Lucchese <riccardo.lucchese@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Bounded memory for runs of any length. The rows of a sample block are kept
+# in a ring of the last ones, and summed up in buckets of several periods
+# (10 s, 1 min and 15 min by default) holding the min, max, sum and count of
+# each column. A row updates the newest bucket of each period in place, a
+# bucket is added when a row falls past the end of the newest one, so a row
+# costs the same whatever the length of the run. Each period keeps a ring of
+# its last buckets, a bucket without any row takes no room.
+#
+# A query of a window and a point budget is answered from the finest of the
+# raw rows and the periods that still holds the whole window. When it has more
+# points than the budget its buckets are merged into wider ones, a multiple
+# of its period, down to the budget. So a week asked in 1000 points comes from
+# the 15 min buckets and a day in 1000 points from the 1 min ones merged by 2.
+# The times of a ring are sorted, a window is found with searchsorted.
+#
+
+import numpy
+
+PERIODS = (10., 60., 900.)  # [sec]
+_RAW_CAPACITY = 3*3600      # rows, 3 hours at 1 Hz
+_CAPACITY = 8640            # buckets of each period, a day of 10 s and 90 days of 15 min
+
+
+class _ring(object):
+    #
+    # the last capacity rows of some (capacity, nr. of columns) arrays and
+    # their times, the rows are pushed in time order
+    #
+    def __init__(self, capacity, nr_columns, fields):
+        assert capacity > 0
+        self.times = numpy.empty(capacity)
+        self.fields = dict((name, numpy.empty((capacity, nr_columns), dtype=dtype)) for name, dtype in fields)
+        self._capacity = capacity
+        self._n = 0             # rows ever pushed
+
+    def __len__(self):
+        return min(self._n, self._capacity)
+
+    def push(self, time):
+        # the slot of a new row, the oldest one is overwritten when full
+        slot = self._n % self._capacity
+        self._n += 1
+        self.times[slot] = time
+        return slot
+
+    def is_complete(self):
+        # no row was overwritten yet
+        return self._n <= self._capacity
+
+    def get_oldest_time(self):
+        if not self._n:
+            return None
+        return self.times[self._n % self._capacity if self._n > self._capacity else 0]
+
+    def _segments(self):
+        # the slots oldest first, as one or two slices
+        if self._n <= self._capacity:
+            return [slice(0, self._n)]
+        head = self._n % self._capacity
+        return [slice(head, self._capacity), slice(0, head)]
+
+    def _window(self, t0, t1):
+        # the slices of the rows with t0 <= time <= t1, oldest first
+        parts = []
+        for segment in self._segments():
+            times = self.times[segment]
+            first = segment.start + times.searchsorted(t0, 'left')
+            last = segment.start + times.searchsorted(t1, 'right')
+            if last > first:
+                parts.append(slice(first, last))
+        return parts
+
+    def count(self, t0, t1):
+        return sum(part.stop - part.start for part in self._window(t0, t1))
+
+    def get(self, t0, t1, column):
+        # the times and the values of a column of the rows in the window, copies
+        parts = self._window(t0, t1)
+        times = numpy.concatenate([self.times[part] for part in parts] + [numpy.empty(0)])
+        fields = {}
+        for name, values in self.fields.items():
+            fields[name] = numpy.concatenate([values[part, column] for part in parts] +
+                                             [numpy.empty(0, dtype=values.dtype)])
+        return times, fields
+
+    def get_nbytes(self):
+        return self.times.nbytes + sum(values.nbytes for values in self.fields.values())
+
+
+class rollup_level(object):
+    # the buckets of one period, the time of a bucket is its start
+    def __init__(self, period, capacity, nr_columns):
+        assert period > 0
+        self.period = float(period)
+        self.ring = _ring(capacity, nr_columns, [('min', float), ('max', float), ('sum', float),
+                                                 ('count', numpy.int32)])
+        self._min = self.ring.fields['min']
+        self._max = self.ring.fields['max']
+        self._sum = self.ring.fields['sum']
+        self._count = self.ring.fields['count']
+        self._start = None
+        self._slot = None
+
+    def add(self, time, values, present):
+        start = numpy.floor(time/self.period)*self.period
+        if self._start is None or start > self._start:
+            slot = self.ring.push(start)
+            self._min[slot] = numpy.inf
+            self._max[slot] = -numpy.inf
+            self._sum[slot] = 0.
+            self._count[slot] = 0
+            self._start = start
+            self._slot = slot
+        # a late row goes to the newest bucket, fmin and fmax skip the NaN
+        slot = self._slot
+        numpy.fmin(self._min[slot], values, out=self._min[slot])
+        numpy.fmax(self._max[slot], values, out=self._max[slot])
+        numpy.add(self._sum[slot], values, out=self._sum[slot], where=present)
+        self._count[slot] += present
+
+
+def _merge(times, mins, maxs, sums, counts, width):
+    # the buckets merged into buckets of width [sec]
+    keys = numpy.floor(times/width)
+    starts = numpy.flatnonzero(numpy.concatenate([[True], keys[1:] != keys[:-1]]))
+    return (keys[starts]*width, numpy.minimum.reduceat(mins, starts), numpy.maximum.reduceat(maxs, starts),
+            numpy.add.reduceat(sums, starts), numpy.add.reduceat(counts, starts))
+
+
+class trace_rollup(object):
+    def __init__(self, nr_columns, periods=PERIODS, raw_capacity=_RAW_CAPACITY, capacity=_CAPACITY):
+        assert nr_columns > 0
+        self._raw = _ring(raw_capacity, nr_columns, [('value', float)])
+        self._raw_values = self._raw.fields['value']
+        self._levels = [rollup_level(period, capacity, nr_columns) for period in sorted(periods)]
+
+    def get_periods(self):
+        return [level.period for level in self._levels]
+
+    def add(self, time, values):
+        # a row of the block, NaN where a column is missing
+        slot = self._raw.push(time)
+        self._raw_values[slot] = values
+        present = values == values
+        for level in self._levels:
+            level.add(time, values, present)
+
+    def _choose(self, t0, t1, max_points):
+        #
+        # (period, ring) of the resolution to merge down to the budget, 0 for
+        # the raw rows: the one holding the window before the first that
+        # holds it in the budget, which is taken when there is none. The
+        # coarsest of all when none holds the window
+        #
+        candidates = [(0., self._raw)] + [(level.period, level.ring) for level in self._levels]
+        holding = None
+        for period, ring in candidates:
+            oldest = ring.get_oldest_time()
+            if ring.is_complete() or (oldest is not None and oldest <= t0):
+                if ring.count(t0, t1) <= max_points:
+                    return holding or (period, ring)
+                holding = (period, ring)
+        return holding or candidates[-1]
+
+    def query(self, column, t0=None, t1=None, max_points=1000):
+        #
+        # (resolution [sec], times, mins, maxs, means, counts) of a column in
+        # t0 <= time <= t1, at most max_points of them. A resolution of 0 is
+        # the raw rows, their min, max and mean are the value. The buckets
+        # where the column was always missing are left out
+        #
+        assert max_points > 0
+        if t0 is None:
+            t0 = -numpy.inf
+        if t1 is None:
+            t1 = numpy.inf
+        period, ring = self._choose(t0, t1, max_points)
+        times, fields = ring.get(t0, t1, column)
+        if period == 0:
+            values = fields['value']
+            present = values == values
+            times, mins = times[present], values[present]
+            maxs, sums, counts = mins, mins, numpy.ones(len(mins), dtype=numpy.int32)
+        else:
+            present = fields['count'] > 0
+            times, mins, maxs, sums, counts = times[present], fields['min'][present], fields['max'][present], \
+                fields['sum'][present], fields['count'][present]
+        if len(times) > max_points:
+            # the raw rows are merged into multiples of a decimal step
+            span = (times[-1] - times[0])/max_points
+            step = period or (10**numpy.floor(numpy.log10(span))/10 if span > 0 else 1.)
+            k = max(1, int(numpy.ceil(span/step)))
+            while True:
+                merged = _merge(times, mins, maxs, sums, counts, k*step)
+                if len(merged[0]) <= max_points:
+                    break
+                k += 1
+            period = k*step
+            times, mins, maxs, sums, counts = merged
+        return period, times, mins, maxs, sums/numpy.maximum(counts, 1), counts
+
+    def get_nbytes(self):
+        return self._raw.get_nbytes() + sum(level.ring.get_nbytes() for level in self._levels)